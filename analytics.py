@@ -25,8 +25,24 @@ from sqlalchemy.sql import text
 from models import User, PortfolioItem, PortfolioComment, UserActivity, PortfolioLike, CommentLike, Visitor, PageVisit
 from database import db
 from restricted_actions import admin_required
-import user_agents  # لتحليل معلومات المتصفح
+from ua_classifier import classify_user_agent, get_cache_stats as get_ua_cache_stats
 from telegram_service import send_telegram_message, format_visit_notification
+from telegram_dispatcher import telegram_dispatcher
+from telegram_digest import telegram_digest, EVENT_VISITOR
+from mail_dispatcher import mail_dispatcher
+from analytics_rollup import analytics_rollup, get_daily_series, get_hourly_series
+from time_buckets import aggregate_buckets, count_if
+from analytics_cache import analytics_cache
+from unique_sketches import sketch_store, SCOPE_VISITORS
+from retention import retention_job
+from content_snapshot import content_snapshot
+from page_cache import page_cache
+from portfolio_tags import category_cache
+from portfolio_search import search_index
+from view_dedup import view_dedup
+from visit_tracking import visit_tracker
+from tracking_filter import tracking_filter
+from visitor_cache import visitor_identity_cache, find_visitor_by_session, find_visitor_by_ip, remember_visitor
 
 # إنشاء blueprint للتعامل مع مسارات الإحصائيات
 analytics = Blueprint('analytics', __name__)
@@ -38,28 +54,9 @@ def dashboard():
     import logging
     logging.debug("Entered analytics.dashboard function")
     logging.info(f"User {current_user.username} (id: {current_user.id}) accessing analytics dashboard")
-    # الحصول على الإحصائيات الإجمالية
-    try:
-        likes_count = PortfolioLike.query.count()
-    except:
-        likes_count = 0
-        
-    try:
-        comment_likes = CommentLike.query.count()
-    except:
-        comment_likes = 0
-        
-    try:
-        comments_count = PortfolioComment.query.count()
-    except:
-        comments_count = 0
-    
-    total_stats = {
-        'views': get_total_views(),
-        'likes': likes_count + comment_likes,
-        'comments': comments_count,
-        'users': User.query.count()
-    }
+    # الإحصائيات الإجمالية وبيانات الرسوم البيانية (من الذاكرة المؤقتة)
+    summary = analytics_cache.get('dashboard', get_dashboard_summary)
+    total_stats = summary['total_stats']
     
     # الحصول على أكثر المشاريع مشاهدة
     top_projects = PortfolioItem.query.order_by(
@@ -71,8 +68,7 @@ def dashboard():
         UserActivity.created_at.desc()
     ).limit(10).all()
     
-    # توليد بيانات الرسوم البيانية
-    chart_data = generate_chart_data(days=30)
+    chart_data = summary['chart_data']
     
     # إضافة تاريخ ووقت التحديث
     date_time = datetime.now().strftime('%Y-%m-%d %H:%M')
@@ -91,7 +87,7 @@ def dashboard():
 def portfolio_stats_api():
     """واجهة برمجية لإحصائيات المشاريع - للمدير فقط"""
     days = request.args.get('days', type=int)
-    stats = get_portfolio_stats(days)
+    stats = analytics_cache.get(f'portfolio:{days}', lambda: get_portfolio_stats(days))
     return jsonify(stats)
 
 @analytics.route('/activity')
@@ -99,7 +95,7 @@ def portfolio_stats_api():
 def activity_stats_api():
     """واجهة برمجية لإحصائيات النشاطات - للمدير فقط"""
     days = request.args.get('days', type=int)
-    stats = get_activity_stats(days)
+    stats = analytics_cache.get(f'activity:{days}', lambda: get_activity_stats(days))
     return jsonify(stats)
 
 @analytics.route('/users')
@@ -115,47 +111,16 @@ def user_stats_api():
 def chart_data_api():
     """واجهة برمجية لبيانات الرسوم البيانية - للمدير فقط"""
     days = request.args.get('days', type=int, default=30)
-    chart_data = generate_chart_data(days)
-    
-    # إحصائيات إجمالية
-    total_stats = {
-        'views': get_total_views(days),
-        'likes': get_total_likes(days),
-        'comments': get_total_comments(days),
-        'users': get_total_users(days)
-    }
-    
-    # أكثر المشاريع مشاهدة
-    top_projects_query = PortfolioItem.query
-    
-    if days:
-        date_filter = datetime.now() - timedelta(days=days)
-        # نحتاج إلى تحسين هذا الاستعلام ليعكس المشاهدات والإعجابات في الفترة المحددة
-        # هذا يتطلب تعديلًا في هيكل قاعدة البيانات ليتضمن تواريخ للعدادات
-        top_projects_query = top_projects_query.filter(
-            PortfolioItem.created_at >= date_filter
-        )
-    
-    top_projects = top_projects_query.order_by(
-        PortfolioItem.views_count.desc()
-    ).limit(10).all()
-    
-    # تحويل النتائج إلى JSON
-    top_projects_json = []
-    for item in top_projects:
-        top_projects_json.append({
-            'id': item.id,
-            'title': item.title,
-            'views_count': item.views_count,
-            'likes_count': item.likes_count,
-            'comments_count': PortfolioComment.query.filter_by(portfolio_id=item.id).count()
-        })
-    
-    return jsonify({
-        'chart_data': chart_data,
-        'total_stats': total_stats,
-        'top_projects': top_projects_json
-    })
+    return jsonify(analytics_cache.get(f'data:{days}', lambda: get_chart_payload(days)))
+
+@analytics.route('/data/hourly')
+@admin_required
+def hourly_chart_data_api():
+    """واجهة برمجية لبيانات الرسوم البيانية الساعية (آخر 24 ساعة افتراضيًا) - للمدير فقط"""
+    hours = min(request.args.get('hours', type=int, default=24), 24 * 7)
+    labels, series = get_hourly_series(hours)
+    series['labels'] = labels
+    return jsonify({'chart_data': series})
 
 @analytics.route('/activity-list')
 @admin_required
@@ -204,9 +169,10 @@ def user_activity(user_id):
 def visitors_dashboard():
     """لوحة تحكم إحصائيات الزوار - للمدير فقط"""
     days = request.args.get('days', 30, type=int)
+    exact = request.args.get('exact', '0') == '1'
     
-    # الحصول على إحصائيات الزوار
-    stats = get_visitor_stats(days)
+    # الحصول على إحصائيات الزوار (نفس النتيجة المحفوظة لواجهة /visitors/data)
+    stats = analytics_cache.get(f'visitors:{days}:{int(exact)}', lambda: get_visitor_stats(days, exact))
     
     # الحصول على قائمة الزوار الأخيرة
     latest_visitors = Visitor.query.order_by(
@@ -229,7 +195,8 @@ def visitors_dashboard():
 def visitors_data_api():
     """واجهة برمجية لبيانات الزوار - للمدير فقط"""
     days = request.args.get('days', 30, type=int)
-    stats = get_visitor_stats(days)
+    exact = request.args.get('exact', '0') == '1'
+    stats = analytics_cache.get(f'visitors:{days}:{int(exact)}', lambda: get_visitor_stats(days, exact))
     return jsonify(stats)
     
 @analytics.route('/visitors/<int:visitor_id>')
@@ -323,8 +290,105 @@ def api_page_visits():
     
     return jsonify({'visits': visits_data})
 
+@analytics.route('/tracking/stats')
+@admin_required
+def tracking_stats_api():
+    """واجهة برمجية لمراقبة طابور تتبع الزيارات - للمدير فقط"""
+    stats = visit_tracker.get_stats()
+    stats['visitor_cache'] = visitor_identity_cache.get_stats()
+    stats['ua_cache'] = get_ua_cache_stats()
+    stats['filter'] = tracking_filter.get_stats()
+    stats['telegram'] = telegram_dispatcher.get_stats()
+    stats['telegram_digest'] = telegram_digest.get_stats()
+    stats['mail'] = mail_dispatcher.get_stats()
+    stats['rollup'] = analytics_rollup.get_stats()
+    stats['analytics_cache'] = analytics_cache.get_stats()
+    stats['unique_sketches'] = sketch_store.get_stats()
+    stats['retention'] = retention_job.get_stats()
+    stats['content_snapshot'] = content_snapshot.get_stats()
+    stats['page_cache'] = page_cache.get_stats()
+    stats['categories'] = category_cache.get_stats()
+    stats['portfolio_search'] = search_index.get_stats()
+    stats['view_dedup'] = view_dedup.get_stats()
+    return jsonify(stats)
+
 # الوظائف المساعدة
 
+def get_dashboard_summary():
+    """الإحصائيات الإجمالية وبيانات الرسوم البيانية للوحة الإحصائيات"""
+    # الحصول على الإحصائيات الإجمالية
+    try:
+        likes_count = PortfolioLike.query.count()
+    except:
+        likes_count = 0
+        
+    try:
+        comment_likes = CommentLike.query.count()
+    except:
+        comment_likes = 0
+        
+    try:
+        comments_count = PortfolioComment.query.count()
+    except:
+        comments_count = 0
+    
+    total_stats = {
+        'views': get_total_views(),
+        'likes': likes_count + comment_likes,
+        'comments': comments_count,
+        'users': User.query.count()
+    }
+    
+    # توليد بيانات الرسوم البيانية
+    return {
+        'total_stats': total_stats,
+        'chart_data': generate_chart_data(days=30)
+    }
+
+def get_chart_payload(days):
+    """بيانات واجهة الرسوم البيانية: السلاسل اليومية والإجماليات وأكثر المشاريع مشاهدة"""
+    chart_data = generate_chart_data(days)
+    
+    # إحصائيات إجمالية
+    total_stats = {
+        'views': get_total_views(days),
+        'likes': get_total_likes(days),
+        'comments': get_total_comments(days),
+        'users': get_total_users(days)
+    }
+    
+    # أكثر المشاريع مشاهدة
+    top_projects_query = PortfolioItem.query
+    
+    if days:
+        date_filter = datetime.now() - timedelta(days=days)
+        # نحتاج إلى تحسين هذا الاستعلام ليعكس المشاهدات والإعجابات في الفترة المحددة
+        # هذا يتطلب تعديلًا في هيكل قاعدة البيانات ليتضمن تواريخ للعدادات
+        top_projects_query = top_projects_query.filter(
+            PortfolioItem.created_at >= date_filter
+        )
+    
+    top_projects = top_projects_query.order_by(
+        PortfolioItem.views_count.desc()
+    ).limit(10).all()
+    
+    # تحويل النتائج إلى JSON
+    top_projects_json = []
+    for item in top_projects:
+        top_projects_json.append({
+            'id': item.id,
+            'title': item.title,
+            'views_count': item.views_count,
+            'likes_count': item.likes_count,
+            'comments_count': item.comments_count
+        })
+    
+    return {
+        'chart_data': chart_data,
+        'total_stats': total_stats,
+        'top_projects': top_projects_json
+    }
+
 def get_total_views(days=None):
     """الحصول على مجموع المشاهدات لجميع المشاريع"""
     if days:
@@ -395,7 +459,7 @@ def get_portfolio_stats(days=None):
         PortfolioItem.id,
         PortfolioItem.title,
         PortfolioItem.views_count,
-        PortfolioItem.likes_count,
+        PortfolioItem.likes_count_value.label('likes_count'),
         func.count(PortfolioComment.id).label('comments_count')
     ).outerjoin(
         PortfolioComment, PortfolioComment.portfolio_id == PortfolioItem.id
@@ -479,97 +543,52 @@ def get_user_stats(days=None):
     }
 
 def generate_chart_data(days=30):
-    """توليد بيانات الرسوم البيانية"""
-    # تحديد الفترة الزمنية
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
-    
-    # توليد التواريخ
-    dates = []
-    current_date = start_date
-    while current_date <= end_date:
-        dates.append(current_date.strftime('%Y-%m-%d'))
-        current_date += timedelta(days=1)
-    
-    # بيانات المشاهدات
-    views_data = []
-    for date in dates:
-        date_obj = datetime.strptime(date, '%Y-%m-%d')
-        next_date = date_obj + timedelta(days=1)
-        
-        # احتساب عدد النشاطات من نوع view في هذا اليوم
-        views_count = UserActivity.query.filter(
-            UserActivity.activity_type.like('view%'),
-            UserActivity.created_at >= date_obj,
-            UserActivity.created_at < next_date
-        ).count()
-        
-        views_data.append(views_count)
-    
-    # بيانات الإعجابات
-    likes_data = []
-    for date in dates:
-        date_obj = datetime.strptime(date, '%Y-%m-%d')
-        next_date = date_obj + timedelta(days=1)
-        
-        # احتساب عدد النشاطات من نوع like في هذا اليوم
-        likes_count = UserActivity.query.filter(
-            UserActivity.activity_type.like('like%'),
-            UserActivity.created_at >= date_obj,
-            UserActivity.created_at < next_date
-        ).count()
-        
-        likes_data.append(likes_count)
-    
-    # بيانات التعليقات
-    comments_data = []
-    for date in dates:
-        date_obj = datetime.strptime(date, '%Y-%m-%d')
-        next_date = date_obj + timedelta(days=1)
-        
-        # احتساب عدد النشاطات من نوع comment في هذا اليوم
-        comments_count = UserActivity.query.filter(
-            UserActivity.activity_type.like('comment%'),
-            UserActivity.created_at >= date_obj,
-            UserActivity.created_at < next_date
-        ).count()
-        
-        comments_data.append(comments_count)
+    """
+    توليد بيانات الرسوم البيانية
+    من جدول التجميع اليومي إذا كان مفعلاً، وإلا باستعلام GROUP BY واحد على النشاطات وآخر على زيارات الصفحات
+    """
+    if analytics_rollup.enabled:
+        dates, series = get_daily_series(days)
+    else:
+        start_date = datetime.now() - timedelta(days=days)
+        dates, series = aggregate_buckets(UserActivity.created_at, {
+            'views': count_if(UserActivity.activity_type.like('view%')),
+            'likes': count_if(UserActivity.activity_type.like('like%')),
+            'comments': count_if(UserActivity.activity_type.like('comment%'))
+        }, start=start_date)
+        _, visits_series = aggregate_buckets(PageVisit.visited_at, {
+            'page_visits': func.count(PageVisit.id),
+            'unique_visitors': func.count(func.distinct(PageVisit.visitor_id))
+        }, start=start_date)
+        series.update(visits_series)
     
     # تجميع البيانات
     chart_data = {
         'labels': dates,
-        'views': views_data,
-        'likes': likes_data,
-        'comments': comments_data
+        'views': series['views'],
+        'likes': series['likes'],
+        'comments': series['comments'],
+        'page_visits': series['page_visits'],
+        'unique_visitors': series['unique_visitors']
     }
     
     return chart_data
     
 # وظائف تتبع الزوار
 
-def track_visitor(request):
-    """تتبع زائر جديد أو تحديث بيانات زائر موجود"""
-    from user_agents import parse  # استيراد داخلي لتجنب مشاكل دورة الاستيراد
-    import logging
-    
-    logging.debug("Starting visitor tracking")
-    
-    # الحصول على عنوان IP الحقيقي للزائر (مع مراعاة وجود بروكسي)
+def _get_client_ip(request):
+    """الحصول على عنوان IP الحقيقي للزائر (مع مراعاة وجود بروكسي)"""
     ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
     if ip_address:
         # إذا كان العنوان يحتوي على عناوين متعددة، نأخذ الأول
         ip_address = ip_address.split(',')[0].strip()
-    
-    # معلومات عن المتصفح
-    user_agent_string = request.headers.get('User-Agent', '')
-    user_agent = parse(user_agent_string)
-    
-    logging.debug(f"Visitor info - IP: {ip_address}, UA: {user_agent_string}")
-    
-    # معلومات إضافية
-    referrer = request.headers.get('Referer', '')
-    
+    return ip_address
+
+def build_visit_event(request):
+    """
+    استخراج بيانات الزيارة من الطلب الحالي في قاموس خفيف
+    يمكن معالجته لاحقًا خارج دورة الطلب (بدون الحاجة إلى request أو current_user)
+    """
     # استخدام Flask session بدلاً من قراءة الكوكيز مباشرة
     try:
         session_id = session.get('session_id', '')
@@ -577,29 +596,47 @@ def track_visitor(request):
         logging.warning(f"Error getting session_id: {str(e)}")
         session_id = request.cookies.get('session', '')
     
-    # التحقق من وجود الزائر
+    is_authenticated = current_user.is_authenticated
+    
+    return {
+        'ip_address': _get_client_ip(request),
+        'user_agent': request.headers.get('User-Agent', ''),
+        'referrer': request.headers.get('Referer', ''),
+        'session_id': session_id,
+        'user_id': current_user.id if is_authenticated else None,
+        'username': current_user.username if is_authenticated else None,
+        'page_url': request.path,
+        'page_title': request.args.get('page_title', ''),
+        'visited_at': datetime.now()
+    }
+
+def upsert_visitor(event):
+    """
+    إنشاء زائر جديد أو تحديث بيانات زائر موجود انطلاقًا من حدث زيارة (بدون حفظ)
+    
+    Returns:
+        tuple: (الزائر, هل هو زائر جديد)
+    """
+    ip_address = event.get('ip_address')
+    session_id = event.get('session_id')
+    user_agent_string = event.get('user_agent', '')
+    user_agent = classify_user_agent(user_agent_string)
+    
+    logging.debug(f"Visitor info - IP: {ip_address}, UA: {user_agent_string}")
+    
+    # التحقق من وجود الزائر (مع استخدام ذاكرة الهوية المؤقتة لتجنب استعلامات البحث)
     visitor = None
     
+    # البحث بعنوان IP فقط إذا كان ليس خاصًا (مثل localhost)
+    ip_is_public = bool(ip_address) and not Visitor.is_ip_anonymous(ip_address)
+    
     # تحقق أولاً باستخدام session_id (للزوار المتكررين)
     if session_id:
-        visitor = Visitor.query.filter_by(session_id=session_id).first()
+        visitor = find_visitor_by_session(session_id)
     
     # إذا لم نجد الزائر بمعرف الجلسة، نبحث عنه بعنوان IP
-    if not visitor and ip_address:
-        # البحث فقط إذا كان IP ليس خاصًا (مثل localhost)
-        if not Visitor.is_ip_anonymous(ip_address):
-            visitor = Visitor.query.filter_by(ip_address=ip_address).first()
-    
-    # استخراج معلومات الجهاز من وكيل المستخدم
-    device_type = 'unknown'
-    if user_agent.is_mobile:
-        device_type = 'mobile'
-    elif user_agent.is_tablet:
-        device_type = 'tablet'
-    elif user_agent.is_pc:
-        device_type = 'desktop'
-    elif user_agent.is_bot:
-        device_type = 'bot'
+    if not visitor and ip_is_public:
+        visitor = find_visitor_by_ip(ip_address)
     
     # إنشاء زائر جديد إذا لم يكن موجودًا
     is_new_visitor = False
@@ -608,146 +645,193 @@ def track_visitor(request):
         visitor = Visitor(
             ip_address=ip_address,
             user_agent=user_agent_string,
-            referrer=referrer,
-            browser=user_agent.browser.family,
-            os=user_agent.os.family,
-            device=device_type,
+            referrer=event.get('referrer', ''),
+            browser=user_agent.browser,
+            os=user_agent.os,
+            device=user_agent.device,
             session_id=session_id,
             is_bot=user_agent.is_bot,
+            first_visit=event.get('visited_at'),
+            last_visit=event.get('visited_at'),
             # إذا كان المستخدم مسجلاً، نربط الزائر بحسابه
-            user_id=current_user.id if current_user.is_authenticated else None
+            user_id=event.get('user_id')
         )
         db.session.add(visitor)
+        db.session.flush()  # لإنشاء معرف للزائر الجديد
+        remember_visitor(visitor, session_id=session_id, ip_address=ip_address if ip_is_public else None)
     else:
         # تحديث بيانات الزائر الموجود
         visitor.update_visit()
+        if event.get('visited_at'):
+            visitor.last_visit = event['visited_at']
         visitor.user_agent = user_agent_string
-        visitor.referrer = referrer
-        visitor.browser = user_agent.browser.family
-        visitor.os = user_agent.os.family
-        visitor.device = device_type
+        visitor.referrer = event.get('referrer', '')
+        visitor.browser = user_agent.browser
+        visitor.os = user_agent.os
+        visitor.device = user_agent.device
         # تحديث معرف المستخدم إذا قام بتسجيل الدخول
-        if current_user.is_authenticated and not visitor.user_id:
-            visitor.user_id = current_user.id
+        if event.get('user_id') and not visitor.user_id:
+            visitor.user_id = event.get('user_id')
     
-    # حفظ التغييرات
-    db.session.commit()
+    return visitor, is_new_visitor
+
+def notify_new_visitor(visitor, event):
+    """إرسال إشعار عن زائر جديد عبر تلغرام"""
+    ip_address = event.get('ip_address')
+    if visitor.is_bot or Visitor.is_ip_anonymous(ip_address):
+        return
     
-    # إرسال إشعار عن زائر جديد عبر تلغرام
-    if is_new_visitor and not visitor.is_bot and not Visitor.is_ip_anonymous(ip_address):
-        try:
-            visitor_name = f"المستخدم {current_user.username}" if current_user.is_authenticated else "زائر جديد"
-            notification_message = format_visit_notification(visitor_name, "الصفحة الرئيسية", ip_address, user_agent_string)
-            send_telegram_message(notification_message)
-            logging.info(f"Sent Telegram notification for new visitor: {visitor.id} from IP: {ip_address}")
-        except Exception as e:
-            logging.error(f"Failed to send Telegram notification for new visitor: {str(e)}")
+    # في وضع الملخص يضاف الزائر إلى الملخص الدوري بدلاً من رسالة منفصلة
+    if telegram_digest.record(EVENT_VISITOR, referrer=event.get('referrer')):
+        return
     
-    return visitor
+    try:
+        visitor_name = f"المستخدم {event['username']}" if event.get('username') else "زائر جديد"
+        notification_message = format_visit_notification(visitor_name, "الصفحة الرئيسية", ip_address, event.get('user_agent', ''))
+        send_telegram_message(notification_message)
+        logging.info(f"Sent Telegram notification for new visitor: {visitor.id} from IP: {ip_address}")
+    except Exception as e:
+        logging.error(f"Failed to send Telegram notification for new visitor: {str(e)}")
 
-def track_page_visit(visitor, request):
-    """تسجيل زيارة صفحة"""
-    import logging
-    
-    page_url = request.path
-    page_title = request.args.get('page_title', '')
+def add_page_visit(visitor, event):
+    """إضافة سجل زيارة صفحة للزائر (بدون حفظ)"""
+    page_url = event.get('page_url')
+    page_title = event.get('page_title', '')
     
     logging.debug(f"Tracking page visit - URL: {page_url}, Title: {page_title}, Visitor ID: {visitor.id}")
     
-    # إنشاء سجل زيارة جديد
+    # تعليم صفحة الخروج السابقة كغير خروج
+    if visitor.last_page_visit_id:
+        # تحديث سجل واحد بالمفتاح الأساسي بدلاً من تحميل كل الزيارات
+        PageVisit.query.filter(
+            PageVisit.id == visitor.last_page_visit_id
+        ).update({PageVisit.exit_page: False})
+    else:
+        # زائر قديم بدون مؤشر: تحديث جماعي واحد لإزالة أي علامات خروج متبقية
+        PageVisit.query.filter(
+            PageVisit.visitor_id == visitor.id,
+            PageVisit.exit_page == True
+        ).update({PageVisit.exit_page: False})
+    
+    # إنشاء سجل زيارة جديد واعتباره صفحة الخروج مبدئيًا
     page_visit = PageVisit(
         visitor_id=visitor.id,
         page_url=page_url,
-        page_title=page_title
+        page_title=page_title,
+        visited_at=event.get('visited_at'),
+        exit_page=True
     )
     
-    # تعليم زيارات الصفحة السابقة كغير خروج
-    previous_visits = PageVisit.query.filter_by(
-        visitor_id=visitor.id,
-        exit_page=True
-    ).all()
+    db.session.add(page_visit)
+    db.session.flush()  # للحصول على معرف الزيارة
+    visitor.last_page_visit_id = page_visit.id
+    
+    return page_visit
+
+def track_visitor(request):
+    """تتبع زائر جديد أو تحديث بيانات زائر موجود"""
+    logging.debug("Starting visitor tracking")
     
-    for visit in previous_visits:
-        visit.exit_page = False
+    event = build_visit_event(request)
+    visitor, is_new_visitor = upsert_visitor(event)
+    
+    # حفظ التغييرات
+    db.session.commit()
     
-    # اعتبار هذه الزيارة هي صفحة الخروج مبدئيًا
-    page_visit.exit_page = True
+    if is_new_visitor:
+        notify_new_visitor(visitor, event)
+    
+    return visitor
+
+def track_page_visit(visitor, request):
+    """تسجيل زيارة صفحة"""
+    page_visit = add_page_visit(visitor, {
+        'page_url': request.path,
+        'page_title': request.args.get('page_title', ''),
+        'visited_at': datetime.now()
+    })
     
     # حفظ البيانات
-    db.session.add(page_visit)
     db.session.commit()
     
     return page_visit
 
-def get_visitor_stats(days=None):
-    """إحصائيات الزوار"""
+def get_visitor_stats(days=None, exact=False):
+    """
+    إحصائيات الزوار
+    
+    Args:
+        days (int, optional): عدد الأيام (الافتراضي: كل الفترة)
+        exact (bool): عدّ الزوار الفريدين بـ COUNT(DISTINCT) بدلاً من تقدير مخططات HyperLogLog
+    """
     # تحديد الفترة الزمنية
     date_filter = None
     if days:
         date_filter = datetime.now() - timedelta(days=days)
+    exact = exact or not sketch_store.enabled
     
-    # إجمالي عدد الزوار
-    visitors_query = db.session.query(Visitor)
+    # إجمالي عدد الزوار وعدد الزوار المميزين (غير البوتات) في مسح واحد
+    visitors_query = db.session.query(
+        func.count(Visitor.id),
+        count_if(Visitor.is_bot == False)
+    )
     if date_filter:
         visitors_query = visitors_query.filter(Visitor.first_visit >= date_filter)
-    total_visitors = visitors_query.count()
-    
-    # عدد الزوار المميزين (غير البوتات)
-    non_bot_visitors_query = visitors_query.filter(Visitor.is_bot == False)
-    non_bot_visitors = non_bot_visitors_query.count()
+    total_visitors, non_bot_visitors = visitors_query.one()
+    non_bot_visitors = int(non_bot_visitors or 0)
     
     # عدد مشاهدات الصفحات
-    page_views_query = db.session.query(PageVisit)
+    page_views_query = db.session.query(func.count(PageVisit.id))
     if date_filter:
         page_views_query = page_views_query.filter(PageVisit.visited_at >= date_filter)
-    total_page_views = page_views_query.count()
+    total_page_views = page_views_query.scalar() or 0
     
     # متوسط عدد الصفحات لكل زائر
     pages_per_visitor = 0
     if non_bot_visitors > 0:
         pages_per_visitor = round(total_page_views / non_bot_visitors, 2)
     
-    # تصنيف الزوار حسب الأجهزة
+    # تصنيف الزوار حسب الجهاز والمتصفح ونظام التشغيل من GROUP BY واحد (عدد التركيبات صغير)
     devices_stats = {}
-    devices = db.session.query(
-        Visitor.device,
-        func.count(Visitor.id).label('count')
-    ).group_by(Visitor.device)
-    
-    if date_filter:
-        devices = devices.filter(Visitor.first_visit >= date_filter)
-    
-    for device in devices.all():
-        device_name = device.device or 'unknown'
-        devices_stats[device_name] = device.count
-    
-    # تصنيف الزوار حسب المتصفح
     browser_stats = {}
-    browsers = db.session.query(
-        Visitor.browser,
-        func.count(Visitor.id).label('count')
-    ).group_by(Visitor.browser)
-    
-    if date_filter:
-        browsers = browsers.filter(Visitor.first_visit >= date_filter)
-    
-    for browser in browsers.all():
-        browser_name = browser.browser or 'unknown'
-        browser_stats[browser_name] = browser.count
-    
-    # تصنيف الزوار حسب نظام التشغيل
     os_stats = {}
-    operating_systems = db.session.query(
+    breakdown = db.session.query(
+        Visitor.device,
+        Visitor.browser,
         Visitor.os,
         func.count(Visitor.id).label('count')
-    ).group_by(Visitor.os)
+    ).group_by(Visitor.device, Visitor.browser, Visitor.os)
     
     if date_filter:
-        operating_systems = operating_systems.filter(Visitor.first_visit >= date_filter)
-    
-    for os in operating_systems.all():
-        os_name = os.os or 'unknown'
-        os_stats[os_name] = os.count
+        breakdown = breakdown.filter(Visitor.first_visit >= date_filter)
+    
+    for device, browser, os_name, count in breakdown.all():
+        device = device or 'unknown'
+        browser = browser or 'unknown'
+        os_name = os_name or 'unknown'
+        devices_stats[device] = devices_stats.get(device, 0) + count
+        browser_stats[browser] = browser_stats.get(browser, 0) + count
+        os_stats[os_name] = os_stats.get(os_name, 0) + count
+    
+    # الزيارات لكل يوم (استعلام GROUP BY واحد، 30 يومًا إذا لم تحدد الفترة)، والزوار الفريدون
+    # لكل يوم وللفترة كلها من مخططات HyperLogLog (أو COUNT DISTINCT عند طلب العد الدقيق)
+    daily_start = date_filter or datetime.now() - timedelta(days=30)
+    daily_aggregates = {'page_views': func.count(PageVisit.id)}
+    if exact:
+        daily_aggregates['visitors'] = func.count(func.distinct(PageVisit.visitor_id))
+    daily_labels, daily_series = aggregate_buckets(PageVisit.visited_at, daily_aggregates, start=daily_start)
+    
+    if exact:
+        unique_query = db.session.query(func.count(func.distinct(PageVisit.visitor_id)))
+        if date_filter:
+            unique_query = unique_query.filter(PageVisit.visited_at >= date_filter)
+        unique_visitors = unique_query.scalar() or 0
+    else:
+        _, daily_series['visitors'] = sketch_store.daily_counts(
+            SCOPE_VISITORS, daily_start.date(), datetime.now().date()
+        )
+        unique_start = date_filter.date() if date_filter else datetime.min.date()
+        unique_visitors = sketch_store.estimate(SCOPE_VISITORS, unique_start, datetime.now().date())
     
     # الصفحات الأكثر زيارة
     top_pages = db.session.query(
@@ -775,8 +859,15 @@ def get_visitor_stats(days=None):
         'non_bot_visitors': non_bot_visitors,
         'total_page_views': total_page_views,
         'pages_per_visitor': pages_per_visitor,
+        'unique_visitors': unique_visitors,
+        'unique_visitors_exact': exact,
         'devices': devices_stats,
         'browsers': browser_stats,
         'operating_systems': os_stats,
-        'top_pages': top_pages_list
+        'top_pages': top_pages_list,
+        'daily': {
+            'labels': daily_labels,
+            'page_views': daily_series['page_views'],
+            'visitors': daily_series['visitors']
+        }
     }
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+ذاكرة مؤقتة لنتائج واجهات الإحصائيات
+لوحات الإحصائيات مفتوحة عادة مع تحديث تلقائي عند أكثر من مدير، وكل تحديث كان يعيد حساب كل شيء
+من جداول الأحداث. هنا تحفظ النتيجة لكل (واجهة، عدد الأيام):
+- خلال مدة الصلاحية (ANALYTICS_CACHE_TTL) تعاد النتيجة مباشرة
+- بعدها وحتى ANALYTICS_CACHE_STALE_TTL تعاد النتيجة القديمة فورًا ويعاد حسابها في خيط خلفي
+  (stale-while-revalidate)، مع حساب واحد فقط لكل مفتاح في نفس الوقت
+- كتابة إعجاب أو تعليق أو زيارة جديدة تجعل النتائج قديمة (اختياري)، فتحدث في الخلفية عند الطلب التالي
+"""
+
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import (PortfolioLike, CommentLike, PortfolioComment, PageVisit, PortfolioView, UserActivity,
+                    Visitor, User)
+
+# النماذج التي تجعل كتابتها الإحصائيات المحفوظة قديمة
+INVALIDATING_MODELS = (PortfolioLike, CommentLike, PortfolioComment, PageVisit, PortfolioView, UserActivity,
+                       Visitor, User)
+
+
+class _CacheEntry:
+    __slots__ = ('value', 'computed_at', 'generation')
+
+    def __init__(self, value, computed_at, generation):
+        self.value = value
+        self.computed_at = computed_at
+        self.generation = generation
+
+
+class AnalyticsCache:
+    """ذاكرة مؤقتة داخل العملية لنتائج الإحصائيات مع تحديث في الخلفية"""
+
+    def __init__(self, ttl=120, stale_ttl=900, min_age=15, max_entries=256):
+        self.enabled = True
+        self.invalidate_on_write = True
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_age = min_age
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._refreshing = set()
+        self._listening = False
+        # يزداد مع كل كتابة مؤثرة؛ النتائج المحسوبة قبله تعتبر قديمة
+        self.generation = 0
+        self.counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'invalidations': 0
+        }
+
+    def init_app(self, app):
+        """قراءة الإعدادات وتسجيل مستمع الكتابة (مرة واحدة لكل عملية)"""
+        self.enabled = app.config['ANALYTICS_CACHE_ENABLED']
+        self.ttl = app.config['ANALYTICS_CACHE_TTL']
+        self.stale_ttl = max(app.config['ANALYTICS_CACHE_STALE_TTL'], self.ttl)
+        self.min_age = app.config['ANALYTICS_CACHE_MIN_AGE']
+        self.invalidate_on_write = app.config['ANALYTICS_CACHE_INVALIDATE_ON_WRITE']
+        if not self._listening:
+            event.listen(Session, 'after_flush', self._after_flush)
+            self._listening = True
+
+    def _increment(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _is_fresh(self, entry, now):
+        age = now - entry.computed_at
+        # حد أدنى للعمر حتى لا تؤدي الزيارات المستمرة إلى إعادة الحساب مع كل تحديث للوحة
+        if age < self.min_age:
+            return True
+        return age < self.ttl and entry.generation == self.generation
+
+    def get(self, key, compute):
+        """
+        إرجاع النتيجة المحفوظة للمفتاح أو حسابها
+
+        Args:
+            key (str): مفتاح النتيجة (الواجهة وعدد الأيام)
+            compute (callable): دالة بدون معاملات تحسب النتيجة (لا تعتمد على request)
+
+        Returns:
+            النتيجة المحفوظة أو المحسوبة
+        """
+        if not self.enabled:
+            return compute()
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is not None:
+            if self._is_fresh(entry, now):
+                self._increment('hits')
+                return entry.value
+            if now - entry.computed_at < self.stale_ttl:
+                self._increment('stale_hits')
+                self._refresh_async(key, compute)
+                return entry.value
+
+        # لا توجد نتيجة صالحة: حساب متزامن، مرة واحدة فقط لكل مفتاح حتى لو طلبها عدة مديرين معًا
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and entry.computed_at >= now:
+                self._increment('hits')
+                return entry.value
+
+            self._increment('misses')
+            return self._compute_and_store(key, compute)
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _compute_and_store(self, key, compute):
+        generation = self.generation
+        value = compute()
+        with self._lock:
+            self._entries[key] = _CacheEntry(value, time.time(), generation)
+            if len(self._entries) > self.max_entries:
+                oldest_key = min(self._entries, key=lambda k: self._entries[k].computed_at)
+                self._entries.pop(oldest_key, None)
+                self._key_locks.pop(oldest_key, None)
+        return value
+
+    def _refresh_async(self, key, compute):
+        """إعادة حساب المفتاح في خيط خلفي (خيط واحد لكل مفتاح)"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        app = current_app._get_current_object()
+
+        def refresh():
+            try:
+                with app.app_context(), self._key_lock(key):
+                    self._compute_and_store(key, compute)
+                self._increment('refreshes')
+            except Exception as e:
+                self._increment('refresh_errors')
+                logging.error(f"Error refreshing analytics cache entry '{key}': {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        thread = threading.Thread(target=refresh, name='analytics-cache-refresh')
+        thread.daemon = True
+        thread.start()
+
+    def invalidate(self):
+        """جعل كل النتائج المحفوظة قديمة (تبقى متاحة وتحدث في الخلفية عند الطلب التالي)"""
+        with self._lock:
+            self.generation += 1
+            self.counters['invalidations'] += 1
+
+    def clear(self):
+        """حذف كل النتائج المحفوظة"""
+        with self._lock:
+            self._entries.clear()
+            self._key_locks.clear()
+
+    def _after_flush(self, session, flush_context):
+        if not self.enabled or not self.invalidate_on_write:
+            return
+        if any(isinstance(obj, INVALIDATING_MODELS) for obj in session.new):
+            self.invalidate()
+
+    def get_stats(self):
+        """حالة الذاكرة المؤقتة للمراقبة"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+            stats['refreshing'] = len(self._refreshing)
+            stats['generation'] = self.generation
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['stale_hits']) / lookups, 3) if lookups else 0
+        stats['enabled'] = self.enabled
+        stats['ttl'] = self.ttl
+        stats['stale_ttl'] = self.stale_ttl
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+analytics_cache = AnalyticsCache()
+
+
+def init_analytics_cache(app):
+    """
+    تهيئة الذاكرة المؤقتة للإحصائيات
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('ANALYTICS_CACHE_ENABLED', os.environ.get('ANALYTICS_CACHE_ENABLED', '1') != '0')
+    app.config.setdefault('ANALYTICS_CACHE_TTL', int(os.environ.get('ANALYTICS_CACHE_TTL', 120)))
+    app.config.setdefault('ANALYTICS_CACHE_STALE_TTL', int(os.environ.get('ANALYTICS_CACHE_STALE_TTL', 900)))
+    app.config.setdefault('ANALYTICS_CACHE_MIN_AGE', int(os.environ.get('ANALYTICS_CACHE_MIN_AGE', 15)))
+    app.config.setdefault('ANALYTICS_CACHE_INVALIDATE_ON_WRITE',
+                          os.environ.get('ANALYTICS_CACHE_INVALIDATE_ON_WRITE', '1') != '0')
+
+    analytics_cache.init_app(app)
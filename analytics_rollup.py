@@ -0,0 +1,374 @@
+"""
+جداول التجميع اليومية والساعية للإحصائيات
+بدلاً من عدّ نشاطات UserActivity يومًا بيوم عند كل فتح للوحة الإحصائيات (3 استعلامات لكل يوم)،
+تحدث عدادات DailyStat و HourlyStat في نفس معاملة كتابة الحدث (مستمع after_flush)،
+وتقرأ الرسوم البيانية سلسلة الأيام كاملة باستعلام واحد.
+
+- DailyStat: المشاهدات والإعجابات والتعليقات لكل يوم ولكل مشروع، وزيارات الصفحات والزوار الفريدون لإجمالي الموقع
+- HourlyStat: نفس العدادات لإجمالي الموقع لكل ساعة (اختياري)
+- DailyVisitor: الزوار المحتسبون في كل يوم لاحتساب الزوار الفريدين دون COUNT DISTINCT
+
+لإعادة بناء الجداول من البيانات الموجودة:
+    python analytics_rollup.py backfill [--days N]
+"""
+
+import argparse
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import db
+from models import UserActivity, PageVisit, DailyStat, HourlyStat, DailyVisitor
+
+# معرف المشروع المستخدم لصفوف إجمالي الموقع
+SITE_WIDE = 0
+
+# تصنيف أنواع النشاطات كما في الاستعلامات السابقة (LIKE 'view%' ...)
+ACTIVITY_COUNTERS = (
+    ('view', 'views'),
+    ('like', 'likes'),
+    ('comment', 'comments'),
+)
+
+# أنواع الموارد التي تشير إلى مشروع في المعرض
+PORTFOLIO_RESOURCE_TYPES = ('portfolio', 'portfolio_item')
+
+_UPSERT_INSERTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
+
+def activity_counter(activity_type):
+    """اسم العداد الذي يزيده نوع النشاط، أو None إذا لم يكن من النشاطات المجمعة"""
+    if not activity_type:
+        return None
+    for prefix, counter in ACTIVITY_COUNTERS:
+        if activity_type.startswith(prefix):
+            return counter
+    return None
+
+
+def _hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class RollupDelta:
+    """الزيادات المطلوبة على جداول التجميع من مجموعة أحداث"""
+
+    def __init__(self, hourly=True):
+        self.hourly = hourly
+        self.daily = defaultdict(Counter)  # (day, portfolio_id) -> Counter
+        self.hours = defaultdict(Counter)  # hour -> Counter
+        self.visitor_days = set()  # (day, visitor_id)
+
+    def __bool__(self):
+        return bool(self.daily or self.visitor_days)
+
+    def _add(self, moment, counter, portfolio_id=None):
+        day = moment.date()
+        self.daily[(day, SITE_WIDE)][counter] += 1
+        if portfolio_id:
+            self.daily[(day, portfolio_id)][counter] += 1
+        if self.hourly:
+            self.hours[_hour_start(moment)][counter] += 1
+
+    def add_activity(self, activity_type, resource_type, resource_id, created_at):
+        counter = activity_counter(activity_type)
+        if counter is None:
+            return
+        portfolio_id = resource_id if resource_type in PORTFOLIO_RESOURCE_TYPES else None
+        self._add(created_at or datetime.now(), counter, portfolio_id)
+
+    def add_page_visit(self, visitor_id, visited_at):
+        visited_at = visited_at or datetime.now()
+        self._add(visited_at, 'page_visits')
+        if visitor_id:
+            self.visitor_days.add((visited_at.date(), visitor_id))
+
+
+def upsert_counters(connection, model, keys, increments):
+    """زيادة العدادات في صف التجميع، أو إنشاؤه إذا لم يكن موجودًا"""
+    table = model.__table__
+    values = dict(keys)
+    values.update(increments)
+    insert = _UPSERT_INSERTS.get(connection.dialect.name)
+
+    if insert is not None:
+        statement = insert(table).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + statement.excluded[column] for column in increments}
+        )
+        connection.execute(statement)
+        return
+
+    # قواعد بيانات أخرى: تحديث ثم إدراج
+    key_filter = and_(*(table.c[column] == value for column, value in keys.items()))
+    result = connection.execute(
+        table.update().where(key_filter).values({column: table.c[column] + amount for column, amount in increments.items()})
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+
+def _insert_visitor_day(connection, day, visitor_id):
+    """تسجيل الزائر في يوم معين. يعيد True إذا كانت أول زيارة له في هذا اليوم"""
+    table = DailyVisitor.__table__
+    insert = _UPSERT_INSERTS.get(connection.dialect.name)
+
+    if insert is not None:
+        statement = insert(table).values(day=day, visitor_id=visitor_id).on_conflict_do_nothing(
+            index_elements=['day', 'visitor_id']
+        )
+        return connection.execute(statement).rowcount == 1
+
+    exists = connection.execute(
+        table.select().where(and_(table.c.day == day, table.c.visitor_id == visitor_id))
+    ).first()
+    if exists:
+        return False
+    connection.execute(table.insert().values(day=day, visitor_id=visitor_id))
+    return True
+
+
+def apply_delta(connection, delta):
+    """تطبيق الزيادات على جداول التجميع (بترتيب ثابت للمفاتيح لتجنب الجمود بين المعاملات المتزامنة)"""
+    for day, visitor_id in sorted(delta.visitor_days):
+        if _insert_visitor_day(connection, day, visitor_id):
+            delta.daily[(day, SITE_WIDE)]['unique_visitors'] += 1
+
+    for (day, portfolio_id) in sorted(delta.daily):
+        upsert_counters(connection, DailyStat, {'day': day, 'portfolio_id': portfolio_id}, dict(delta.daily[(day, portfolio_id)]))
+
+    for hour in sorted(delta.hours):
+        increments = {counter: amount for counter, amount in delta.hours[hour].items() if counter != 'unique_visitors'}
+        if increments:
+            upsert_counters(connection, HourlyStat, {'hour': hour}, increments)
+
+
+class AnalyticsRollup:
+    """تحديث جداول التجميع تلقائيًا عند كتابة النشاطات وزيارات الصفحات"""
+
+    def __init__(self):
+        self.enabled = True
+        self.hourly = True
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.errors = 0
+        self.last_error = None
+        self._listening = False
+
+    def init_app(self, app):
+        """قراءة الإعدادات وتسجيل مستمع after_flush (مرة واحدة لكل عملية)"""
+        self.enabled = app.config['ANALYTICS_ROLLUP_ENABLED']
+        self.hourly = app.config['ANALYTICS_ROLLUP_HOURLY']
+        if not self._listening:
+            event.listen(Session, 'after_flush', self._after_flush)
+            self._listening = True
+
+    def collect(self, objects):
+        """بناء الزيادات من الكائنات الجديدة في الجلسة"""
+        delta = RollupDelta(hourly=self.hourly)
+        for obj in objects:
+            if isinstance(obj, UserActivity):
+                delta.add_activity(obj.activity_type, obj.resource_type, obj.resource_id, obj.created_at)
+            elif isinstance(obj, PageVisit):
+                delta.add_page_visit(obj.visitor_id, obj.visited_at)
+        return delta
+
+    def _after_flush(self, session, flush_context):
+        # session.new ما زالت تحتوي على الكائنات المدرجة في هذا الـ flush
+        if not self.enabled or not session.new:
+            return
+
+        delta = self.collect(session.new)
+        if not delta:
+            return
+
+        # التحديث في نفس المعاملة: إذا تراجعت المعاملة تتراجع العدادات معها
+        # الخطأ هنا يفشل الـ flush حتى لا تنحرف العدادات عن الأحداث
+        try:
+            apply_delta(session.connection(), delta)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self.last_error = str(e)
+            logging.error(f"Error updating analytics rollups: {str(e)}")
+            raise
+
+        with self._lock:
+            self.flushes += 1
+
+    def get_stats(self):
+        """حالة التجميع للمراقبة"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'hourly': self.hourly,
+                'flushes': self.flushes,
+                'errors': self.errors,
+                'last_error': self.last_error
+            }
+
+
+# نسخة مشتركة على مستوى العملية
+analytics_rollup = AnalyticsRollup()
+
+
+def get_daily_series(days, portfolio_id=SITE_WIDE):
+    """
+    سلسلة العدادات اليومية لآخر عدد من الأيام باستعلام واحد، مع ملء الأيام الفارغة بأصفار
+
+    Args:
+        days (int): عدد الأيام قبل اليوم الحالي
+        portfolio_id (int): معرف المشروع، أو SITE_WIDE لإجمالي الموقع
+
+    Returns:
+        tuple: (قائمة التواريخ، قاموس: اسم العداد -> قائمة القيم)
+    """
+    end_day = datetime.now().date()
+    start_day = end_day - timedelta(days=days)
+
+    rows = DailyStat.query.filter(
+        DailyStat.portfolio_id == portfolio_id,
+        DailyStat.day >= start_day,
+        DailyStat.day <= end_day
+    ).all()
+    by_day = {row.day: row for row in rows}
+
+    labels = []
+    series = {column: [] for column in ('views', 'likes', 'comments', 'page_visits', 'unique_visitors')}
+    day = start_day
+    while day <= end_day:
+        labels.append(day.strftime('%Y-%m-%d'))
+        row = by_day.get(day)
+        for column, values in series.items():
+            values.append(getattr(row, column) or 0 if row else 0)
+        day += timedelta(days=1)
+
+    return labels, series
+
+
+def get_hourly_series(hours=24):
+    """سلسلة العدادات الساعية لإجمالي الموقع لآخر عدد من الساعات، مع ملء الساعات الفارغة بأصفار"""
+    end_hour = _hour_start(datetime.now())
+    start_hour = end_hour - timedelta(hours=hours - 1)
+
+    by_hour = {row.hour: row for row in HourlyStat.query.filter(HourlyStat.hour >= start_hour).all()}
+
+    labels = []
+    series = {column: [] for column in ('views', 'likes', 'comments', 'page_visits')}
+    hour = start_hour
+    while hour <= end_hour:
+        labels.append(hour.strftime('%Y-%m-%d %H:00'))
+        row = by_hour.get(hour)
+        for column, values in series.items():
+            values.append(getattr(row, column) or 0 if row else 0)
+        hour += timedelta(hours=1)
+
+    return labels, series
+
+
+def backfill_rollups(days=None, batch_size=5000, progress=None):
+    """
+    إعادة بناء جداول التجميع من UserActivity و PageVisit الموجودة
+
+    يحذف صفوف التجميع للفترة المحددة ثم يعيد حسابها في معاملة واحدة.
+    الأحداث التي تكتب أثناء التشغيل تحدث الجداول عبر المستمع كالمعتاد،
+    لذلك يفضل تشغيله في وقت هادئ لتجنب احتسابها مرتين.
+
+    Args:
+        days (int, optional): إعادة بناء آخر عدد من الأيام فقط (الافتراضي: كل البيانات)
+        batch_size (int): عدد الصفوف المقروءة في كل دفعة
+        progress (callable, optional): دالة تستقبل رسالة تقدم نصية
+
+    Returns:
+        dict: عدد النشاطات والزيارات التي تمت معالجتها
+    """
+    from retention import rebuild_start
+
+    report = progress or (lambda message: logging.info(message))
+    start = None
+    if days:
+        start = datetime.combine(datetime.now().date() - timedelta(days=days), datetime.min.time())
+    # الأيام التي ضغطت زياراتها تبقى تجميعاتها كما هي
+    start = rebuild_start(start, 'page_visit')
+
+    delta = RollupDelta(hourly=analytics_rollup.hourly)
+
+    activities = db.session.query(
+        UserActivity.activity_type, UserActivity.resource_type, UserActivity.resource_id, UserActivity.created_at
+    )
+    if start:
+        activities = activities.filter(UserActivity.created_at >= start)
+    activities_count = 0
+    for activity_type, resource_type, resource_id, created_at in activities.yield_per(batch_size):
+        delta.add_activity(activity_type, resource_type, resource_id, created_at)
+        activities_count += 1
+        if activities_count % batch_size == 0:
+            report(f"Read {activities_count} activities")
+
+    page_visits = db.session.query(PageVisit.visitor_id, PageVisit.visited_at)
+    if start:
+        page_visits = page_visits.filter(PageVisit.visited_at >= start)
+    page_visits_count = 0
+    for visitor_id, visited_at in page_visits.yield_per(batch_size):
+        delta.add_page_visit(visitor_id, visited_at)
+        page_visits_count += 1
+        if page_visits_count % batch_size == 0:
+            report(f"Read {page_visits_count} page visits")
+
+    # حذف التجميعات القديمة للفترة ثم كتابة الجديدة (الإدراج يمر بنفس دالة الزيادة)
+    daily_query = DailyStat.query
+    hourly_query = HourlyStat.query
+    visitor_query = DailyVisitor.query
+    if start:
+        daily_query = daily_query.filter(DailyStat.day >= start.date())
+        hourly_query = hourly_query.filter(HourlyStat.hour >= start)
+        visitor_query = visitor_query.filter(DailyVisitor.day >= start.date())
+    daily_query.delete(synchronize_session=False)
+    hourly_query.delete(synchronize_session=False)
+    visitor_query.delete(synchronize_session=False)
+
+    apply_delta(db.session.connection(), delta)
+    db.session.commit()
+
+    report(f"Rebuilt {len(delta.daily)} daily rollup rows from {activities_count} activities "
+           f"and {page_visits_count} page visits")
+    return {'activities': activities_count, 'page_visits': page_visits_count, 'daily_rows': len(delta.daily)}
+
+
+def init_analytics_rollup(app):
+    """
+    تهيئة التجميع التلقائي للإحصائيات
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('ANALYTICS_ROLLUP_ENABLED', os.environ.get('ANALYTICS_ROLLUP_ENABLED', '1') != '0')
+    app.config.setdefault('ANALYTICS_ROLLUP_HOURLY', os.environ.get('ANALYTICS_ROLLUP_HOURLY', '1') != '0')
+
+    analytics_rollup.init_app(app)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analytics rollup maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help='Rebuild rollup tables from existing events')
+    backfill_parser.add_argument('--days', type=int, default=None, help='Only rebuild the last N days')
+    backfill_parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'backfill':
+            backfill_rollups(days=args.days, batch_size=args.batch_size, progress=print)
@@ -28,6 +28,24 @@ from analytics import analytics
 from messaging_routes import messaging_bp
 # from portfolio_instagram import portfolio_instagram_bp
 from live_visitors import init_live_visitors_tracking
+from visit_tracking import init_visit_tracking, visit_tracker
+from tracking_filter import init_tracking_filter, tracking_filter
+from telegram_dispatcher import init_telegram_dispatcher
+from telegram_digest import init_telegram_digest
+from mail_dispatcher import init_mail_dispatcher
+from analytics_rollup import init_analytics_rollup
+from analytics_cache import init_analytics_cache
+from unique_sketches import init_unique_sketches, sketch_store, SCOPE_VISITORS
+from retention import init_retention
+from content_snapshot import init_content_snapshot, content_snapshot
+from page_cache import init_page_cache, page_cache
+from comment_counters import init_comment_counters, reconcile_comment_counts
+from keyset_pagination import keyset_page, encode_cursor, total_counts, InvalidCursor, MAX_PAGE_SIZE
+from portfolio_tags import init_portfolio_tags, ensure_tags_backfilled, category_cache, filter_by_tag
+from portfolio_search import init_portfolio_search, search_index
+from view_dedup import init_view_dedup
+from time_buckets import aggregate_buckets, count_if
+from ua_classifier import classify_user_agent
 from download_routes import download_bp
 
 # Configure logging
@@ -68,6 +86,51 @@ app.register_blueprint(download_bp)
 # تهيئة نظام تتبع الزوار النشطين حاليًا
 init_live_visitors_tracking(app)
 
+# تهيئة طابور تتبع الزيارات (الكتابة في قاعدة البيانات على دفعات في خيط خلفي)
+init_visit_tracking(app)
+
+# تهيئة مرشح التتبع (استبعاد الروبوتات وأدوات المراقبة والمسارات غير الصفحية)
+init_tracking_filter(app)
+
+# تهيئة مرسل إشعارات التيليجرام في الخلفية
+init_telegram_dispatcher(app)
+
+# تهيئة وضع الملخص الدوري لإشعارات الزوار والمشاهدات والإعجابات
+init_telegram_digest(app)
+
+# تهيئة مرسل البريد الإلكتروني في الخلفية
+init_mail_dispatcher(app)
+
+# تهيئة جداول التجميع اليومية للإحصائيات (تحدث مع كل نشاط أو زيارة صفحة)
+init_analytics_rollup(app)
+
+# تهيئة الذاكرة المؤقتة لنتائج واجهات الإحصائيات
+init_analytics_cache(app)
+
+# تهيئة مخططات HyperLogLog لعدّ الزوار والمشاهدين الفريدين
+init_unique_sketches(app)
+
+# تهيئة مهمة ضغط وأرشفة سجلات التتبع القديمة
+init_retention(app)
+
+# تهيئة لقطة محتوى الموقع للصفحة الرئيسية وصفحات الإدارة
+init_content_snapshot(app)
+
+# تهيئة الذاكرة المؤقتة للصفحات العامة (للزوار غير المسجلين)
+init_page_cache(app)
+
+# تهيئة عدادات التعليقات المخزنة في جدول المشاريع
+init_comment_counters(app)
+
+# تهيئة مزامنة وسوم معرض الأعمال مع حقل الفئة
+init_portfolio_tags(app)
+
+# تهيئة فهرس البحث النصي في معرض الأعمال
+init_portfolio_search(app)
+
+# تهيئة ذاكرة منع تكرار احتساب مشاهدات المشاريع
+init_view_dedup(app)
+
 # Security settings
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=1)
 app.config['SESSION_COOKIE_SECURE'] = True
@@ -152,17 +215,11 @@ def check_session():
             # توجيه كل المسارات التي تبدأ بـ /en إلى الصفحة الرئيسية
             return redirect(url_for('index'))
     
-    # تتبع الزائر وتسجيل الزيارة (للصفحات العامة فقط، ليس API أو الملفات الثابتة)
-    if not request.path.startswith('/static') and not request.path.startswith('/api') and request.method == 'GET':
-        # استيراد عند الطلب لتجنب دورة الاستيراد
-        from analytics import track_visitor, track_page_visit
-        
+    # تتبع الزائر وتسجيل الزيارة (للصفحات العامة فقط، ليس API أو الملفات الثابتة أو الروبوتات)
+    if tracking_filter.should_track(request):
         try:
-            # تتبع الزائر
-            visitor = track_visitor(request)
-            
-            # تسجيل زيارة الصفحة
-            track_page_visit(visitor, request)
+            # وضع حدث الزيارة في طابور التتبع - تتم الكتابة في قاعدة البيانات خارج الطلب
+            visit_tracker.track(request)
         except Exception as e:
             app.logger.error(f"Error tracking visitor: {str(e)}", exc_info=True)
             # لا نريد أن نمنع وصول المستخدم إذا فشل التتبع
@@ -204,13 +261,28 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 db.init_app(app)
 
 # Import models
-from models import User, Section, Content, Testimonial, Image, PortfolioItem, PortfolioComment, PortfolioLike, CommentLike, PortfolioView, Service, SocialMedia, Carousel, Visitor, PageVisit
+from models import User, Section, Content, Testimonial, Image, PortfolioItem, PortfolioComment, PortfolioLike, CommentLike, PortfolioView, Service, SocialMedia, Carousel, Visitor, PageVisit, DailyStat, HourlyStat, DailyVisitor, UniqueSketch, DailyPageStat, DailyViewStat, DailyVisitorStat, RetentionState, PortfolioTag, PortfolioViewLock
 
 # Create all tables
 with app.app_context():
     db.create_all()
     app.logger.info("Database tables created")
 
+    # إضافة الأعمدة والفهارس الجديدة إلى الجداول الموجودة مسبقًا
+    from db_migrations import apply_column_migrations, apply_index_migrations
+    added_columns = apply_column_migrations()
+    apply_index_migrations()
+
+    # عدادات التعليقات المضافة لتوها تبدأ من صفر، فتحسب مرة واحدة من جدول التعليقات
+    if 'portfolio_item.comments_count' in added_columns:
+        reconcile_comment_counts()
+
+    # نقل الفئات النصية الموجودة إلى جدول الوسوم (مرة واحدة)
+    ensure_tags_backfilled()
+
+    # إنشاء فهرس البحث النصي (FTS5 أو tsvector) وبناؤه عند إنشائه لأول مرة
+    search_index.ensure_index()
+
 # Import telegram service
 from telegram_service import send_telegram_message, test_telegram_notification, format_contact_message, format_testimonial, format_portfolio_comment, format_order_notification
 
@@ -439,86 +511,34 @@ with app.app_context():
     create_default_data()
 
 @app.route('/')
+@page_cache.cached
 def index():
-    sections = Section.query.all()
-    section_data = {}
-
-    for section in sections:
-        contents = Content.query.filter_by(section_id=section.id).all()
-        images = Image.query.filter_by(section_id=section.id).all()
-
-        content_data = {}
-        image_data = {}
-
-        for content in contents:
-            content_data[content.key] = content.value
-
-        for image in images:
-            image_data[image.key] = image.path
-
-        section_data[section.name] = {
-            'title': section.title,
-            'contents': content_data,
-            'images': image_data
-        }
-
-    testimonials = Testimonial.query.filter_by(approved=True).order_by(Testimonial.created_at.desc()).all()
-    services = Service.query.all()
-    social_media_links = SocialMedia.query.filter_by(active=True).all()
-    
-    # Get homepage carousel items (showing all active items sorted by order)
-    homepage_carousel_items = Carousel.query.filter_by(active=True).order_by(Carousel.order, Carousel.id).all()
-    app.logger.info(f"Homepage: Found {len(homepage_carousel_items)} carousel items")
-    for idx, item in enumerate(homepage_carousel_items):
-        app.logger.info(f"Carousel #{idx+1}: {item.image_filename} (path: {item.image_path})")
-    
-    # Get portfolio carousel items for the portfolio section
-    portfolio_carousel_items = PortfolioItem.query.filter(PortfolioItem.carousel_order > 0).order_by(PortfolioItem.carousel_order).all()
-    
-    featured_items = PortfolioItem.query.filter_by(featured=True).order_by(PortfolioItem.created_at.desc()).limit(6).all()
-
-    if len(featured_items) < 6:
-        additional_items = PortfolioItem.query.filter_by(featured=False).order_by(
-            PortfolioItem.created_at.desc()).limit(6 - len(featured_items)).all()
-        portfolio_items = featured_items + additional_items
-    else:
-        portfolio_items = featured_items
+    # كل محتوى الصفحة من لقطة المحتوى في الذاكرة (بدون استعلامات ما لم يتغير المحتوى)
+    snapshot = content_snapshot.get(g.lang)
 
     from forms import TestimonialForm
     form = TestimonialForm()
-    
-    # Get contact information
-    contact_info = {}
-    contact_section = Section.query.filter_by(name='contact').first()
-    if contact_section:
-        for content in Content.query.filter_by(section_id=contact_section.id).all():
-            contact_info[content.key] = content.value
-            
-    app.logger.info(f"Contact info: {contact_info}")
 
     return render_template('index.html',
-                         section_data=section_data,
-                         testimonials=testimonials,
-                         services=services,
-                         social_media_links=social_media_links,
-                         portfolio_items=portfolio_items,
-                         carousel_items=portfolio_carousel_items,
-                         homepage_carousel_items=homepage_carousel_items,
-                         contact_info=contact_info,
+                         section_data=snapshot.section_data,
+                         testimonials=snapshot.testimonials,
+                         services=snapshot.services,
+                         social_media_links=snapshot.social_media_links,
+                         portfolio_items=snapshot.portfolio_items,
+                         carousel_items=snapshot.portfolio_carousel_items,
+                         homepage_carousel_items=snapshot.homepage_carousel_items,
+                         contact_info=snapshot.contact_info,
                          form=form)
 
 @app.route('/portfolio')
 def portfolio():
     portfolio_items = PortfolioItem.query.order_by(PortfolioItem.created_at.desc()).all()
-    categories = set()
-    for item in portfolio_items:
-        item_categories = [cat.strip() for cat in item.category.split(',')]
-        categories.update(item_categories)
+    categories = category_cache.names()
     
     # حساب إجمالي الإحصائيات للوحة الإحصائيات بأسلوب انستجرام
     total_views = sum(item.views_count for item in portfolio_items)
     total_likes = sum(item.likes_count for item in portfolio_items)
-    total_comments = sum(len(item.comments) for item in portfolio_items)
+    total_comments = sum(item.approved_comments_count for item in portfolio_items)
     
     testimonials = Testimonial.query.filter_by(approved=True).order_by(Testimonial.created_at.desc()).limit(3).all()
     social_media_links = SocialMedia.query.filter_by(active=True).all()
@@ -534,7 +554,7 @@ def portfolio():
     # استخدام قالب أسلوب انستجرام الجديد
     return render_template('portfolio_instagram_style.html', 
                            portfolio_items=portfolio_items,
-                           categories=sorted(categories),
+                           categories=categories,
                            testimonials=testimonials,
                            social_media_links=social_media_links,
                            total_views=total_views,
@@ -549,6 +569,7 @@ def portfolio():
 # تمت إزالة مسار تفاصيل الخدمة الإنجليزية
 
 @app.route('/service/<service_type>')
+@page_cache.cached
 def service_detail(service_type):
     service_obj = Service.query.filter_by(service_type=service_type).first()
     if not service_obj:
@@ -569,12 +590,7 @@ def service_detail(service_type):
     }
     
     # جلب معلومات التواصل للاستخدام في زر الواتساب
-    contact_info = {}
-    contact_section = Section.query.filter_by(name='contact').first()
-    if contact_section:
-        contact_contents = Content.query.filter_by(section_id=contact_section.id).all()
-        for content in contact_contents:
-            contact_info[content.key] = content.value
+    contact_info = content_snapshot.get(g.lang).contact_info
     
     return render_template('service_detail.html', service=service, service_type=service_type, contact_info=contact_info)
 
@@ -671,22 +687,7 @@ def admin_change_password():
         return redirect(url_for('admin_dashboard'))
     
     # إعداد البيانات اللازمة لقالب profile.html
-    sections = Section.query.all()
-    section_data = {}
-    for section in sections:
-        contents = Content.query.filter_by(section_id=section.id).all()
-        images = Image.query.filter_by(section_id=section.id).all()
-        content_data = {}
-        image_data = {}
-        for content in contents:
-            content_data[content.key] = content.value
-        for image in images:
-            image_data[image.key] = image.path
-        section_data[section.name] = {
-            "title": section.title,
-            "contents": content_data,
-            "images": image_data
-        }
+    section_data = content_snapshot.get(g.lang).section_data
     pending_testimonials = Testimonial.query.filter_by(approved=False).count()
     pending_portfolio_comments = PortfolioComment.query.filter_by(approved=False).count()
     
@@ -733,15 +734,9 @@ def admin_dashboard():
         
         app.logger.info("Created contact section with default data")
 
-    home_content = {}
-    if home_section:
-        for content in Content.query.filter_by(section_id=home_section.id).all():
-            home_content[content.key] = content.value
-
-    about_content = {}
-    if about_section:
-        for content in Content.query.filter_by(section_id=about_section.id).all():
-            about_content[content.key] = content.value
+    section_data = content_snapshot.get(g.lang).section_data
+    home_content = dict(section_data['home']['contents']) if home_section and 'home' in section_data else {}
+    about_content = dict(section_data['about']['contents']) if about_section and 'about' in section_data else {}
 
     return render_template('admin/dashboard.html', 
                           sections_count=sections_count,
@@ -1134,22 +1129,7 @@ def admin_profile():
     from forms import ProfileForm
     form = ProfileForm()
     form.email.data = current_user.email
-    sections = Section.query.all()
-    section_data = {}
-    for section in sections:
-        contents = Content.query.filter_by(section_id=section.id).all()
-        images = Image.query.filter_by(section_id=section.id).all()
-        content_data = {}
-        image_data = {}
-        for content in contents:
-            content_data[content.key] = content.value
-        for image in images:
-            image_data[image.key] = image.path
-        section_data[section.name] = {
-            'title': section.title,
-            'contents': content_data,
-            'images': image_data
-        }
+    section_data = content_snapshot.get(g.lang).section_data
     pending_testimonials = Testimonial.query.filter_by(approved=False).count()
     pending_portfolio_comments = PortfolioComment.query.filter_by(approved=False).count()
     return render_template('admin/profile.html', 
@@ -2004,13 +1984,30 @@ def upload_image():
 
 @app.route('/api/portfolio-items')
 def get_portfolio_items():
-    page = request.args.get('page', 1, type=int)
+    # ?cursor=<next_cursor> للصفحة التالية؛ ?page= مدعوم للعملاء القدامى، والعدد الكلي فقط مع include_total=1
+    page = request.args.get('page', type=int)
     per_page = request.args.get('per_page', 10, type=int)
+    cursor = request.args.get('cursor')
     category = request.args.get('category')
     query = PortfolioItem.query
     if category:
-        query = query.filter_by(category=category)
-    items = query.order_by(PortfolioItem.created_at.desc()).paginate(page=page, per_page=per_page)
+        tag = category_cache.find(category)
+        if tag is None:
+            return jsonify({'items': [], 'has_more': False, 'next_cursor': None, 'current_page': page or 1})
+        query = filter_by_tag(query, tag.id)
+    if cursor or not page or page == 1:
+        try:
+            items, has_more, next_cursor = keyset_page(query, per_page, cursor)
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    else:
+        # رقم صفحة قديم: OFFSET مع عنصر إضافي لمعرفة وجود صفحة تالية بدون COUNT
+        per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+        items = query.order_by(PortfolioItem.created_at.desc(), PortfolioItem.id.desc()).offset(
+            (page - 1) * per_page).limit(per_page + 1).all()
+        has_more = len(items) > per_page
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1]) if has_more else None
     result = {
         'items': [{
             'id': item.id,
@@ -2021,15 +2018,19 @@ def get_portfolio_items():
             'image_url': item.image_url,
             'carousel_images': item.get_carousel_images() if item.carousel_images else [],
             'category': item.category,
-            'year': item.year,
+            'year': item.created_at.year if item.created_at else None,
             'views_count': item.views_count,
             'likes_count': item.likes_count,
-            'comments_count': item.comments.filter_by(approved=True).count()
-        } for item in items.items],
-        'total':items.total,
-        'pages': items.pages,
-        'current_page': page
+            'comments_count': item.approved_comments_count
+        } for item in items],
+        'has_more': has_more,
+        'next_cursor': next_cursor,
+        'current_page': page or 1
     }
+    if request.args.get('include_total') == '1':
+        total = total_counts.get(('category', category), query)
+        result['total'] = total
+        result['pages'] = -(-total // per_page) if per_page > 0 else 0
     return jsonify(result)
 
 @app.route('/api/portfolio-items/<int:portfolio_id>')
@@ -2052,7 +2053,7 @@ def get_portfolio_item_detail(portfolio_id):
                 'external_url': item.link,
                 'views_count': item.views_count,
                 'likes_count': item.likes_count,
-                'comments_count': item.comments.filter_by(approved=True).count(),
+                'comments_count': item.approved_comments_count,
                 'created_at': item.created_at.strftime('%Y-%m-%d'),
                 'user_liked': False  # Placeholder, can be implemented with session tracking
             }
@@ -2113,6 +2114,7 @@ def view_portfolio_item(portfolio_id):
                 ip_address=ip_address,
                 fingerprint=fingerprint,
                 user_agent=user_agent,
+                device_type=classify_user_agent(user_agent).device,
                 referrer=referrer
             )
             db.session.add(new_view)
@@ -2384,17 +2386,13 @@ def add_portfolio_item():
         }
         
         # نرسل البيانات إلى قالب صفحة إضافة المشروع
-        all_items = PortfolioItem.query.all()
-        categories = set()
-        for item in all_items:
-            item_categories = [cat.strip() for cat in item.category.split(',') if cat.strip()]
-            categories.update(item_categories)
+        categories = category_cache.names()
             
         pending_testimonials = Testimonial.query.filter_by(approved=False).count()
         pending_portfolio_comments = PortfolioComment.query.filter_by(approved=False).count()
         
         return render_template('admin/portfolio_add.html',
-                            categories=sorted(categories),
+                            categories=categories,
                             pending_testimonials=pending_testimonials,
                             pending_portfolio_comments=pending_portfolio_comments)
     
@@ -2595,22 +2593,19 @@ def add_portfolio_item():
 def admin_portfolio_management():
     search_query = request.args.get('search', '')
     category_filter = request.args.get('category', '')
-    sort_by = request.args.get('sort_by', 'created_at')
+    # نتائج البحث مرتبة حسب الصلة ما لم يختر ترتيب آخر
+    sort_by = request.args.get('sort_by', 'relevance' if search_query else 'created_at')
     sort_order = request.args.get('sort_order', 'desc')
     featured_filter = request.args.get('featured', '')
     query = PortfolioItem.query
+    search_ids = []
     if search_query:
-        search_term = f"%{search_query}%"
-        query = query.filter(
-            db.or_(
-                PortfolioItem.title.ilike(search_term),
-                PortfolioItem.title_en.ilike(search_term),
-                PortfolioItem.description.ilike(search_term),
-                PortfolioItem.category.ilike(search_term)
-            )
-        )
+        # فهرس البحث النصي بدلاً من ilike على كل الأعمدة
+        search_ids = search_index.search(search_query, limit=500)
+        query = query.filter(PortfolioItem.id.in_(search_ids))
     if category_filter:
-        query = query.filter(PortfolioItem.category.ilike(f"%{category_filter}%"))
+        tag = category_cache.find(category_filter)
+        query = filter_by_tag(query, tag.id) if tag else query.filter(db.false())
     if featured_filter == 'featured':
         query = query.filter(PortfolioItem.featured == True)
     elif featured_filter == 'not_featured':
@@ -2627,18 +2622,18 @@ def admin_portfolio_management():
         order_column = PortfolioItem.carousel_order
     else:
         order_column = PortfolioItem.created_at
-    if sort_order == 'asc':
-        query = query.order_by(order_column.asc())
+    if sort_by == 'relevance' and search_query:
+        rank = {item_id: position for position, item_id in enumerate(search_ids)}
+        portfolio_items = sorted(query.all(), key=lambda item: rank[item.id])
     else:
-        query = query.order_by(order_column.desc())
-    portfolio_items = query.all()
-    all_items = PortfolioItem.query.all()
-    categories = set()
-    for item in all_items:
-        item_categories = [cat.strip() for cat in item.category.split(',') if cat.strip()]
-        categories.update(item_categories)
-    total_views = sum(item.views_count or 0 for item in all_items)
-    total_likes = sum(item.likes_count or 0 for item in all_items)
+        if sort_order == 'asc':
+            query = query.order_by(order_column.asc())
+        else:
+            query = query.order_by(order_column.desc())
+        portfolio_items = query.all()
+    categories = category_cache.names()
+    total_views = db.session.query(func.sum(PortfolioItem.views_count)).scalar() or 0
+    total_likes = db.session.query(func.sum(PortfolioItem.likes_count_value)).scalar() or 0
     total_comments = PortfolioComment.query.count()
     featured_count = PortfolioItem.query.filter_by(featured=True).count()
     carousel_count = PortfolioItem.query.filter(PortfolioItem.carousel_order > 0).count()
@@ -2646,7 +2641,7 @@ def admin_portfolio_management():
     pending_portfolio_comments = PortfolioComment.query.filter_by(approved=False).count()
     return render_template('admin/portfolio_management.html', 
                           portfolio_items=portfolio_items,
-                          categories=sorted(categories),
+                          categories=categories,
                           total_views=total_views,
                           total_likes=total_likes,
                           total_comments=total_comments,
@@ -2669,19 +2664,14 @@ def update_portfolio_item(portfolio_id):
         # إذا كان طلب GET، اعرض صفحة التعديل
         if request.method == 'GET':
             # الحصول على جميع الفئات الموجودة
-            all_portfolio_items = PortfolioItem.query.all()
-            categories = set()
-            for portfolio_item in all_portfolio_items:
-                if portfolio_item.category:
-                    item_categories = [cat.strip() for cat in portfolio_item.category.split(',')]
-                    categories.update(item_categories)
+            categories = category_cache.names()
             
             # تجهيز صور الكاروسيل
             carousel_images = item.get_carousel_images()
             
             return render_template('admin/edit_portfolio_item.html', 
                                   item=item,
-                                  categories=sorted(categories),
+                                  categories=categories,
                                   carousel_images=carousel_images)
         
         # تسجيل بيانات التحديث للتصحيح
@@ -3247,14 +3237,27 @@ def views_analytics():
             app.logger.error(f"Error getting total views: {str(e)}")
             total_views = 0
             
-        # الحصول على المشاهدات الفريدة (من portfolio_view)
+        # المشاهدات الفريدة ومتوسط المدة ونسبة الارتداد من مسح واحد لجدول portfolio_view
+        engagement_stats = {
+            'avg_duration': 0,
+            'bounce_rate': 0
+        }
+        
         try:
-            unique_views_query = db.session.query(func.count(distinct(PortfolioView.id)))
+            views_summary_query = db.session.query(
+                func.count(PortfolioView.id),
+                func.avg(PortfolioView.duration),
+                count_if(PortfolioView.bounced == True)
+            )
             if days:
-                unique_views_query = unique_views_query.filter(PortfolioView.created_at >= start_date)
-            unique_views = unique_views_query.scalar() or 0
+                views_summary_query = views_summary_query.filter(PortfolioView.created_at >= start_date)
+            unique_views, avg_duration, bounced = views_summary_query.one()
+            unique_views = unique_views or 0
+            
+            engagement_stats['avg_duration'] = int(avg_duration or 0)
+            engagement_stats['bounce_rate'] = int((bounced or 0) / unique_views * 100) if unique_views else 0
         except Exception as e:
-            app.logger.error(f"Error getting unique views: {str(e)}")
+            app.logger.error(f"Error getting unique views and engagement stats: {str(e)}")
             unique_views = 0
             
         # الحصول على توزيع الأجهزة
@@ -3288,40 +3291,32 @@ def views_analytics():
         # بيانات الاتجاه على مدار الفترة المحددة (7 أيام ماضية كحد أقصى)
         trend_days = min(days, 7)  # لعرض أحدث 7 أيام فقط لتبسيط الرسم البياني
         
-        trend_data = {
-            'labels': [],
-            'total': [],
-            'unique': []
-        }
-        
-        # توليد بيانات الاتجاه يوميًا
-        for i in range(trend_days, 0, -1):
-            current_date = end_date - timedelta(days=i)
-            next_date = current_date + timedelta(days=1)
-            date_str = current_date.strftime('%Y-%m-%d')
-            
-            # إضافة التاريخ إلى التسميات
-            trend_data['labels'].append(date_str)
-            
-            try:
-                # عدد زيارات الصفحات في هذا اليوم
-                day_visits = db.session.query(func.count(PageVisit.id)).filter(
-                    PageVisit.visited_at >= current_date,
-                    PageVisit.visited_at < next_date
-                ).scalar() or 0
-                
-                # عدد الزوار الفريدين في هذا اليوم
-                day_visitors = db.session.query(func.count(func.distinct(PageVisit.visitor_id))).filter(
-                    PageVisit.visited_at >= current_date,
-                    PageVisit.visited_at < next_date
-                ).scalar() or 0
-                
-                trend_data['total'].append(day_visits)
-                trend_data['unique'].append(day_visitors)
-            except Exception as e:
-                app.logger.error(f"Error getting trend data for {date_str}: {str(e)}")
-                trend_data['total'].append(0)
-                trend_data['unique'].append(0)
+        # كل الأيام باستعلام GROUP BY واحد، والأيام الفارغة أصفار. الزوار الفريدون من مخططات
+        # HyperLogLog اليومية إلا إذا طلب العد الدقيق (?exact=1)
+        exact = request.args.get('exact', '0') == '1' or not sketch_store.enabled
+        try:
+            trend_start = end_date - timedelta(days=trend_days - 1)
+            aggregates = {'total': func.count(PageVisit.id)}
+            if exact:
+                aggregates['unique'] = func.count(func.distinct(PageVisit.visitor_id))
+            trend_labels, trend_series = aggregate_buckets(
+                PageVisit.visited_at,
+                aggregates,
+                start=trend_start,
+                end=end_date
+            )
+            if not exact:
+                _, trend_series['unique'] = sketch_store.daily_counts(
+                    SCOPE_VISITORS, trend_start.date(), end_date.date()
+                )
+            trend_data = {
+                'labels': trend_labels,
+                'total': trend_series['total'],
+                'unique': trend_series['unique']
+            }
+        except Exception as e:
+            app.logger.error(f"Error getting trend data: {str(e)}")
+            trend_data = {'labels': [], 'total': [], 'unique': []}
         
         # الحصول على إحصائيات المشاريع
         try:
@@ -3349,41 +3344,6 @@ def views_analytics():
                 'values': [0]
             }
             
-        # إحصائيات المتابعة
-        engagement_stats = {
-            'avg_duration': 0,
-            'bounce_rate': 0
-        }
-        
-        try:
-            # متوسط مدة المشاهدة
-            avg_duration_query = db.session.query(func.avg(PortfolioView.duration))
-            if days:
-                avg_duration_query = avg_duration_query.filter(PortfolioView.created_at >= start_date)
-            avg_duration = avg_duration_query.scalar() or 0
-            
-            engagement_stats['avg_duration'] = int(avg_duration)
-            
-            # نسبة الارتداد
-            # تصحيح استخدام case() في SQLAlchemy
-            bounced_query = db.session.query(func.sum(
-                case((PortfolioView.bounced == True, 1), else_=0)
-            ))
-            total_query = db.session.query(func.count(PortfolioView.id))
-            
-            if days:
-                bounced_query = bounced_query.filter(PortfolioView.created_at >= start_date)
-                total_query = total_query.filter(PortfolioView.created_at >= start_date)
-                
-            bounced = bounced_query.scalar() or 0
-            total = total_query.scalar() or 1  # لتجنب القسمة على صفر
-            
-            bounce_rate = (bounced / total) * 100 if total > 0 else 0
-            engagement_stats['bounce_rate'] = int(bounce_rate)
-            
-        except Exception as e:
-            app.logger.error(f"Error getting engagement stats: {str(e)}")
-            
         # تحضير البيانات التفصيلية للمشاريع
         detailed_stats = []
         
@@ -3413,7 +3373,7 @@ def views_analytics():
             detailed_query = detailed_query.offset((page - 1) * per_page).limit(per_page)
             detailed_result = detailed_query.all()
             
-            for item_id, title, views, unique_views, avg_duration in detailed_result:
+            for item_id, title, views, item_unique_views, avg_duration in detailed_result:
                 # حساب معدل التفاعل
                 if avg_duration is None:
                     avg_duration = 0
@@ -3424,7 +3384,7 @@ def views_analytics():
                     'id': item_id,
                     'title': title,
                     'views': views,
-                    'unique_views': unique_views or 0,
+                    'unique_views': item_unique_views or 0,
                     'avg_duration': int(avg_duration or 0),
                     'engagement': engagement
                 })
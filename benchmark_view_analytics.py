@@ -0,0 +1,145 @@
+"""
+قياس أداء PortfolioView.get_analytics مع نمو جدول المشاهدات
+ينشئ قاعدة SQLite مؤقتة، ويملأ جدول portfolio_view بأحجام متزايدة من السجلات القديمة
+مع عدد ثابت من المشاهدات داخل نافذة التحليل (آخر 30 يومًا)، ثم يقيس زمن الاستعلام لكل حجم.
+بما أن الاستعلامات مقيدة بالفهرس (portfolio_id, created_at)، يجب أن يبقى الزمن ثابتًا تقريبًا
+مهما زاد عدد السجلات خارج النافذة.
+
+المشاهدون الفريدون يقدرون افتراضيًا من مخططات unique_sketch، فتضاف كل دفعة مدرجة إلى المخططات
+وتكتب قبل القياس، ويقاس معها العدّ الدقيق (exact=True) للمقارنة.
+
+الاستخدام:
+    python benchmark_view_analytics.py [--sizes 10000,100000,1000000] [--window-rows 5000] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from database import db
+from models import PortfolioItem, PortfolioView
+from unique_sketches import sketch_store, viewer_identity, SCOPE_VIEWERS
+
+DEVICES = ('desktop', 'mobile', 'tablet', None)
+PROJECTS = 20
+
+
+def _make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    return app
+
+
+def _view_rows(count, start_id, oldest_days, newest_days):
+    """توليد صفوف مشاهدات عشوائية بين عمرين (بالأيام)"""
+    now = datetime.now()
+    for offset in range(count):
+        age = random.uniform(newest_days, oldest_days)
+        created_at = now - timedelta(days=age)
+        yield {
+            'id': start_id + offset,
+            'portfolio_id': random.randint(1, PROJECTS),
+            'ip_address': f'10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}',
+            'fingerprint': f'fp-{start_id + offset}',
+            'created_at': created_at,
+            'last_viewed_at': created_at,
+            'view_count': random.choice((1, 1, 1, 2, 3)),
+            'duration': random.randint(0, 300),
+            'device_type': random.choice(DEVICES),
+            'bounced': random.random() < 0.4,
+        }
+
+
+def _add_to_sketches(row):
+    """نفس ما يضيفه مستمع unique_sketches للمشاهدة المحفوظة (الإدراج هنا بـ Core لا يمر بالجلسة)"""
+    identity = viewer_identity(PortfolioView(**row))
+    sketch_store.add(SCOPE_VIEWERS, identity, row['created_at'])
+    sketch_store.add(SCOPE_VIEWERS, identity, row['created_at'], portfolio_id=row['portfolio_id'])
+
+
+def _insert(rows, batch_size=20000):
+    table = PortfolioView.__table__
+    batch = []
+    for row in rows:
+        batch.append(row)
+        _add_to_sketches(row)
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+    sketch_store.flush()
+
+
+def _measure(repeat):
+    """الوسيط لزمن الاستعلام لكل المشاريع ولمشروع واحد، بالتقدير والعدّ الدقيق (بالملي ثانية)"""
+    cases = {
+        'all_projects': {},
+        'one_project': {'portfolio_id': 1},
+        'all_projects_exact': {'exact': True},
+        'one_project_exact': {'portfolio_id': 1, 'exact': True},
+    }
+    timings = {name: [] for name in cases}
+    for _ in range(repeat):
+        for name, kwargs in cases.items():
+            started = time.perf_counter()
+            PortfolioView.get_analytics(days=30, **kwargs)
+            timings[name].append((time.perf_counter() - started) * 1000)
+    return {name: statistics.median(values) for name, values in timings.items()}
+
+
+def run(sizes, window_rows, repeat):
+    path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    app = _make_app(path)
+    random.seed(42)
+
+    sketch_store.app = app
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(PortfolioItem.__table__.insert(), [
+            {'id': project_id, 'title': f'Project {project_id}', 'description': '', 'image_url': '', 'category': ''}
+            for project_id in range(1, PROJECTS + 1)
+        ])
+        # عدد ثابت من المشاهدات داخل نافذة التحليل
+        _insert(_view_rows(window_rows, 1, 29, 0))
+        inserted = window_rows
+
+        print(f"{'rows':>12} {'all projects (ms)':>20} {'one project (ms)':>20} "
+              f"{'all exact (ms)':>20} {'one exact (ms)':>20}")
+        for size in sorted(sizes):
+            # المشاهدات القديمة (أقدم من النافذة) هي التي تنمو
+            if size > inserted:
+                _insert(_view_rows(size - inserted, inserted + 1, 3 * 365, 31))
+                inserted = size
+                db.session.execute(db.text('ANALYZE'))
+            timings = _measure(repeat)
+            print(f"{inserted:>12} {timings['all_projects']:>20.2f} {timings['one_project']:>20.2f} "
+                  f"{timings['all_projects_exact']:>20.2f} {timings['one_project_exact']:>20.2f}")
+
+        result = PortfolioView.get_analytics(days=30)
+        exact = PortfolioView.get_analytics(days=30, exact=True)
+        print(f"\nSample result (last 30 days, all projects): {result}")
+        print(f"Unique viewers: estimated {result['unique_views']}, exact {exact['unique_views']}")
+
+    print(f"\nDatabase kept at {path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark PortfolioView.get_analytics as the table grows')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='Comma-separated total row counts to measure at')
+    parser.add_argument('--window-rows', type=int, default=5000,
+                        help='Number of views inside the 30-day analysis window')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement (median is reported)')
+    args = parser.parse_args()
+
+    run([int(size) for size in args.sizes.split(',') if size.strip()], args.window_rows, args.repeat)
@@ -0,0 +1,172 @@
+"""
+عدادات التعليقات المخزنة في جدول المشاريع
+قوائم المعرض كانت تنفذ استعلام COUNT على التعليقات لكل مشروع (N+1). هنا يحتفظ كل مشروع بعمودين:
+
+- comments_count: كل تعليقات المشروع (بما فيها الردود والتعليقات المعلقة)
+- approved_comments_count: التعليقات المعتمدة فقط (ما يعرض للزوار)
+
+يحدث العمودان في نفس المعاملة التي تضيف التعليق أو تعتمده أو ترفضه أو تحذفه (مستمع after_flush
+بتحديث ذري column = column + delta)، وأي انحراف (حذف جماعي أو كتابة من خارج التطبيق) يصلح بأمر المطابقة:
+
+    python comment_counters.py reconcile [--dry-run]
+"""
+
+import argparse
+import json
+import logging
+from collections import defaultdict
+
+from sqlalchemy import case, event, func, inspect, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from database import db
+from models import PortfolioItem, PortfolioComment
+
+_listening = False
+
+
+def _previous_value(state, key):
+    """قيمة الحقل قبل التعديل الحالي (بدون أي استعلام)"""
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return state.dict.get(key)
+
+
+def _comment_deltas(session):
+    """فروق العدادات لكل مشروع من التعليقات المضافة والمحذوفة والمعدلة في هذا الـ flush"""
+    deltas = defaultdict(lambda: [0, 0])
+
+    for obj in session.new:
+        if isinstance(obj, PortfolioComment) and obj.portfolio_id is not None:
+            deltas[obj.portfolio_id][0] += 1
+            deltas[obj.portfolio_id][1] += 1 if obj.approved else 0
+
+    for obj in session.deleted:
+        if isinstance(obj, PortfolioComment):
+            state = inspect(obj)
+            portfolio_id = _previous_value(state, 'portfolio_id')
+            if portfolio_id is not None:
+                deltas[portfolio_id][0] -= 1
+                deltas[portfolio_id][1] -= 1 if _previous_value(state, 'approved') else 0
+
+    for obj in session.dirty:
+        if not isinstance(obj, PortfolioComment):
+            continue
+        state = inspect(obj)
+        if not (state.attrs.approved.history.has_changes() or state.attrs.portfolio_id.history.has_changes()):
+            continue
+        old_portfolio_id = _previous_value(state, 'portfolio_id')
+        old_approved = bool(_previous_value(state, 'approved'))
+        if old_portfolio_id is not None:
+            deltas[old_portfolio_id][0] -= 1
+            deltas[old_portfolio_id][1] -= 1 if old_approved else 0
+        if obj.portfolio_id is not None:
+            deltas[obj.portfolio_id][0] += 1
+            deltas[obj.portfolio_id][1] += 1 if obj.approved else 0
+
+    return {portfolio_id: delta for portfolio_id, delta in deltas.items() if any(delta)}
+
+
+def _load_previous_value(target, value, oldvalue, initiator):
+    """مستمع فارغ: تسجيله مع active_history يجعل SQLAlchemy يحمل القيمة السابقة حتى بعد انتهاء صلاحية الكائن"""
+
+
+def _after_flush(session, flush_context):
+    deltas = _comment_deltas(session)
+    if not deltas:
+        return
+
+    table = PortfolioItem.__table__
+    connection = session.connection()
+    for portfolio_id, (total_delta, approved_delta) in deltas.items():
+        connection.execute(
+            update(table)
+            .where(table.c.id == portfolio_id)
+            .values(comments_count=table.c.comments_count + total_delta,
+                    approved_comments_count=table.c.approved_comments_count + approved_delta)
+        )
+
+        # المشروع المحمل في الجلسة يرى القيم الجديدة بدون إعادة تحميل
+        item = session.identity_map.get(inspect(PortfolioItem).identity_key_from_primary_key((portfolio_id,)))
+        if item is not None:
+            state_dict = inspect(item).dict
+            if 'comments_count' in state_dict:
+                set_committed_value(item, 'comments_count', (item.comments_count or 0) + total_delta)
+            if 'approved_comments_count' in state_dict:
+                set_committed_value(item, 'approved_comments_count',
+                                    (item.approved_comments_count or 0) + approved_delta)
+
+
+def reconcile_comment_counts(dry_run=False):
+    """
+    مطابقة عدادات التعليقات مع جدول التعليقات وإصلاح أي انحراف
+
+    Args:
+        dry_run (bool): عرض الفروق فقط بدون تعديل
+
+    Returns:
+        list: المشاريع المختلفة بصيغة {'id', 'stored': [..], 'actual': [..]}
+    """
+    actual = {
+        row.portfolio_id: (row.total, int(row.approved or 0))
+        for row in db.session.query(
+            PortfolioComment.portfolio_id,
+            func.count(PortfolioComment.id).label('total'),
+            func.sum(case((PortfolioComment.approved == True, 1), else_=0)).label('approved')
+        ).group_by(PortfolioComment.portfolio_id)
+    }
+
+    drift = []
+    for item_id, stored_total, stored_approved in db.session.query(
+            PortfolioItem.id, PortfolioItem.comments_count, PortfolioItem.approved_comments_count):
+        expected = actual.get(item_id, (0, 0))
+        if (stored_total, stored_approved) != expected:
+            drift.append({'id': item_id, 'stored': [stored_total, stored_approved], 'actual': list(expected)})
+
+    if drift and not dry_run:
+        table = PortfolioItem.__table__
+        for entry in drift:
+            db.session.execute(
+                update(table)
+                .where(table.c.id == entry['id'])
+                .values(comments_count=entry['actual'][0], approved_comments_count=entry['actual'][1])
+            )
+        db.session.commit()
+        logging.warning(f"Repaired comment counters for {len(drift)} portfolio items")
+
+    return drift
+
+
+def init_comment_counters(app):
+    """
+    تسجيل مستمع تحديث عدادات التعليقات (مرة واحدة لكل عملية)
+
+    Args:
+        app: تطبيق Flask
+    """
+    global _listening
+    if not _listening:
+        # بدون القيمة السابقة لا يعرف إن كان اعتماد تعليق محمل قبل commit سابق تغييرًا فعليًا
+        for attribute in (PortfolioComment.approved, PortfolioComment.portfolio_id):
+            event.listen(attribute, 'set', _load_previous_value, active_history=True)
+        event.listen(Session, 'after_flush', _after_flush)
+        _listening = True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Denormalized portfolio comment counters')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    reconcile_parser = subparsers.add_parser('reconcile', help='Recount comments and repair drifted counters')
+    reconcile_parser.add_argument('--dry-run', action='store_true', help='Only report the drifted items')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'reconcile':
+            result = reconcile_comment_counts(dry_run=args.dry_run)
+            print(json.dumps({'drifted': len(result), 'items': result}, indent=2, ensure_ascii=False))
@@ -552,8 +552,9 @@ def delete_comment(comment_id):
     # حذف الإعجابات المرتبطة بهذا التعليق
     CommentLike.query.filter_by(comment_id=comment_id).delete()
     
-    # حذف الردود على هذا التعليق
-    PortfolioComment.query.filter_by(parent_id=comment_id).delete()
+    # حذف الردود على هذا التعليق (عبر الجلسة وليس حذفًا جماعيًا حتى تنقص عدادات المشروع)
+    for reply in comment.replies:
+        db.session.delete(reply)
     
     # حذف التعليق نفسه
     db.session.delete(comment)
@@ -632,22 +633,16 @@ def check_spam():
 @comments.route('/api/most-commented-items')
 def most_commented_items():
     """الحصول على قائمة المشاريع الأكثر تعليقًا"""
-    from sqlalchemy import func
-    
-    # الحصول على عدد التعليقات لكل مشروع
+    # عدد التعليقات المعتمدة مخزن في جدول المشاريع
     query = db.session.query(
         PortfolioItem.id,
         PortfolioItem.title,
         PortfolioItem.image_url,
-        func.count(PortfolioComment.id).label('comments_count')
-    ).join(
-        PortfolioComment, PortfolioItem.id == PortfolioComment.portfolio_id
+        PortfolioItem.approved_comments_count.label('comments_count')
     ).filter(
-        PortfolioComment.approved == True
-    ).group_by(
-        PortfolioItem.id, PortfolioItem.title, PortfolioItem.image_url
+        PortfolioItem.approved_comments_count > 0
     ).order_by(
-        func.count(PortfolioComment.id).desc()
+        PortfolioItem.approved_comments_count.desc()
     ).limit(5)
     
     items = query.all()
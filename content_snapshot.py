@@ -0,0 +1,275 @@
+"""
+لقطة محتوى الموقع في الذاكرة
+الصفحة الرئيسية كانت تنفذ استعلامين لكل قسم (المحتوى والصور) ثم حوالي عشرة استعلامات أخرى
+للتقييمات والخدمات والروابط والكاروسيل والمشاريع المميزة ومعلومات التواصل، ونفس حلقة الأقسام
+تتكرر في صفحات الإدارة. هنا يحمل كل ذلك بعدد قليل من الاستعلامات المجمعة ويبنى منه نموذج عرض
+غير قابل للتعديل لكل لغة، يبقى في ذاكرة العملية حتى تتغير البيانات.
+
+- أي كتابة مؤكدة (commit) على المحتوى أو الخدمات أو الروابط أو الكاروسيل أو التقييمات أو المشاريع
+  تلغي اللقطة في هذه العملية، وتحدث ملف الإصدار المشترك (CONTENT_SNAPSHOT_VERSION_PATH)
+  حتى تعيد عمال gunicorn الأخرى بناءها في طلبها التالي
+- تحديث عدادات المشاريع (المشاهدات والإعجابات) لا يلغي اللقطة لأنها لا تعرض فيها
+- مدة صلاحية قصوى (CONTENT_SNAPSHOT_TTL) احتياطًا للكتابات من خارج التطبيق
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, selectinload
+
+from models import Section, Content, Image, Testimonial, Service, SocialMedia, Carousel, PortfolioItem
+
+# النماذج التي تلغي كتابتها اللقطة
+SNAPSHOT_MODELS = (Section, Content, Image, Testimonial, Service, SocialMedia, Carousel, PortfolioItem)
+
+# أعمدة تتغير مع كل مشاهدة أو إعجاب ولا تظهر في اللقطة
+IGNORED_COLUMNS = {
+    PortfolioItem: {'views_count', 'likes_count_value', 'comments_count', 'approved_comments_count', 'updated_at'},
+}
+
+FEATURED_ITEMS_LIMIT = 6
+
+TestimonialView = namedtuple('TestimonialView', ['id', 'name', 'company', 'content', 'rating', 'approved', 'created_at'])
+ServiceView = namedtuple('ServiceView', ['id', 'service_type', 'title', 'subtitle', 'price', 'delivery_time',
+                                         'image_url', 'description'])
+SocialLinkView = namedtuple('SocialLinkView', ['id', 'platform', 'name', 'url', 'icon', 'active'])
+SlideView = namedtuple('SlideView', ['id', 'title', 'caption', 'image_filename', 'image_path', 'order'])
+PortfolioCardView = namedtuple('PortfolioCardView', ['id', 'title', 'description', 'image_url', 'category', 'link',
+                                                     'featured', 'carousel_order', 'created_at'])
+ContentSnapshot = namedtuple('ContentSnapshot', ['lang', 'section_data', 'contact_info', 'testimonials', 'services',
+                                                 'social_media_links', 'homepage_carousel_items',
+                                                 'portfolio_carousel_items', 'portfolio_items', 'built_at'])
+
+
+def _localized(obj, field, lang):
+    """قيمة الحقل بلغة العرض (الحقل _en للإنجليزية مع الرجوع للعربية إذا كان فارغًا)"""
+    if lang != 'ar':
+        value = getattr(obj, f'{field}_{lang}', None)
+        if value:
+            return value
+    return getattr(obj, field)
+
+
+def _portfolio_card(item, lang):
+    return PortfolioCardView(item.id, _localized(item, 'title', lang), _localized(item, 'description', lang),
+                             item.image_url, item.category, item.link, item.featured, item.carousel_order,
+                             item.created_at)
+
+
+def load_snapshot(lang):
+    """
+    تحميل لقطة المحتوى من قاعدة البيانات (9 استعلامات مهما كان عدد الأقسام)
+
+    Args:
+        lang (str): لغة العرض
+
+    Returns:
+        ContentSnapshot: نموذج عرض غير قابل للتعديل
+    """
+    section_data = {}
+    for section in Section.query.options(selectinload(Section.contents), selectinload(Section.images)).all():
+        section_data[section.name] = MappingProxyType({
+            'title': section.title,
+            'contents': MappingProxyType({content.key: content.value for content in section.contents}),
+            'images': MappingProxyType({image.key: image.path for image in section.images})
+        })
+
+    contact = section_data.get('contact')
+    contact_info = contact['contents'] if contact else MappingProxyType({})
+
+    testimonials = tuple(
+        TestimonialView(t.id, t.name, t.company, t.content, t.rating, t.approved, t.created_at)
+        for t in Testimonial.query.filter_by(approved=True).order_by(Testimonial.created_at.desc())
+    )
+    services = tuple(
+        ServiceView(s.id, s.service_type, _localized(s, 'title', lang), _localized(s, 'subtitle', lang),
+                    _localized(s, 'price', lang), _localized(s, 'delivery_time', lang), s.image_url,
+                    _localized(s, 'description', lang))
+        for s in Service.query.all()
+    )
+    social_media_links = tuple(
+        SocialLinkView(link.id, link.platform, link.name, link.url, link.icon, link.active)
+        for link in SocialMedia.query.filter_by(active=True)
+    )
+    homepage_carousel_items = tuple(
+        SlideView(slide.id, _localized(slide, 'title', lang), _localized(slide, 'caption', lang),
+                  slide.image_filename, slide.image_path, slide.order)
+        for slide in Carousel.query.filter_by(active=True).order_by(Carousel.order, Carousel.id)
+    )
+    portfolio_carousel_items = tuple(
+        _portfolio_card(item, lang)
+        for item in PortfolioItem.query.filter(PortfolioItem.carousel_order > 0).order_by(PortfolioItem.carousel_order)
+    )
+
+    # المشاريع المميزة أولاً ثم الأحدث حتى اكتمال العدد
+    portfolio_items = PortfolioItem.query.filter_by(featured=True).order_by(
+        PortfolioItem.created_at.desc()).limit(FEATURED_ITEMS_LIMIT).all()
+    if len(portfolio_items) < FEATURED_ITEMS_LIMIT:
+        portfolio_items += PortfolioItem.query.filter_by(featured=False).order_by(
+            PortfolioItem.created_at.desc()).limit(FEATURED_ITEMS_LIMIT - len(portfolio_items)).all()
+
+    return ContentSnapshot(
+        lang=lang,
+        section_data=MappingProxyType(section_data),
+        contact_info=contact_info,
+        testimonials=testimonials,
+        services=services,
+        social_media_links=social_media_links,
+        homepage_carousel_items=homepage_carousel_items,
+        portfolio_carousel_items=portfolio_carousel_items,
+        portfolio_items=tuple(_portfolio_card(item, lang) for item in portfolio_items),
+        built_at=time.time()
+    )
+
+
+class ContentSnapshotCache:
+    """لقطة لكل لغة في ذاكرة العملية، تلغى عند تأكيد كتابة على المحتوى"""
+
+    def __init__(self, ttl=300, version_path=None):
+        self.enabled = True
+        self.ttl = ttl
+        self.version_path = version_path
+        self._snapshots = {}  # lang -> (snapshot, version)
+        # يزداد مع كل إلغاء في هذه العملية (تستخدمه ذاكرة الصفحات المؤقتة أيضًا)
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._listening = False
+        self.counters = {
+            'hits': 0,
+            'builds': 0,
+            'invalidations': 0
+        }
+
+    def init_app(self, app):
+        """قراءة الإعدادات وتسجيل مستمعي الكتابة (مرة واحدة لكل عملية)"""
+        self.enabled = app.config['CONTENT_SNAPSHOT_ENABLED']
+        self.ttl = app.config['CONTENT_SNAPSHOT_TTL']
+        self.version_path = app.config['CONTENT_SNAPSHOT_VERSION_PATH']
+        if not self._listening:
+            event.listen(Session, 'after_flush', self._after_flush)
+            event.listen(Session, 'after_commit', self._after_commit)
+            event.listen(Session, 'after_soft_rollback', self._after_rollback)
+            self._listening = True
+
+    def _shared_version(self):
+        """إصدار المحتوى المشترك بين العمليات (وقت تعديل ملف الإصدار)"""
+        if not self.version_path:
+            return 0
+        try:
+            return os.stat(self.version_path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def version_token(self):
+        """إصدار المحتوى الحالي (يتغير مع أي إلغاء في هذه العملية أو في عملية أخرى)"""
+        return self.generation, self._shared_version()
+
+    def get(self, lang='ar'):
+        """
+        لقطة المحتوى للغة (بدون أي استعلام إذا كانت محفوظة وصالحة)
+
+        Returns:
+            ContentSnapshot
+        """
+        if not self.enabled:
+            return load_snapshot(lang)
+
+        version = self._shared_version()
+        with self._lock:
+            entry = self._snapshots.get(lang)
+        if entry is not None and entry[1] == version and time.time() - entry[0].built_at < self.ttl:
+            with self._lock:
+                self.counters['hits'] += 1
+            return entry[0]
+
+        # بناء واحد فقط في نفس الوقت حتى لا تبني كل الخيوط نفس اللقطة بعد الإلغاء
+        with self._build_lock:
+            with self._lock:
+                entry = self._snapshots.get(lang)
+            if entry is not None and entry[1] == version and time.time() - entry[0].built_at < self.ttl:
+                return entry[0]
+
+            snapshot = load_snapshot(lang)
+            with self._lock:
+                self._snapshots[lang] = (snapshot, version)
+                self.counters['builds'] += 1
+            return snapshot
+
+    def invalidate(self):
+        """إلغاء اللقطات في هذه العملية وإبلاغ العمليات الأخرى"""
+        with self._lock:
+            self._snapshots.clear()
+            self.generation += 1
+            self.counters['invalidations'] += 1
+        if self.version_path:
+            try:
+                with open(self.version_path, 'a'):
+                    pass
+                os.utime(self.version_path)
+            except OSError as e:
+                logging.error(f"Error updating content snapshot version file: {str(e)}")
+
+    def _changes_snapshot(self, obj):
+        """هل يغير تعديل الكائن محتوى اللقطة (وليس عداداته فقط)"""
+        ignored = IGNORED_COLUMNS.get(type(obj))
+        if not ignored:
+            return True
+        state = inspect(obj)
+        return any(
+            attr.key not in ignored and attr.history.has_changes()
+            for attr in state.attrs
+        )
+
+    def _after_flush(self, session, flush_context):
+        if session.info.get('content_snapshot_dirty'):
+            return
+        for obj in session.new | session.deleted:
+            if isinstance(obj, SNAPSHOT_MODELS):
+                session.info['content_snapshot_dirty'] = True
+                return
+        for obj in session.dirty:
+            if isinstance(obj, SNAPSHOT_MODELS) and self._changes_snapshot(obj):
+                session.info['content_snapshot_dirty'] = True
+                return
+
+    def _after_commit(self, session):
+        if session.info.pop('content_snapshot_dirty', False):
+            self.invalidate()
+
+    def _after_rollback(self, session, previous_transaction):
+        session.info.pop('content_snapshot_dirty', None)
+
+    def get_stats(self):
+        """حالة اللقطة للمراقبة"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['languages'] = sorted(self._snapshots)
+        stats['enabled'] = self.enabled
+        stats['ttl'] = self.ttl
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+content_snapshot = ContentSnapshotCache()
+
+
+def init_content_snapshot(app):
+    """
+    تهيئة لقطة محتوى الموقع
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('CONTENT_SNAPSHOT_ENABLED', os.environ.get('CONTENT_SNAPSHOT_ENABLED', '1') != '0')
+    app.config.setdefault('CONTENT_SNAPSHOT_TTL', int(os.environ.get('CONTENT_SNAPSHOT_TTL', 300)))
+    app.config.setdefault('CONTENT_SNAPSHOT_VERSION_PATH', os.environ.get(
+        'CONTENT_SNAPSHOT_VERSION_PATH', os.path.join(tempfile.gettempdir(), 'content_snapshot.version')))
+
+    content_snapshot.init_app(app)
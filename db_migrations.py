@@ -0,0 +1,172 @@
+"""
+ترحيلات مخطط قاعدة البيانات
+db.create_all() ينشئ الجداول الجديدة فقط ولا يضيف الأعمدة أو الفهارس الجديدة إلى الجداول الموجودة،
+لذلك نضيف هنا الأعمدة والفهارس المفقودة عند بدء التشغيل (يعمل مع SQLite و PostgreSQL)
+
+يمكن تشغيله مباشرة: python db_migrations.py
+"""
+import logging
+
+from sqlalchemy import inspect, text
+
+from database import db
+
+# الأعمدة المضافة بعد إنشاء الجداول: (الجدول، العمود، تعريف SQL)
+REQUIRED_COLUMNS = [
+    ('visitor', 'last_page_visit_id', 'INTEGER'),
+    ('portfolio_item', 'comments_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('portfolio_item', 'approved_comments_count', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# ترحيلات الفهارس المرقمة: (الإصدار، [(الجدول، اسم الفهرس، الأعمدة)])
+# كل إصدار يطبق مرة واحدة ويسجل في جدول schema_migration؛ لا تعدل إصدارًا مطبقًا بل أضف إصدارًا جديدًا.
+# نفس الفهارس معرفة في __table_args__ للنماذج حتى ينشئها db.create_all() في قواعد البيانات الجديدة.
+# لاقتراح فهارس جديدة من الاستعلامات الفعلية: python query_audit.py record
+INDEX_MIGRATIONS = [
+    ('0001_portfolio_view_period', [
+        ('portfolio_view', 'ix_portfolio_view_portfolio_created', ('portfolio_id', 'created_at')),
+        ('portfolio_view', 'ix_portfolio_view_created_at', ('created_at',)),
+    ]),
+    ('0002_hot_access_paths', [
+        ('page_visit', 'ix_page_visit_visitor_exit', ('visitor_id', 'exit_page')),
+        ('page_visit', 'ix_page_visit_visited_at', ('visited_at',)),
+        ('portfolio_view', 'ix_portfolio_view_portfolio_session', ('portfolio_id', 'session_id')),
+        ('portfolio_view', 'ix_portfolio_view_portfolio_ip', ('portfolio_id', 'ip_address')),
+        ('portfolio_view', 'ix_portfolio_view_visitor_id', ('visitor_id',)),
+        ('user_activity', 'ix_user_activity_type_created', ('activity_type', 'created_at')),
+        ('user_activity', 'ix_user_activity_created_at', ('created_at',)),
+        ('portfolio_comment', 'ix_portfolio_comment_portfolio_approved_created',
+         ('portfolio_id', 'approved', 'created_at')),
+        ('portfolio_comment', 'ix_portfolio_comment_approved_status', ('approved', 'status')),
+        ('portfolio_comment', 'ix_portfolio_comment_parent_id', ('parent_id',)),
+        ('portfolio_like', 'ix_portfolio_like_portfolio_user', ('portfolio_id', 'user_id')),
+        ('portfolio_like', 'ix_portfolio_like_portfolio_session', ('portfolio_id', 'session_id')),
+        ('portfolio_like', 'ix_portfolio_like_portfolio_fingerprint', ('portfolio_id', 'fingerprint')),
+        ('portfolio_like', 'ix_portfolio_like_portfolio_ip', ('portfolio_id', 'ip_address')),
+        ('portfolio_like', 'ix_portfolio_like_portfolio_user_ip', ('portfolio_id', 'user_ip')),
+        ('comment_like', 'ix_comment_like_comment_user', ('comment_id', 'user_id')),
+        ('comment_like', 'ix_comment_like_comment_session', ('comment_id', 'session_id')),
+        ('comment_like', 'ix_comment_like_comment_fingerprint', ('comment_id', 'fingerprint')),
+        ('comment_like', 'ix_comment_like_comment_ip', ('comment_id', 'ip_address')),
+        ('contact_message', 'ix_contact_message_read', ('read',)),
+        ('service_request', 'ix_service_request_status', ('status',)),
+        ('visitor', 'ix_visitor_last_visit', ('last_visit',)),
+    ]),
+    ('0003_portfolio_item_keyset', [
+        ('portfolio_item', 'ix_portfolio_item_created_id', ('created_at', 'id')),
+        ('portfolio_item', 'ix_portfolio_item_category_created_id', ('category', 'created_at', 'id')),
+    ]),
+    ('0004_portfolio_tags', [
+        ('portfolio_item_tag', 'ix_portfolio_item_tag_tag_item', ('tag_id', 'portfolio_item_id')),
+    ]),
+]
+
+# كل الفهارس المطلوبة بغض النظر عن الإصدار
+REQUIRED_INDEXES = [index for _, indexes in INDEX_MIGRATIONS for index in indexes]
+
+
+def apply_column_migrations():
+    """
+    إضافة الأعمدة المفقودة إلى الجداول الموجودة
+
+    Returns:
+        list: الأعمدة التي تمت إضافتها بصيغة table.column
+    """
+    inspector = inspect(db.engine)
+    added = []
+
+    for table, column, ddl in REQUIRED_COLUMNS:
+        if not inspector.has_table(table):
+            continue
+
+        existing_columns = {col['name'] for col in inspector.get_columns(table)}
+        if column in existing_columns:
+            continue
+
+        try:
+            db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+            db.session.commit()
+            added.append(f"{table}.{column}")
+            logging.info(f"تمت إضافة العمود {column} إلى جدول {table}")
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"حدث خطأ أثناء إضافة العمود {column} إلى جدول {table}: {str(e)}")
+
+    return added
+
+
+def _create_index(table, index_name, columns):
+    """إنشاء فهرس إذا لم يكن موجودًا (في PostgreSQL بدون قفل الكتابة على الجدول)"""
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    if db.engine.dialect.name == 'postgresql':
+        # CONCURRENTLY لا يعمل داخل معاملة
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON "{table}" ({column_list})'
+            ))
+    else:
+        db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {index_name} ON "{table}" ({column_list})'))
+        db.session.commit()
+
+
+def apply_index_migrations():
+    """
+    تطبيق ترحيلات الفهارس المرقمة التي لم تطبق بعد
+
+    Returns:
+        list: أسماء الفهارس التي تم إنشاؤها
+    """
+    from models import SchemaMigration
+
+    inspector = inspect(db.engine)
+    if not inspector.has_table(SchemaMigration.__tablename__):
+        SchemaMigration.__table__.create(db.engine)
+    applied = {migration.version for migration in SchemaMigration.query.all()}
+    created = []
+
+    for version, indexes in INDEX_MIGRATIONS:
+        if version in applied:
+            continue
+
+        failed = False
+        for table, index_name, columns in indexes:
+            if not inspector.has_table(table):
+                continue
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table)}
+            if index_name in existing_indexes:
+                continue
+
+            try:
+                _create_index(table, index_name, columns)
+                created.append(index_name)
+                logging.info(f"تم إنشاء الفهرس {index_name} على جدول {table}")
+            except Exception as e:
+                db.session.rollback()
+                failed = True
+                logging.error(f"حدث خطأ أثناء إنشاء الفهرس {index_name} على جدول {table}: {str(e)}")
+
+        # الإصدار لا يسجل إلا إذا أنشئت كل فهارسه، فيعاد المحاولة في التشغيل التالي
+        if not failed:
+            db.session.add(SchemaMigration(version=version))
+            db.session.commit()
+            logging.info(f"تم تطبيق ترحيل الفهارس {version}")
+
+    return created
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        added_columns = apply_column_migrations()
+        if added_columns:
+            print(f"تمت إضافة الأعمدة: {', '.join(added_columns)}")
+        else:
+            print("قاعدة البيانات محدثة، لا توجد أعمدة مفقودة")
+
+        created_indexes = apply_index_migrations()
+        if created_indexes:
+            print(f"تم إنشاء الفهارس: {', '.join(created_indexes)}")
+        else:
+            print("لا توجد فهارس مفقودة")
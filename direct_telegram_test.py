@@ -125,7 +125,7 @@ def test_contact_message():
         subject="استفسار عن الخدمات"
     )
     
-    success = send_telegram_message(formatted_message)
+    success = send_telegram_message(formatted_message, wait=True)
     
     return jsonify({
         'success': success,
@@ -141,7 +141,7 @@ def test_comment():
         comment_text="تصميم رائع وألوان متناسقة وسرعة تحميل ممتازة!"
     )
     
-    success = send_telegram_message(formatted_message)
+    success = send_telegram_message(formatted_message, wait=True)
     
     return jsonify({
         'success': success,
@@ -158,7 +158,7 @@ def test_testimonial():
         rating=5
     )
     
-    success = send_telegram_message(formatted_message)
+    success = send_telegram_message(formatted_message, wait=True)
     
     return jsonify({
         'success': success,
@@ -176,7 +176,7 @@ def test_service_request():
         phone="+2010000000"
     )
     
-    success = send_telegram_message(formatted_message)
+    success = send_telegram_message(formatted_message, wait=True)
     
     return jsonify({
         'success': success,
@@ -192,7 +192,7 @@ def test_like():
         content_title="تطبيق إدارة المهام"
     )
     
-    success = send_telegram_message(formatted_message)
+    success = send_telegram_message(formatted_message, wait=True)
     
     return jsonify({
         'success': success,
@@ -208,7 +208,7 @@ def test_registration():
         display_name="مستخدم جديد"
     )
     
-    success = send_telegram_message(formatted_message)
+    success = send_telegram_message(formatted_message, wait=True)
     
     return jsonify({
         'success': success,
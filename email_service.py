@@ -1,19 +1,17 @@
-import os
-import sys
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content
+import logging
 
-sendgrid_key = os.environ.get('SENDGRID_API_KEY')
+from mail_dispatcher import mail_dispatcher, OutgoingMail, STATUS_DROPPED, STATUS_FAILED
 
-def send_email(
+def queue_email(
     to_email: str,
     from_email: str,
     subject: str,
     text_content: str | None = None,
-    html_content: str | None = None
-) -> bool:
+    html_content: str | None = None,
+    batch: bool = False
+) -> OutgoingMail | None:
     """
-    Send an email using SendGrid.
+    Queue an email for background delivery through the mail dispatcher.
     
     Args:
         to_email: Recipient email address
@@ -21,40 +19,51 @@ def send_email(
         subject: Email subject
         text_content: Plain text content (if html_content is None)
         html_content: HTML content (takes precedence over text_content)
+        batch: Admin notification that may be merged with others sent in the same window
         
     Returns:
-        bool: True if email was sent successfully, False otherwise
+        OutgoingMail: The queued message (its id can be used to track its status), or None if there is no content
     """
-    if not sendgrid_key:
-        print("SendGrid API key not set", file=sys.stderr)
-        return False
-        
-    # طباعة معلومات إرسال البريد الإلكتروني للتحقق
-    print(f"Preparing to send email to {to_email} with subject: {subject}")
+    if not html_content and not text_content:
+        logging.error("No content provided for email")
+        return None
     
-    sg = SendGridAPIClient(sendgrid_key)
-
-    message = Mail(
-        from_email=Email(from_email),
-        to_emails=To(to_email),
-        subject=subject
+    logging.info(f"Queueing email to {to_email} with subject: {subject}")
+    
+    mail = OutgoingMail(
+        to_email=to_email,
+        from_email=from_email,
+        subject=subject,
+        text_content=text_content,
+        html_content=html_content,
+        batch=batch
     )
+    return mail_dispatcher.submit(mail)
 
-    if html_content:
-        message.content = Content("text/html", html_content)
-    elif text_content:
-        message.content = Content("text/plain", text_content)
-    else:
-        print("No content provided for email", file=sys.stderr)
-        return False
-
-    try:
-        sg.send(message)
-        print(f"Email sent successfully to {to_email}")
-        return True
-    except Exception as e:
-        print(f"SendGrid error: {e}", file=sys.stderr)
-        return False
+def send_email(
+    to_email: str,
+    from_email: str,
+    subject: str,
+    text_content: str | None = None,
+    html_content: str | None = None,
+    batch: bool = False
+) -> bool:
+    """
+    Send an email using SendGrid (queued, the request does not wait for SendGrid).
+    
+    Args:
+        to_email: Recipient email address
+        from_email: Sender email address
+        subject: Email subject
+        text_content: Plain text content (if html_content is None)
+        html_content: HTML content (takes precedence over text_content)
+        batch: Admin notification that may be merged with others sent in the same window
+        
+    Returns:
+        bool: True if email was accepted for delivery, False otherwise
+    """
+    mail = queue_email(to_email, from_email, subject, text_content, html_content, batch)
+    return mail is not None and mail.status not in (STATUS_DROPPED, STATUS_FAILED)
 
 def send_contact_form_notification(name: str, email: str, subject: str, message: str, admin_email: str) -> bool:
     """
@@ -88,7 +97,8 @@ def send_contact_form_notification(name: str, email: str, subject: str, message:
         to_email=admin_email,
         from_email="noreply@firas-designs.com",
         subject=f"رسالة جديدة: {subject}",
-        html_content=html_content
+        html_content=html_content,
+        batch=True
     )
 
 def send_comment_notification(name: str, email: str, portfolio_title: str, comment: str, admin_email: str) -> bool:
@@ -128,7 +138,8 @@ def send_comment_notification(name: str, email: str, portfolio_title: str, comme
         to_email=admin_email,
         from_email="noreply@firas-designs.com",
         subject="تعليق جديد بانتظار الموافقة",
-        html_content=html_content
+        html_content=html_content,
+        batch=True
     )
 
 def send_testimonial_notification(name: str, company: str, rating: int, content: str, admin_email: str) -> bool:
@@ -176,5 +187,6 @@ def send_testimonial_notification(name: str, company: str, rating: int, content:
         to_email=admin_email,
         from_email="noreply@firas-designs.com",
         subject="تقييم جديد بانتظار الموافقة",
-        html_content=html_content
+        html_content=html_content,
+        batch=True
     )
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+ترقيم صفحات معرض الأعمال بالمؤشر (keyset pagination)
+OFFSET يجعل قاعدة البيانات تقرأ كل الصفوف السابقة ثم تتجاهلها، فتزداد كلفة الصفحة كلما تعمق الزائر
+في التمرير اللانهائي، وكانت كل صفحة تنفذ COUNT إضافيًا. هنا ترتب المشاريع حسب (created_at, id) تنازليًا
+وتبدأ كل صفحة بعد آخر عنصر في الصفحة السابقة مباشرة عبر الفهرس، بكلفة ثابتة مهما كان العمق:
+
+- المؤشر نص مبهم موقع بمفتاح التطبيق (لا يمكن تعديله أو بناؤه من خارج الخادم)
+- وجود صفحة تالية يعرف بجلب عنصر إضافي واحد بدلاً من COUNT
+- العدد الكلي اختياري (include_total=1) ومحفوظ حتى يتغير إصدار لقطة المحتوى (إضافة أو حذف مشروع)
+"""
+
+import threading
+from datetime import datetime
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import or_
+
+from content_snapshot import content_snapshot
+from models import PortfolioItem
+
+CURSOR_SALT = 'portfolio-cursor'
+MAX_PAGE_SIZE = 50
+
+
+class InvalidCursor(ValueError):
+    """مؤشر تالف أو موقع بمفتاح آخر"""
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.secret_key, salt=CURSOR_SALT)
+
+
+def encode_cursor(item):
+    """
+    مؤشر الصفحة التالية بعد عنصر
+
+    Args:
+        item: آخر مشروع في الصفحة الحالية
+
+    Returns:
+        str: مؤشر مبهم
+    """
+    # created_at له قيمة افتراضية دائمًا؛ العنصر القديم بدون تاريخ ينهي التمرير بدلاً من تكرار الصفحات
+    return _serializer().dumps([(item.created_at or datetime.min).isoformat(), item.id])
+
+
+def decode_cursor(cursor):
+    """
+    قراءة المؤشر
+
+    Returns:
+        tuple: (created_at, id)
+
+    Raises:
+        InvalidCursor: إذا كان المؤشر تالفًا
+    """
+    try:
+        created_at, item_id = _serializer().loads(cursor)
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (BadSignature, TypeError, ValueError) as e:
+        raise InvalidCursor(str(e))
+
+
+def keyset_page(query, limit, cursor=None):
+    """
+    صفحة من المشاريع بعد المؤشر، بالترتيب من الأحدث إلى الأقدم
+
+    Args:
+        query: استعلام PortfolioItem (مع أي فلترة، بدون ترتيب)
+        limit (int): حجم الصفحة
+        cursor (str): مؤشر الصفحة السابقة (None للصفحة الأولى)
+
+    Returns:
+        tuple: (العناصر، هل توجد صفحة تالية، مؤشر الصفحة التالية أو None)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        # (created_at, id) < (c, i) بصيغة تعمل في كل قواعد البيانات؛ الشرط created_at <= c
+        # يعطي قاعدة البيانات نطاقًا على أول عمود في الفهرس بدلاً من مسحه من البداية
+        query = query.filter(
+            PortfolioItem.created_at <= created_at,
+            or_(PortfolioItem.created_at < created_at, PortfolioItem.id < item_id)
+        )
+
+    items = query.order_by(PortfolioItem.created_at.desc(), PortfolioItem.id.desc()).limit(limit + 1).all()
+    has_more = len(items) > limit
+    items = items[:limit]
+    next_cursor = encode_cursor(items[-1]) if has_more else None
+    return items, has_more, next_cursor
+
+
+class TotalCountCache:
+    """العدد الكلي للمشاريع لكل فلتر، صالح حتى يتغير إصدار لقطة المحتوى"""
+
+    def __init__(self):
+        self._counts = {}  # key -> (version, count)
+        self._lock = threading.Lock()
+
+    def get(self, key, query):
+        version = content_snapshot.version_token()
+        with self._lock:
+            entry = self._counts.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        count = query.order_by(None).count()
+        with self._lock:
+            self._counts[key] = (version, count)
+        return count
+
+
+# نسخة مشتركة على مستوى العملية
+total_counts = TotalCountCache()
@@ -0,0 +1,572 @@
+"""
+سجل مشترك للزوار النشطين بين عمال gunicorn
+كل عامل كان يحتفظ بقواميس خاصة به، فيرى جزءًا فقط من الزوار ويرسل إشعارات مكررة.
+هذه الوحدة توفر واجهة واحدة بعدة خلفيات:
+- sqlite: ملف SQLite بوضع WAL مشترك بين العمال على نفس الخادم (الافتراضي)
+- redis: أي خادم يدعم بروتوكول Redis (Redis أو بديل محلي متوافق) عبر حزمة redis الاختيارية
+- memory: قواميس داخل العملية (عامل واحد فقط، للتطوير)
+
+كل تحديث نبض (heartbeat) ذري، ومطالبة الإشعار ذرية حتى يرسل عامل واحد فقط الإشعار،
+وحذف الزوار المنتهين يقوم به مالك واحد يحمل عقد إيجار (lease) متجدد
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+BACKEND_MEMORY = 'memory'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_REDIS = 'redis'
+
+# مدة النشاط: الزائر الذي لم يرسل نبضًا خلال هذه المدة لا يعتبر نشطًا (15 دقيقة)
+DEFAULT_ACTIVE_TTL = 900
+# عدد الصفحات المحفوظة لكل زائر
+DEFAULT_MAX_PAGES = 10
+# الحد الأقصى لعدد الزوار المتتبعين معًا؛ عند تجاوزه يحذف الأقدم ظهورًا حتى لو لم تنته مدة نشاطه
+DEFAULT_MAX_VISITORS = 10000
+
+
+def _visitor_record(visitor_id, info, current_page, page_title, last_seen, pages):
+    """بناء سجل الزائر الموحد الذي تعيده كل الخلفيات"""
+    record = dict(info)
+    if current_page is not None:
+        record['current_page'] = current_page
+    if page_title is not None:
+        record['page_title'] = page_title
+    record['last_seen'] = datetime.fromtimestamp(last_seen)
+    record['visited_pages'] = pages
+    record['id'] = visitor_id
+    return record
+
+
+class MemoryLiveRegistry:
+    """
+    سجل داخل العملية (لا يشارك بين العمال)
+    الزوار مرتبون حسب آخر ظهور في OrderedDict: كل نبض ينقل الزائر إلى النهاية،
+    فيكون الأقدم دائمًا في البداية ويتم الحذف منها دون المرور على كل الزوار
+    """
+
+    def __init__(self, active_ttl=DEFAULT_ACTIVE_TTL, max_pages=DEFAULT_MAX_PAGES, max_visitors=DEFAULT_MAX_VISITORS):
+        self.active_ttl = active_ttl
+        self.max_pages = max_pages
+        self.max_visitors = max_visitors
+        # visitor_id -> {'info', 'current_page', 'page_title', 'last_seen', 'last_notified', 'pages'}
+        self._visitors = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _touch(self, visitor_id, entry, now):
+        """تحديث وقت آخر ظهور ونقل الزائر إلى نهاية الترتيب"""
+        # time.time() قد يتراجع قليلاً بين الخيوط، فلا نسمح بقيمة أقدم من آخر زائر حتى يبقى الترتيب صحيحًا
+        if self._visitors:
+            newest = self._visitors[next(reversed(self._visitors))]
+            now = max(now, newest['last_seen'])
+        entry['last_seen'] = now
+        self._visitors[visitor_id] = entry
+        self._visitors.move_to_end(visitor_id)
+
+    def _evict(self, now):
+        """حذف الزوار المنتهين من بداية الترتيب، ثم الأقدم إذا تجاوز العدد الحد الأقصى. يعيد عدد المحذوفين"""
+        threshold = now - self.active_ttl
+        removed = 0
+        while self._visitors:
+            oldest_id = next(iter(self._visitors))
+            if self._visitors[oldest_id]['last_seen'] >= threshold and len(self._visitors) <= self.max_visitors:
+                break
+            del self._visitors[oldest_id]
+            removed += 1
+        self.evicted += removed
+        return removed
+
+    def heartbeat(self, visitor_id, info):
+        """تحديث معلومات الزائر ووقت آخر ظهور. يعيد True إذا كان الزائر جديدًا (أو عاد بعد انتهاء نشاطه)"""
+        now = time.time()
+        with self._lock:
+            entry = self._visitors.pop(visitor_id, None)
+            is_new = entry is None or entry['last_seen'] < now - self.active_ttl
+            if entry is None:
+                entry = {'last_notified': None, 'pages': deque(maxlen=self.max_pages)}
+            entry['info'] = dict(info)
+            entry['current_page'] = info.get('current_page')
+            entry['page_title'] = info.get('page_title')
+            self._touch(visitor_id, entry, now)
+            self._evict(now)
+            return is_new
+
+    def add_page(self, visitor_id, page_url, page_title, page_label):
+        """إضافة صفحة إلى سجل الزائر وتحديث صفحته الحالية. يعيد عدد الصفحات المحفوظة"""
+        now = time.time()
+        with self._lock:
+            entry = self._visitors.get(visitor_id)
+            if entry is None:
+                return 0
+            # deque بطول ثابت: الصفحة الأقدم تسقط تلقائيًا
+            entry['pages'].append((page_url, page_label))
+            entry['current_page'] = page_url
+            entry['page_title'] = page_title
+            self._touch(visitor_id, entry, now)
+            return len(entry['pages'])
+
+    def get_pages(self, visitor_id):
+        with self._lock:
+            entry = self._visitors.get(visitor_id)
+            return list(entry['pages']) if entry else []
+
+    def contains(self, visitor_id):
+        with self._lock:
+            entry = self._visitors.get(visitor_id)
+            return entry is not None and entry['last_seen'] >= time.time() - self.active_ttl
+
+    def claim_notification(self, visitor_id, interval, force=False):
+        """
+        مطالبة ذرية بإرسال إشعار الزائر: True إذا لم يرسل إشعار عنه خلال المدة المحددة
+        (force لتسجيل الإشعار دون شرط، للزائر الجديد)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._visitors.get(visitor_id)
+            if entry is None:
+                return False
+            if not force and entry['last_notified'] is not None and entry['last_notified'] > now - interval:
+                return False
+            entry['last_notified'] = now
+            return True
+
+    def count(self):
+        with self._lock:
+            self._evict(time.time())
+            return len(self._visitors)
+
+    def list_visitors(self):
+        with self._lock:
+            self._evict(time.time())
+            return [
+                _visitor_record(visitor_id, entry['info'], entry['current_page'], entry['page_title'],
+                                entry['last_seen'], list(entry['pages']))
+                for visitor_id, entry in self._visitors.items()
+            ]
+
+    def get_index(self):
+        """خريطة مختصرة للزوار النشطين: visitor_id -> (الصفحة الحالية، عنوانها) لحساب التغييرات"""
+        with self._lock:
+            self._evict(time.time())
+            return {
+                visitor_id: (entry['current_page'], entry['page_title'])
+                for visitor_id, entry in self._visitors.items()
+            }
+
+    def get_visitor(self, visitor_id):
+        """سجل زائر نشط واحد، أو None"""
+        with self._lock:
+            entry = self._visitors.get(visitor_id)
+            if entry is None or entry['last_seen'] < time.time() - self.active_ttl:
+                return None
+            return _visitor_record(visitor_id, entry['info'], entry['current_page'], entry['page_title'],
+                                   entry['last_seen'], list(entry['pages']))
+
+    def expire(self):
+        """حذف الزوار غير النشطين. يعيد عدد المحذوفين"""
+        with self._lock:
+            return self._evict(time.time())
+
+    def acquire_lease(self, name, owner, ttl):
+        """عملية واحدة فقط: المالك دائمًا هو العملية الحالية"""
+        return True
+
+
+class SQLiteLiveRegistry:
+    """سجل مشترك في ملف SQLite بوضع WAL (للعمال على نفس الخادم)"""
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS live_visitor (
+            visitor_id TEXT PRIMARY KEY,
+            info TEXT NOT NULL,
+            current_page TEXT,
+            page_title TEXT,
+            last_seen REAL NOT NULL,
+            last_notified REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_live_visitor_last_seen ON live_visitor (last_seen)",
+        """CREATE TABLE IF NOT EXISTS live_visitor_page (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            visitor_id TEXT NOT NULL,
+            page_url TEXT,
+            page_label TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_live_visitor_page_visitor ON live_visitor_page (visitor_id, id)",
+        """CREATE TABLE IF NOT EXISTS registry_lease (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )""",
+    )
+
+    def __init__(self, path, active_ttl=DEFAULT_ACTIVE_TTL, max_pages=DEFAULT_MAX_PAGES, max_visitors=DEFAULT_MAX_VISITORS):
+        self.path = path
+        self.active_ttl = active_ttl
+        self.max_pages = max_pages
+        self.max_visitors = max_visitors
+        self._local = threading.local()
+        with self._transaction() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        """اتصال لكل خيط (ولكل عملية بعد fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._connect())
+
+    def heartbeat(self, visitor_id, info):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT last_seen FROM live_visitor WHERE visitor_id = ?', (visitor_id,)).fetchone()
+            conn.execute(
+                """INSERT INTO live_visitor (visitor_id, info, current_page, page_title, last_seen)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (visitor_id) DO UPDATE SET
+                       info = excluded.info,
+                       current_page = excluded.current_page,
+                       page_title = excluded.page_title,
+                       last_seen = excluded.last_seen""",
+                (visitor_id, json.dumps(info, default=str), info.get('current_page'), info.get('page_title'), now)
+            )
+            if row is None:
+                self._enforce_cap(conn)
+        return row is None or row[0] < now - self.active_ttl
+
+    def _enforce_cap(self, conn):
+        """حذف الزوار الأقدم ظهورًا إذا تجاوز العدد الحد الأقصى (يستدعى عند إضافة زائر جديد فقط)"""
+        overflow = conn.execute('SELECT COUNT(*) FROM live_visitor').fetchone()[0] - self.max_visitors
+        if overflow <= 0:
+            return
+        oldest = [row[0] for row in conn.execute(
+            'SELECT visitor_id FROM live_visitor ORDER BY last_seen LIMIT ?', (overflow,)
+        )]
+        conn.executemany('DELETE FROM live_visitor_page WHERE visitor_id = ?', [(visitor_id,) for visitor_id in oldest])
+        conn.executemany('DELETE FROM live_visitor WHERE visitor_id = ?', [(visitor_id,) for visitor_id in oldest])
+
+    def add_page(self, visitor_id, page_url, page_title, page_label):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO live_visitor_page (visitor_id, page_url, page_label) VALUES (?, ?, ?)',
+                (visitor_id, page_url, page_label)
+            )
+            conn.execute(
+                """DELETE FROM live_visitor_page WHERE visitor_id = ? AND id NOT IN (
+                       SELECT id FROM live_visitor_page WHERE visitor_id = ? ORDER BY id DESC LIMIT ?)""",
+                (visitor_id, visitor_id, self.max_pages)
+            )
+            conn.execute(
+                'UPDATE live_visitor SET current_page = ?, page_title = ?, last_seen = ? WHERE visitor_id = ?',
+                (page_url, page_title, now, visitor_id)
+            )
+            return conn.execute('SELECT COUNT(*) FROM live_visitor_page WHERE visitor_id = ?', (visitor_id,)).fetchone()[0]
+
+    def get_pages(self, visitor_id):
+        return [tuple(row) for row in self._connect().execute(
+            'SELECT page_url, page_label FROM live_visitor_page WHERE visitor_id = ? ORDER BY id', (visitor_id,)
+        )]
+
+    def contains(self, visitor_id):
+        row = self._connect().execute(
+            'SELECT 1 FROM live_visitor WHERE visitor_id = ? AND last_seen >= ?',
+            (visitor_id, time.time() - self.active_ttl)
+        ).fetchone()
+        return row is not None
+
+    def claim_notification(self, visitor_id, interval, force=False):
+        now = time.time()
+        cursor = self._connect().execute(
+            """UPDATE live_visitor SET last_notified = ?
+               WHERE visitor_id = ? AND (? OR last_notified IS NULL OR last_notified <= ?)""",
+            (now, visitor_id, force, now - interval)
+        )
+        return cursor.rowcount == 1
+
+    def count(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM live_visitor WHERE last_seen >= ?', (time.time() - self.active_ttl,)
+        ).fetchone()[0]
+
+    def list_visitors(self):
+        threshold = time.time() - self.active_ttl
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT visitor_id, info, current_page, page_title, last_seen FROM live_visitor WHERE last_seen >= ?',
+            (threshold,)
+        ).fetchall()
+
+        pages = defaultdict(list)
+        for visitor_id, page_url, page_label in conn.execute(
+            """SELECT visitor_id, page_url, page_label FROM live_visitor_page
+               WHERE visitor_id IN (SELECT visitor_id FROM live_visitor WHERE last_seen >= ?)
+               ORDER BY id""",
+            (threshold,)
+        ):
+            pages[visitor_id].append((page_url, page_label))
+
+        return [
+            _visitor_record(visitor_id, json.loads(info), current_page, page_title, last_seen, pages.get(visitor_id, []))
+            for visitor_id, info, current_page, page_title, last_seen in rows
+        ]
+
+    def get_index(self):
+        rows = self._connect().execute(
+            'SELECT visitor_id, current_page, page_title FROM live_visitor WHERE last_seen >= ?',
+            (time.time() - self.active_ttl,)
+        )
+        return {visitor_id: (current_page, page_title) for visitor_id, current_page, page_title in rows}
+
+    def get_visitor(self, visitor_id):
+        row = self._connect().execute(
+            """SELECT info, current_page, page_title, last_seen FROM live_visitor
+               WHERE visitor_id = ? AND last_seen >= ?""",
+            (visitor_id, time.time() - self.active_ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        info, current_page, page_title, last_seen = row
+        return _visitor_record(visitor_id, json.loads(info), current_page, page_title, last_seen,
+                               self.get_pages(visitor_id))
+
+    def expire(self):
+        threshold = time.time() - self.active_ttl
+        with self._transaction() as conn:
+            conn.execute(
+                """DELETE FROM live_visitor_page
+                   WHERE visitor_id IN (SELECT visitor_id FROM live_visitor WHERE last_seen < ?)""",
+                (threshold,)
+            )
+            return conn.execute('DELETE FROM live_visitor WHERE last_seen < ?', (threshold,)).rowcount
+
+    def acquire_lease(self, name, owner, ttl):
+        """الحصول على عقد الإيجار أو تجديده إذا كان حرًا أو منتهيًا أو مملوكًا لنفس المالك"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                """INSERT INTO registry_lease (name, owner, expires_at) VALUES (?, ?, ?)
+                   ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                   WHERE registry_lease.owner = excluded.owner OR registry_lease.expires_at < ?""",
+                (name, owner, now + ttl, now)
+            )
+            row = conn.execute('SELECT owner FROM registry_lease WHERE name = ?', (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+
+class _ImmediateTransaction:
+    """معاملة BEGIN IMMEDIATE تأخذ قفل الكتابة من البداية لتجنب تعارض الترقية بين العمال"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+
+class RedisLiveRegistry:
+    """سجل مشترك على خادم يدعم بروتوكول Redis (يعمل أيضًا بين عدة خوادم)"""
+
+    def __init__(self, url, active_ttl=DEFAULT_ACTIVE_TTL, max_pages=DEFAULT_MAX_PAGES, max_visitors=DEFAULT_MAX_VISITORS,
+                 prefix='live:'):
+        if redis is None:
+            raise RuntimeError("The redis package is required for the redis live registry backend")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.active_ttl = active_ttl
+        self.max_pages = max_pages
+        self.max_visitors = max_visitors
+        self.prefix = prefix
+        self.seen_key = f"{prefix}seen"  # مجموعة مرتبة: visitor_id -> آخر ظهور
+
+    def _visitor_key(self, visitor_id):
+        return f"{self.prefix}v:{visitor_id}"
+
+    def _pages_key(self, visitor_id):
+        return f"{self.prefix}p:{visitor_id}"
+
+    def heartbeat(self, visitor_id, info):
+        now = time.time()
+        visitor_key = self._visitor_key(visitor_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zscore(self.seen_key, visitor_id)
+        pipe.zadd(self.seen_key, {visitor_id: now})
+        pipe.hset(visitor_key, mapping={
+            'info': json.dumps(info, default=str),
+            'current_page': info.get('current_page') or '',
+            'page_title': info.get('page_title') or ''
+        })
+        pipe.expire(visitor_key, self.active_ttl * 2)
+        pipe.zcard(self.seen_key)
+        results = pipe.execute()
+        previous_seen, total = results[0], results[-1]
+        if total > self.max_visitors:
+            self._enforce_cap(total - self.max_visitors)
+        return previous_seen is None or float(previous_seen) < now - self.active_ttl
+
+    def _enforce_cap(self, overflow):
+        """حذف الزوار الأقدم ظهورًا إذا تجاوز العدد الحد الأقصى"""
+        oldest = self.client.zpopmin(self.seen_key, overflow)
+        if oldest:
+            self.client.delete(*[key for visitor_id, _ in oldest
+                                 for key in (self._visitor_key(visitor_id), self._pages_key(visitor_id))])
+
+    def add_page(self, visitor_id, page_url, page_title, page_label):
+        now = time.time()
+        pages_key = self._pages_key(visitor_id)
+        visitor_key = self._visitor_key(visitor_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(pages_key, json.dumps([page_url, page_label]))
+        pipe.ltrim(pages_key, -self.max_pages, -1)
+        pipe.expire(pages_key, self.active_ttl * 2)
+        pipe.hset(visitor_key, mapping={'current_page': page_url, 'page_title': page_title or ''})
+        pipe.zadd(self.seen_key, {visitor_id: now}, xx=True)
+        pipe.llen(pages_key)
+        return pipe.execute()[-1]
+
+    def get_pages(self, visitor_id):
+        return [tuple(json.loads(page)) for page in self.client.lrange(self._pages_key(visitor_id), 0, -1)]
+
+    def contains(self, visitor_id):
+        last_seen = self.client.zscore(self.seen_key, visitor_id)
+        return last_seen is not None and last_seen >= time.time() - self.active_ttl
+
+    def claim_notification(self, visitor_id, interval, force=False):
+        return bool(self.client.set(f"{self.prefix}n:{visitor_id}", 1, nx=not force, ex=int(interval)))
+
+    def count(self):
+        return self.client.zcount(self.seen_key, time.time() - self.active_ttl, '+inf')
+
+    def list_visitors(self):
+        entries = self.client.zrangebyscore(self.seen_key, time.time() - self.active_ttl, '+inf', withscores=True)
+        if not entries:
+            return []
+
+        pipe = self.client.pipeline(transaction=False)
+        for visitor_id, _ in entries:
+            pipe.hgetall(self._visitor_key(visitor_id))
+            pipe.lrange(self._pages_key(visitor_id), 0, -1)
+        results = pipe.execute()
+
+        visitors = []
+        for index, (visitor_id, last_seen) in enumerate(entries):
+            data, pages = results[index * 2], results[index * 2 + 1]
+            if not data:
+                continue
+            visitors.append(_visitor_record(
+                visitor_id, json.loads(data.get('info', '{}')), data.get('current_page'), data.get('page_title'),
+                last_seen, [tuple(json.loads(page)) for page in pages]
+            ))
+        return visitors
+
+    def get_index(self):
+        visitor_ids = self.client.zrangebyscore(self.seen_key, time.time() - self.active_ttl, '+inf')
+        if not visitor_ids:
+            return {}
+
+        pipe = self.client.pipeline(transaction=False)
+        for visitor_id in visitor_ids:
+            pipe.hmget(self._visitor_key(visitor_id), 'current_page', 'page_title')
+        return {visitor_id: tuple(values) for visitor_id, values in zip(visitor_ids, pipe.execute())}
+
+    def get_visitor(self, visitor_id):
+        last_seen = self.client.zscore(self.seen_key, visitor_id)
+        if last_seen is None or last_seen < time.time() - self.active_ttl:
+            return None
+        data = self.client.hgetall(self._visitor_key(visitor_id))
+        if not data:
+            return None
+        return _visitor_record(visitor_id, json.loads(data.get('info', '{}')), data.get('current_page'),
+                               data.get('page_title'), last_seen, self.get_pages(visitor_id))
+
+    def expire(self):
+        threshold = time.time() - self.active_ttl
+        expired = self.client.zrangebyscore(self.seen_key, '-inf', threshold)
+        if not expired:
+            return 0
+
+        pipe = self.client.pipeline(transaction=True)
+        for visitor_id in expired:
+            pipe.delete(self._visitor_key(visitor_id), self._pages_key(visitor_id))
+        pipe.zremrangebyscore(self.seen_key, '-inf', threshold)
+        pipe.execute()
+        return len(expired)
+
+    def acquire_lease(self, name, owner, ttl):
+        lease_key = f"{self.prefix}lease:{name}"
+        if self.client.set(lease_key, owner, nx=True, ex=int(ttl)):
+            return True
+        if self.client.get(lease_key) == owner:
+            self.client.expire(lease_key, int(ttl))
+            return True
+        return False
+
+
+def create_live_registry(app):
+    """
+    إنشاء خلفية السجل حسب الإعدادات، مع الرجوع إلى الذاكرة المحلية عند تعذر ذلك
+
+    Args:
+        app: تطبيق Flask
+
+    Returns:
+        سجل الزوار النشطين
+    """
+    backend = app.config['LIVE_REGISTRY_BACKEND']
+    active_ttl = app.config['LIVE_VISITOR_TTL']
+    max_pages = app.config['LIVE_VISITOR_MAX_PAGES']
+    max_visitors = app.config['LIVE_VISITOR_MAX_TRACKED']
+
+    try:
+        if backend == BACKEND_SQLITE:
+            return SQLiteLiveRegistry(app.config['LIVE_REGISTRY_PATH'], active_ttl=active_ttl, max_pages=max_pages,
+                                      max_visitors=max_visitors)
+        if backend == BACKEND_REDIS:
+            return RedisLiveRegistry(app.config['LIVE_REGISTRY_URL'], active_ttl=active_ttl, max_pages=max_pages,
+                                     max_visitors=max_visitors)
+        if backend != BACKEND_MEMORY:
+            logging.warning(f"Unknown live registry backend '{backend}', using in-memory registry")
+    except Exception as e:
+        logging.error(f"Could not create '{backend}' live registry, using in-memory registry: {str(e)}")
+
+    return MemoryLiveRegistry(active_ttl=active_ttl, max_pages=max_pages, max_visitors=max_visitors)
+
+
+def configure_live_registry(app):
+    """ضبط إعدادات السجل الافتراضية"""
+    app.config.setdefault('LIVE_REGISTRY_BACKEND', os.environ.get('LIVE_REGISTRY_BACKEND', BACKEND_SQLITE))
+    app.config.setdefault('LIVE_REGISTRY_PATH', os.environ.get(
+        'LIVE_REGISTRY_PATH', os.path.join(tempfile.gettempdir(), 'live_visitors.db')))
+    app.config.setdefault('LIVE_REGISTRY_URL', os.environ.get('LIVE_REGISTRY_URL', 'redis://localhost:6379/0'))
+    app.config.setdefault('LIVE_VISITOR_TTL', int(os.environ.get('LIVE_VISITOR_TTL', DEFAULT_ACTIVE_TTL)))
+    app.config.setdefault('LIVE_VISITOR_MAX_PAGES', int(os.environ.get('LIVE_VISITOR_MAX_PAGES', DEFAULT_MAX_PAGES)))
+    app.config.setdefault('LIVE_VISITOR_MAX_TRACKED', int(os.environ.get('LIVE_VISITOR_MAX_TRACKED', DEFAULT_MAX_VISITORS)))
@@ -3,25 +3,30 @@
 يسمح بتتبع الزوار النشطين وإرسال إشعارات تلغرام عنهم
 """
 
+import atexit
+import json
 import logging
+import os
+import socket
 import threading
 import time
-from collections import defaultdict
 from datetime import datetime, timedelta
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app
 from flask_login import current_user
 
 from models import Visitor
+from live_registry import MemoryLiveRegistry, configure_live_registry, create_live_registry
 from telegram_service import send_telegram_message
+from telegram_digest import telegram_digest, EVENT_LIVE_VISITOR
+from ua_classifier import classify_user_agent, describe_browser, describe_device
 
-# المتغيرات العامة لتتبع الزوار النشطين
-live_visitors = {}
-# قاموس لتخزين وقت آخر إشعار لكل زائر
-last_notification = {}
+# سجل الزوار النشطين المشترك بين العمال (يستبدل بالخلفية المضبوطة عند تهيئة التطبيق)
+registry = MemoryLiveRegistry()
 # المدة الزمنية بين الإشعارات (ساعة واحدة)
 NOTIFICATION_INTERVAL = 3600
-# تتبع حركة الصفحات حسب الزائر
-visitor_pages = defaultdict(list)
+# اسم عقد الإيجار الذي يحدد العامل المسؤول عن حذف الزوار غير النشطين
+EXPIRY_LEASE_NAME = 'live-visitors-expiry'
+EXPIRY_LEASE_TTL = 180
 
 # إنشاء بلوبرنت للتعامل مع مسارات الزوار النشطين
 live_bp = Blueprint('live_visitors', __name__, url_prefix='/api/live')
@@ -40,28 +45,23 @@ def update_live_visitor(visitor_id, visitor_info):
     chat_id = os.environ.get('TELEGRAM_CHAT_ID')
     logging.info(f"ENVIRONMENT CHECK: Bot token exists: {bool(bot_token)}, Chat ID exists: {bool(chat_id)}")
     
-    now = datetime.now()
-    visitor_info['last_seen'] = now
+    visitor_info.pop('last_seen', None)
     
-    # التحقق مما إذا كان الزائر جديدًا (غير موجود في القائمة من قبل)
-    is_new = visitor_id not in live_visitors
-    logging.info(f"Visitor {visitor_id} is new: {is_new}")
-    
-    # تحديث معلومات الزائر
-    live_visitors[visitor_id] = visitor_info
+    # التأكد من أن خيط التنظيف يعمل في هذا العامل
+    start_cleanup_thread()
     
-    # التحقق من وقت آخر إشعار
-    last_notified = last_notification.get(visitor_id, datetime.min)
-    time_since_last_notification = (now - last_notified).total_seconds()
+    # تحديث معلومات الزائر ووقت ظهوره في السجل المشترك (عملية ذرية تحدد إن كان الزائر جديدًا)
+    is_new = registry.heartbeat(visitor_id, visitor_info)
+    logging.info(f"Visitor {visitor_id} is new: {is_new}")
     
     # إرسال إشعار إذا كان الزائر جديدًا أو مرت مدة كافية منذ آخر إشعار
-    logging.info(f"NOTIFICATION CHECK: is_new={is_new}, time_since_last_notification={time_since_last_notification}, threshold={NOTIFICATION_INTERVAL}")
-    if is_new or time_since_last_notification > NOTIFICATION_INTERVAL:
+    # المطالبة ذرية في السجل المشترك، فيرسل عامل واحد فقط الإشعار عن نفس الزائر
+    claimed = registry.claim_notification(visitor_id, NOTIFICATION_INTERVAL, force=is_new)
+    logging.info(f"NOTIFICATION CHECK: is_new={is_new}, claimed={claimed}, threshold={NOTIFICATION_INTERVAL}")
+    if claimed:
         # إرسال إشعار تلغرام عن الزائر النشط حاليًا
         try:
             send_live_visitor_notification(visitor_id, visitor_info, is_new)
-            # تحديث وقت آخر إشعار
-            last_notification[visitor_id] = now
         except Exception as e:
             logging.error(f"Error sending live visitor notification: {str(e)}")
 
@@ -86,6 +86,10 @@ def send_live_visitor_notification(visitor_id, visitor_info, is_new=False):
     chat_id = os.environ.get('TELEGRAM_CHAT_ID')
     logging.info(f"DIRECT ENV CHECK IN send_live_visitor_notification: Bot token exists: {bool(bot_token)}, Chat ID exists: {bool(chat_id)}")
     
+    # في وضع الملخص يضاف الزائر النشط إلى الملخص الدوري بدلاً من رسالة منفصلة
+    if telegram_digest.record(EVENT_LIVE_VISITOR, referrer=visitor_info.get('referer')):
+        return True
+    
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     ip_address = visitor_info.get('ip_address', 'غير معروف')
     user_agent = visitor_info.get('user_agent', 'غير معروف')
@@ -104,36 +108,12 @@ def send_live_visitor_notification(visitor_id, visitor_info, is_new=False):
     device_info = "غير معروف"
     
     if user_agent:
-        # محاولة تحديد نوع المتصفح
-        if "Chrome" in user_agent:
-            browser_info = "Google Chrome"
-        elif "Firefox" in user_agent:
-            browser_info = "Mozilla Firefox"
-        elif "Safari" in user_agent:
-            browser_info = "Safari"
-        elif "Edge" in user_agent:
-            browser_info = "Microsoft Edge"
-        elif "Opera" in user_agent or "OPR" in user_agent:
-            browser_info = "Opera"
-        
-        # محاولة تحديد نوع الجهاز
-        if "Mobile" in user_agent:
-            device_info = "هاتف محمول"
-        elif "Tablet" in user_agent:
-            device_info = "جهاز لوحي"
-        elif "Android" in user_agent:
-            device_info = "جهاز Android"
-        elif "iPhone" in user_agent:
-            device_info = "iPhone"
-        elif "Windows" in user_agent:
-            device_info = "حاسوب Windows"
-        elif "Macintosh" in user_agent or "Mac OS" in user_agent:
-            device_info = "حاسوب Mac"
-        elif "Linux" in user_agent:
-            device_info = "حاسوب Linux"
+        user_agent_info = classify_user_agent(user_agent)
+        browser_info = describe_browser(user_agent_info)
+        device_info = describe_device(user_agent_info)
     
     # تجميع الصفحات التي زارها الزائر
-    visited_pages = ", ".join([f"{page[0]} ({page[1]})" for page in visitor_pages.get(visitor_id, [])])[:200]
+    visited_pages = ", ".join([f"{page[0]} ({page[1]})" for page in registry.get_pages(visitor_id)])[:200]
     if not visited_pages:
         visited_pages = f"{current_page} ({page_title})"
     
@@ -177,26 +157,16 @@ def send_live_visitor_notification(visitor_id, visitor_info, is_new=False):
 def cleanup_inactive_visitors():
     """
     تنظيف قائمة الزوار غير النشطين (الذين مر على آخر نشاط لهم أكثر من 15 دقيقة)
+    يقوم بها عامل واحد فقط يحمل عقد الإيجار، والباقي يتخطونها
     """
-    now = datetime.now()
-    inactive_threshold = now - timedelta(minutes=15)
-    
-    to_remove = []
-    for visitor_id, visitor_info in live_visitors.items():
-        if visitor_info['last_seen'] < inactive_threshold:
-            to_remove.append(visitor_id)
+    # معرف هذه العملية كمالك محتمل لعقد الإيجار (يحسب عند الاستدعاء لأن العمال ينشأون بـ fork)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if not registry.acquire_lease(EXPIRY_LEASE_NAME, owner, EXPIRY_LEASE_TTL):
+        return
     
-    for visitor_id in to_remove:
-        try:
-            # إرسال إشعار بمغادرة الزائر (اختياري)
-            # send_visitor_left_notification(visitor_id, live_visitors[visitor_id])
-            # إزالة الزائر من القائمة
-            del live_visitors[visitor_id]
-            # إزالة سجل الصفحات المزارة
-            if visitor_id in visitor_pages:
-                del visitor_pages[visitor_id]
-        except Exception as e:
-            logging.error(f"Error cleaning up visitor {visitor_id}: {str(e)}")
+    removed = registry.expire()
+    if removed:
+        logging.info(f"Removed {removed} inactive live visitors")
 
 def track_visitor_page(visitor_id, page_url, page_title=""):
     """
@@ -212,7 +182,7 @@ def track_visitor_page(visitor_id, page_url, page_title=""):
         return
         
     # إذا لم يكن الزائر موجودًا في قائمة الزوار النشطين، أضفه
-    if visitor_id not in live_visitors:
+    if not registry.contains(visitor_id):
         logging.info(f"إضافة زائر جديد من تتبع الصفحة: {visitor_id}")
         update_live_visitor(visitor_id, {
             'ip_address': request.remote_addr if request else '0.0.0.0',
@@ -222,73 +192,78 @@ def track_visitor_page(visitor_id, page_url, page_title=""):
             'referer': request.headers.get('Referer', '') if request else ''
         })
     
-    # الحفاظ على آخر 10 صفحات فقط للزائر
-    if visitor_id in visitor_pages and len(visitor_pages[visitor_id]) >= 10:
-        visitor_pages[visitor_id].pop(0)  # إزالة أقدم صفحة
-    
     # استخدام الوقت الحالي لتمييز زيارات الصفحة نفسها في أوقات مختلفة
     current_time = datetime.now().strftime('%H:%M:%S')
     page_title_with_time = f"{page_title or page_url} ({current_time})"
     
-    # إضافة الصفحة الجديدة مع تجنب التكرار المباشر
-    page_info = (page_url, page_title_with_time)
-    
-    # إضافة الصفحة الجديدة
-    if visitor_id not in visitor_pages:
-        visitor_pages[visitor_id] = []
-    visitor_pages[visitor_id].append(page_info)
-    
-    # تحديث الصفحة الحالية في معلومات الزائر
-    if visitor_id in live_visitors:
-        live_visitors[visitor_id]['current_page'] = page_url
-        live_visitors[visitor_id]['page_title'] = page_title
-        live_visitors[visitor_id]['last_seen'] = datetime.now()
+    # إضافة الصفحة (مع الحفاظ على آخر 10 صفحات فقط) وتحديث الصفحة الحالية للزائر
+    pages_count = registry.add_page(visitor_id, page_url, page_title, page_title_with_time)
         
     logging.debug(f"تم تتبع الصفحة: visitor_id={visitor_id}, page_url={page_url}, title={page_title}")
     # عودة بيانات الزائر المحدثة للتأكد من نجاح العملية
     return {
         'visitor_id': visitor_id,
-        'pages_count': len(visitor_pages.get(visitor_id, [])),
+        'pages_count': pages_count,
         'current_page': page_url
     }
 
 # تشغيل عملية التنظيف في خيط منفصل
 cleanup_thread = None
-should_stop_cleanup = False
+cleanup_thread_pid = None
+cleanup_stop_event = threading.Event()
+cleanup_thread_lock = threading.Lock()
+# الفترة بين عمليات التنظيف (ثوانٍ)
+CLEANUP_INTERVAL = 60
 
 def cleanup_thread_task():
     """
     مهمة خيط التنظيف - تنظيف الزوار غير النشطين كل دقيقة
     """
-    global should_stop_cleanup
-    while not should_stop_cleanup:
+    while not cleanup_stop_event.wait(CLEANUP_INTERVAL):
         try:
             cleanup_inactive_visitors()
         except Exception as e:
             logging.error(f"Error in cleanup thread: {str(e)}")
-        time.sleep(60)  # انتظار دقيقة واحدة
 
 def start_cleanup_thread():
     """
-    بدء تشغيل خيط التنظيف
+    بدء تشغيل خيط التنظيف (مع إعادة تشغيله بعد fork في عمال gunicorn)
     """
-    global cleanup_thread, should_stop_cleanup
+    global cleanup_thread, cleanup_thread_pid
+    
+    if cleanup_thread is not None and cleanup_thread.is_alive() and cleanup_thread_pid == os.getpid():
+        return
     
-    if cleanup_thread is None or not cleanup_thread.is_alive():
-        should_stop_cleanup = False
-        cleanup_thread = threading.Thread(target=cleanup_thread_task)
+    with cleanup_thread_lock:
+        if cleanup_thread is not None and cleanup_thread.is_alive() and cleanup_thread_pid == os.getpid():
+            return
+        cleanup_stop_event.clear()
+        cleanup_thread_pid = os.getpid()
+        cleanup_thread = threading.Thread(target=cleanup_thread_task, name='live-visitors-cleanup')
         cleanup_thread.daemon = True  # جعل الخيط daemon حتى يتوقف عند إيقاف التطبيق
         cleanup_thread.start()
         logging.info("Started live visitors cleanup thread")
 
 def stop_cleanup_thread():
     """
-    إيقاف خيط التنظيف
+    إيقاف خيط التنظيف (عند إيقاف العملية فقط)
     """
-    global should_stop_cleanup
-    should_stop_cleanup = True
+    cleanup_stop_event.set()
     logging.info("Stopping live visitors cleanup thread")
 
+def serialize_live_visitor(visitor_info):
+    """تحويل سجل زائر نشط إلى الصيغة المرسلة لصفحة الإدارة"""
+    return {
+        'id': visitor_info['id'],
+        'ip_address': visitor_info.get('ip_address', ''),
+        'last_seen': visitor_info.get('last_seen', datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
+        'current_page': visitor_info.get('current_page', '/'),
+        'page_title': visitor_info.get('page_title', ''),
+        'user_agent': visitor_info.get('user_agent', ''),
+        'referer': visitor_info.get('referer', ''),
+        'visited_pages': visitor_info.get('visited_pages', [])
+    }
+
 @live_bp.route('/visitors')
 def get_live_visitors():
     """
@@ -310,7 +285,7 @@ def get_live_visitors():
             logging.error(f"خطأ أثناء التحقق من صلاحيات المستخدم: {str(user_error)}")
             
         # إضافة زوار إضافيين للاختبار إذا كانت القائمة فارغة
-        if not live_visitors:
+        if registry.count() == 0:
             # إضافة زائر نشط للاختبار
             update_live_visitor("test_visitor_1", {
                 'ip_address': request.remote_addr,
@@ -336,18 +311,7 @@ def get_live_visitors():
         # عرض قائمة فارغة في حالة حدوث خطأ
         return jsonify({'count': 0, 'visitors': [], 'error': str(e)}), 200
     
-    visitors_data = []
-    for visitor_id, visitor_info in live_visitors.items():
-        visitors_data.append({
-            'id': visitor_id,
-            'ip_address': visitor_info.get('ip_address', ''),
-            'last_seen': visitor_info.get('last_seen', datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
-            'current_page': visitor_info.get('current_page', '/'),
-            'page_title': visitor_info.get('page_title', ''),
-            'user_agent': visitor_info.get('user_agent', ''),
-            'referer': visitor_info.get('referer', ''),
-            'visited_pages': visitor_pages.get(visitor_id, [])
-        })
+    visitors_data = [serialize_live_visitor(visitor_info) for visitor_info in registry.list_visitors()]
     
     return jsonify({
         'count': len(visitors_data),
@@ -400,7 +364,7 @@ def track_live_visitor():
             'visitor_id': visitor_id,
             'tracking_info': page_tracking_result,
             'timestamp': visitor_info['timestamp'],
-            'total_visitors': len(live_visitors)
+            'total_visitors': registry.count()
         })
         
         # إضافة كوكي معرّف الزائر
@@ -416,16 +380,131 @@ def track_live_visitor():
         return jsonify({
             'error': error_msg, 
             'success': False,
-            'visitor_count': len(live_visitors) 
+            'visitor_count': registry.count()
         }), 500
 
+def _sse_event(event, data):
+    """تنسيق حدث Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def generate_live_visitors_stream(poll_interval, heartbeat_interval, max_age, max_delta):
+    """
+    مولد بث الزوار النشطين: لقطة كاملة عند الاتصال ثم التغييرات فقط
+    (join: زائر جديد، page: تغيير الصفحة، leave: مغادرة)
+    
+    التغييرات تحسب بمقارنة فهرس مختصر من السجل المشترك مع آخر حالة أرسلت لهذا المتصفح،
+    فإذا تأخر العميل في القراءة تندمج التغييرات بدلاً من أن تتراكم، وإذا كثرت ترسل لقطة جديدة
+    """
+    def snapshot():
+        visitors = [serialize_live_visitor(visitor) for visitor in registry.list_visitors()]
+        state = {visitor['id']: (visitor['current_page'], visitor['page_title']) for visitor in visitors}
+        return state, _sse_event('snapshot', {'count': len(visitors), 'visitors': visitors})
+
+    # مدة إعادة الاتصال التلقائي للمتصفح
+    yield f"retry: {int(poll_interval * 1000) + 1000}\n\n"
+    
+    state, event = snapshot()
+    yield event
+    
+    started_at = last_sent_at = time.monotonic()
+    while time.monotonic() - started_at < max_age:
+        time.sleep(poll_interval)
+        
+        index = registry.get_index()
+        joined = [visitor_id for visitor_id in index if visitor_id not in state]
+        left = [visitor_id for visitor_id in state if visitor_id not in index]
+        changed = [visitor_id for visitor_id in index if visitor_id in state and index[visitor_id] != state[visitor_id]]
+        
+        if len(joined) + len(left) + len(changed) > max_delta:
+            state, event = snapshot()
+            yield event
+            last_sent_at = time.monotonic()
+            continue
+        
+        events = []
+        for visitor_id in left:
+            del state[visitor_id]
+            events.append(_sse_event('leave', {'id': visitor_id, 'count': len(index)}))
+        
+        for visitor_id in joined + changed:
+            visitor = registry.get_visitor(visitor_id)
+            if visitor is None:
+                continue
+            visitor_data = serialize_live_visitor(visitor)
+            state[visitor_id] = index[visitor_id]
+            if visitor_id in changed:
+                events.append(_sse_event('page', {
+                    'id': visitor_id,
+                    'current_page': visitor_data['current_page'],
+                    'page_title': visitor_data['page_title'],
+                    'last_seen': visitor_data['last_seen'],
+                    'visited_pages': visitor_data['visited_pages'][-1:],
+                    'count': len(index)
+                }))
+            else:
+                events.append(_sse_event('join', {'visitor': visitor_data, 'count': len(index)}))
+        
+        if events:
+            yield ''.join(events)
+            last_sent_at = time.monotonic()
+        elif time.monotonic() - last_sent_at >= heartbeat_interval:
+            # تعليق SSE لإبقاء الاتصال مفتوحًا عبر الوكلاء ولاكتشاف انقطاع العميل
+            yield ": ping\n\n"
+            last_sent_at = time.monotonic()
+
+# عدد بثوث SSE المفتوحة في هذه العملية
+active_streams = 0
+active_streams_lock = threading.Lock()
+
+@live_bp.route('/stream')
+def stream_live_visitors():
+    """
+    بث Server-Sent Events للزوار النشطين - للمسؤول فقط
+    يستبدل الاستطلاع الدوري لـ /api/live/visitors بإرسال التغييرات فقط
+    """
+    global active_streams
+    
+    if not current_user.is_authenticated or not current_user.is_admin():
+        return jsonify({'error': 'غير مصرح بالوصول'}), 403
+    
+    config = current_app.config
+    with active_streams_lock:
+        if active_streams >= config['LIVE_STREAM_MAX_CLIENTS']:
+            # الحد من عدد البثوث حتى لا تستهلك كل خيوط العامل، والمتصفح يعود إلى الاستطلاع
+            return jsonify({'error': 'عدد كبير من الاتصالات المفتوحة'}), 503
+        active_streams += 1
+    
+    def stream():
+        try:
+            yield from generate_live_visitors_stream(
+                poll_interval=config['LIVE_STREAM_POLL_INTERVAL'],
+                heartbeat_interval=config['LIVE_STREAM_HEARTBEAT'],
+                max_age=config['LIVE_STREAM_MAX_AGE'],
+                max_delta=config['LIVE_STREAM_MAX_DELTA']
+            )
+        except Exception as e:
+            logging.error(f"Error in live visitors stream: {str(e)}")
+    
+    def release_stream():
+        global active_streams
+        with active_streams_lock:
+            active_streams -= 1
+    
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # يستدعى عند إغلاق الاتصال (انتهاء البث أو انقطاع العميل)
+    response.call_on_close(release_stream)
+    return response
+
 @live_bp.route('/count')
 def get_live_visitors_count():
     """
     الحصول على عدد الزوار النشطين حالياً
     """
     return jsonify({
-        'count': len(live_visitors)
+        'count': registry.count()
     })
 
 def init_live_visitors_tracking(app):
@@ -435,10 +514,22 @@ def init_live_visitors_tracking(app):
     Args:
         app: تطبيق Flask
     """
+    global registry
+    
+    # اختيار خلفية السجل المشترك (sqlite افتراضيًا، أو redis، أو memory)
+    configure_live_registry(app)
+    registry = create_live_registry(app)
+    
+    # إعدادات بث SSE لصفحة الزوار النشطين
+    app.config.setdefault('LIVE_STREAM_POLL_INTERVAL', float(os.environ.get('LIVE_STREAM_POLL_INTERVAL', 2.0)))
+    app.config.setdefault('LIVE_STREAM_HEARTBEAT', float(os.environ.get('LIVE_STREAM_HEARTBEAT', 15.0)))
+    app.config.setdefault('LIVE_STREAM_MAX_AGE', float(os.environ.get('LIVE_STREAM_MAX_AGE', 300.0)))
+    app.config.setdefault('LIVE_STREAM_MAX_DELTA', int(os.environ.get('LIVE_STREAM_MAX_DELTA', 100)))
+    app.config.setdefault('LIVE_STREAM_MAX_CLIENTS', int(os.environ.get('LIVE_STREAM_MAX_CLIENTS', 4)))
+    logging.info(f"Live visitors registry backend: {type(registry).__name__}")
+    
     app.register_blueprint(live_bp)
     start_cleanup_thread()
     
-    # إغلاق خيط التنظيف عند إغلاق التطبيق
-    @app.teardown_appcontext
-    def cleanup_live_visitors(exception=None):
-        stop_cleanup_thread()
+    # إيقاف خيط التنظيف عند إيقاف العملية (وليس عند انتهاء كل طلب)
+    atexit.register(stop_cleanup_thread)
@@ -0,0 +1,396 @@
+"""
+مرسل البريد الإلكتروني في الخلفية
+معالجات الطلبات تضع الرسالة في طابور محدود الحجم وتعود فورًا، بينما يرسلها خيط خلفي
+عبر عميل SendGrid واحد يعاد استخدامه. إشعارات المدير المتقاربة زمنيًا تُجمع في رسالة واحدة،
+وتُحفظ حالة كل رسالة (في الطابور، أرسلت، فشلت) للمراقبة.
+يمكن استبدال SendGrid بناقل وهمي محلي (MAIL_TRANSPORT=fake) للاختبارات
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+from markupsafe import escape
+
+# حالات الرسالة
+STATUS_QUEUED = 'queued'
+STATUS_BATCHED = 'batched'  # بانتظار تجميعها مع إشعارات أخرى للمدير
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_DROPPED = 'dropped'
+
+TRANSPORT_SENDGRID = 'sendgrid'
+TRANSPORT_FAKE = 'fake'
+
+
+class OutgoingMail:
+    """رسالة بريد في الطابور مع حالة تسليمها"""
+
+    def __init__(self, to_email, from_email, subject, text_content=None, html_content=None, batch=False):
+        self.id = uuid.uuid4().hex
+        self.to_email = to_email
+        self.from_email = from_email
+        self.subject = subject
+        self.text_content = text_content
+        self.html_content = html_content
+        self.batch = batch
+        self.status = STATUS_QUEUED
+        self.attempts = 0
+        self.error = None
+        self.batch_id = None  # معرف الرسالة المجمعة التي أرسلت ضمنها
+        self.created_at = datetime.now()
+        self.sent_at = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'to': self.to_email,
+            'subject': self.subject,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'batch_id': self.batch_id,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'sent_at': self.sent_at.strftime('%Y-%m-%d %H:%M:%S') if self.sent_at else None
+        }
+
+
+class SendGridTransport:
+    """إرسال عبر SendGrid باستخدام عميل واحد لكل عملية (يعيد استخدام اتصال HTTP)"""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is not None and self._client_pid == os.getpid():
+            return self._client
+
+        from sendgrid import SendGridAPIClient
+
+        with self._lock:
+            if self._client is None or self._client_pid != os.getpid():
+                self._client = SendGridAPIClient(self.api_key)
+                self._client_pid = os.getpid()
+            return self._client
+
+    def send(self, mail):
+        from sendgrid.helpers.mail import Mail, Email, To, Content
+
+        if not self.api_key:
+            raise RuntimeError("SendGrid API key not set")
+
+        message = Mail(
+            from_email=Email(mail.from_email),
+            to_emails=To(mail.to_email),
+            subject=mail.subject
+        )
+        if mail.html_content:
+            message.content = Content("text/html", mail.html_content)
+        else:
+            message.content = Content("text/plain", mail.text_content)
+
+        response = self._get_client().send(message)
+        if response.status_code >= 400:
+            raise RuntimeError(f"SendGrid returned status {response.status_code}")
+
+
+class FakeTransport:
+    """ناقل وهمي للاختبارات: يحفظ الرسائل في قائمة بدلاً من إرسالها"""
+
+    def __init__(self):
+        self.sent = []
+        self.fail = False
+
+    def send(self, mail):
+        if self.fail:
+            raise RuntimeError("Fake transport failure")
+        self.sent.append(mail)
+
+
+class MailDispatcher:
+    """طابور رسائل البريد مع خيط إرسال خلفي"""
+
+    def __init__(self, transport=None, max_queue_size=500, max_retries=3, retry_backoff=2.0,
+                 batch_window=60, status_history=500):
+        self.transport = transport
+        self.enabled = True
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.batch_window = batch_window
+        self.status_history = status_history
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._pending_batches = defaultdict(list)  # (to, from) -> [OutgoingMail]
+        self._batches_lock = threading.RLock()
+        self._messages = OrderedDict()  # id -> OutgoingMail (آخر الرسائل فقط)
+        self._messages_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self._start_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self.counters = {
+            'enqueued': 0,  # الرسائل المقبولة في الطابور
+            'dropped': 0,  # الرسائل المتجاهلة بسبب امتلاء الطابور
+            'sent': 0,  # الرسائل المرسلة فعليًا
+            'failed': 0,  # الرسائل التي فشل إرسالها نهائيًا
+            'retries': 0,  # محاولات الإعادة
+            'batched': 0,  # الإشعارات التي أرسلت ضمن رسالة مجمعة
+            'batches': 0  # عدد الرسائل المجمعة المرسلة
+        }
+        self.last_error = None
+
+    def init_app(self, app):
+        """قراءة الإعدادات من تطبيق Flask واختيار الناقل"""
+        self.enabled = app.config['MAIL_ASYNC']
+        self.max_retries = app.config['MAIL_MAX_RETRIES']
+        self.retry_backoff = app.config['MAIL_RETRY_BACKOFF']
+        self.batch_window = app.config['MAIL_ADMIN_BATCH_WINDOW']
+        self.status_history = app.config['MAIL_STATUS_HISTORY']
+
+        if app.config['MAIL_TRANSPORT'] == TRANSPORT_FAKE:
+            self.transport = FakeTransport()
+        else:
+            self.transport = SendGridTransport(app.config['SENDGRID_API_KEY'])
+
+        max_queue_size = app.config['MAIL_QUEUE_SIZE']
+        if max_queue_size != self.max_queue_size:
+            self.max_queue_size = max_queue_size
+            self._queue = queue.Queue(maxsize=max_queue_size)
+
+    def _increment(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def _remember(self, mail):
+        with self._messages_lock:
+            self._messages[mail.id] = mail
+            while len(self._messages) > self.status_history:
+                self._messages.popitem(last=False)
+
+    def submit(self, mail):
+        """
+        إضافة رسالة إلى طابور الإرسال (أو إرسالها مباشرة إذا كان الإرسال غير المتزامن معطلاً)
+
+        Returns:
+            OutgoingMail: الرسالة مع حالتها الحالية
+        """
+        self._remember(mail)
+
+        if not self.enabled:
+            self._deliver(mail)
+            return mail
+
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(mail)
+        except queue.Full:
+            mail.status = STATUS_DROPPED
+            self._increment('dropped')
+            logging.warning(f"Mail queue is full, dropping email to {mail.to_email}")
+            return mail
+
+        self._increment('enqueued')
+        return mail
+
+    def get_status(self, message_id):
+        """حالة رسالة حسب معرفها، أو None إذا لم تعد محفوظة"""
+        with self._messages_lock:
+            mail = self._messages.get(message_id)
+        return mail.to_dict() if mail else None
+
+    def _ensure_worker(self):
+        """تشغيل خيط الإرسال عند الحاجة (مع إعادة تشغيله بعد fork في عمال gunicorn)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop_event.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='mail-dispatcher')
+            self._thread.daemon = True  # جعل الخيط daemon حتى يتوقف عند إيقاف التطبيق
+            self._thread.start()
+            logging.info("Started mail dispatcher thread")
+
+    def _run(self):
+        """حلقة خيط الإرسال: إرسال الرسائل العادية فورًا وتجميع إشعارات المدير حتى انقضاء النافذة"""
+        while not self._stop_event.is_set():
+            try:
+                mail = self._queue.get(timeout=1)
+            except queue.Empty:
+                mail = None
+
+            try:
+                if mail is not None:
+                    self._handle(mail)
+                self._send_due_batches()
+            except Exception as e:
+                logging.error(f"Error in mail dispatcher thread: {str(e)}")
+            finally:
+                if mail is not None:
+                    self._queue.task_done()
+
+    def _handle(self, mail):
+        if mail.batch and self.batch_window > 0:
+            mail.status = STATUS_BATCHED
+            with self._batches_lock:
+                self._pending_batches[(mail.to_email, mail.from_email)].append(mail)
+        else:
+            self._deliver(mail)
+
+    def _send_due_batches(self, force=False):
+        """إرسال مجموعات إشعارات المدير التي انقضت نافذتها"""
+        now = datetime.now()
+        with self._batches_lock:
+            due = []
+            for key in list(self._pending_batches):
+                mails = self._pending_batches[key]
+                if force or (now - mails[0].created_at).total_seconds() >= self.batch_window:
+                    due.append(self._pending_batches.pop(key))
+
+        for mails in due:
+            if len(mails) == 1:
+                self._deliver(mails[0])
+                continue
+
+            combined = build_batch_mail(mails)
+            self._remember(combined)
+            if self._deliver(combined):
+                self._increment('batches')
+                self._increment('batched', len(mails))
+            for mail in mails:
+                mail.batch_id = combined.id
+                mail.status = combined.status
+                mail.error = combined.error
+                mail.sent_at = combined.sent_at
+
+    def _deliver(self, mail):
+        """إرسال رسالة مع إعادة المحاولة عند الفشل"""
+        while True:
+            mail.attempts += 1
+            try:
+                self.transport.send(mail)
+                mail.status = STATUS_SENT
+                mail.sent_at = datetime.now()
+                mail.error = None
+                self._increment('sent')
+                logging.info(f"Email sent successfully to {mail.to_email}")
+                return True
+            except Exception as e:
+                mail.error = str(e)
+                self.last_error = str(e)
+                logging.error(f"Mail transport error for {mail.to_email}: {str(e)}")
+
+            if mail.attempts > self.max_retries or self._stop_event.is_set():
+                mail.status = STATUS_FAILED
+                self._increment('failed')
+                return False
+
+            self._increment('retries')
+            time.sleep(self.retry_backoff * (2 ** (mail.attempts - 1)))
+
+    def flush(self):
+        """إرسال كل الرسائل الموجودة في الطابور والمجموعات المعلقة بشكل متزامن (للاختبارات والإيقاف)"""
+        while True:
+            try:
+                mail = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self._handle(mail)
+            finally:
+                self._queue.task_done()
+        self._send_due_batches(force=True)
+
+    def stop(self, flush=True):
+        """إيقاف خيط الإرسال مع إرسال ما تبقى"""
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=2)
+        if flush:
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing mail queue on shutdown: {str(e)}")
+
+    def get_stats(self):
+        """إحصائيات الطابور وآخر الرسائل للمراقبة"""
+        with self._counters_lock:
+            stats = dict(self.counters)
+        with self._messages_lock:
+            recent = [mail.to_dict() for mail in list(self._messages.values())[-20:]]
+        stats.update({
+            'enabled': self.enabled,
+            'transport': type(self.transport).__name__,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue_size,
+            'pending_batches': sum(len(mails) for mails in list(self._pending_batches.values())),
+            'worker_alive': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+            'last_error': self.last_error,
+            'recent': recent
+        })
+        return stats
+
+
+def build_batch_mail(mails):
+    """دمج عدة إشعارات للمدير في رسالة واحدة"""
+    first = mails[0]
+    subject = f"{len(mails)} إشعارات جديدة من الموقع"
+
+    html_sections = []
+    text_sections = []
+    for mail in mails:
+        # العناوين تحمل أسماء يكتبها الزوار (مثل اسم مرسل رسالة التواصل)
+        html_sections.append(f"<h3>{escape(mail.subject)}</h3>{mail.html_content or escape(mail.text_content or '')}")
+        text_sections.append(f"{mail.subject}\n{mail.text_content or ''}")
+
+    html_content = f"""
+    <div dir="rtl">
+    <h2>{subject}</h2>
+    {'<hr>'.join(html_sections)}
+    </div>
+    """
+    return OutgoingMail(
+        to_email=first.to_email,
+        from_email=first.from_email,
+        subject=subject,
+        text_content='\n\n----\n\n'.join(text_sections),
+        html_content=html_content
+    )
+
+
+# نسخة مشتركة على مستوى العملية
+mail_dispatcher = MailDispatcher(transport=SendGridTransport(os.environ.get('SENDGRID_API_KEY')))
+
+
+def init_mail_dispatcher(app):
+    """
+    تهيئة مرسل البريد الإلكتروني
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('MAIL_ASYNC', os.environ.get('MAIL_ASYNC', '1') != '0')
+    app.config.setdefault('MAIL_TRANSPORT', os.environ.get('MAIL_TRANSPORT', TRANSPORT_SENDGRID))
+    app.config.setdefault('SENDGRID_API_KEY', os.environ.get('SENDGRID_API_KEY'))
+    app.config.setdefault('MAIL_QUEUE_SIZE', int(os.environ.get('MAIL_QUEUE_SIZE', 500)))
+    app.config.setdefault('MAIL_MAX_RETRIES', int(os.environ.get('MAIL_MAX_RETRIES', 3)))
+    app.config.setdefault('MAIL_RETRY_BACKOFF', float(os.environ.get('MAIL_RETRY_BACKOFF', 2.0)))
+    app.config.setdefault('MAIL_ADMIN_BATCH_WINDOW', int(os.environ.get('MAIL_ADMIN_BATCH_WINDOW', 60)))
+    app.config.setdefault('MAIL_STATUS_HISTORY', int(os.environ.get('MAIL_STATUS_HISTORY', 500)))
+
+    mail_dispatcher.init_app(app)
+
+    # إرسال الرسائل المتبقية عند إيقاف العملية
+    atexit.register(mail_dispatcher.stop)
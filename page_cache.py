@@ -0,0 +1,225 @@
+"""
+ذاكرة مؤقتة للصفحات العامة المعروضة للزوار غير المسجلين
+قوالب الصفحة الرئيسية ومعرض الأعمال وتفاصيل الخدمة كبيرة (80-120 KB) وتعرض مع كل طلب رغم أن
+ناتجها لا يتغير إلا عند تعديل المحتوى من لوحة الإدارة. هنا يحفظ ناتج العرض لكل (مسار، لغة)
+مع نسخة مضغوطة مسبقًا بـ gzip:
+
+- المفتاح يشمل نص الاستعلام (query string)، والحجم الكلي محدود (PAGE_CACHE_MAX_BYTES) مع إخراج الأقدم استخدامًا (LRU)
+- تلغى الصفحات عند تغير إصدار لقطة المحتوى (أي كتابة إدارية مؤكدة في أي عامل)، ومدة صلاحية قصوى
+  PAGE_CACHE_TTL لأن صفحة المعرض تعرض عدادات المشاهدات والإعجابات
+- المستخدمون المسجلون والطلبات التي تحمل رسائل flash تتجاوز الذاكرة
+- الصفحات التي تحتوي رمز CSRF: يحفظ الناتج مع علامة مكان الرمز ويوضع رمز الجلسة الحالية عند كل طلب،
+  فتضغط عند الطلب ولا تأخذ ETag (الرمز يختلف لكل جلسة)؛ باقي الصفحات تأخذ ETag وترد 304 عند عدم التغير
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, g, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+from content_snapshot import content_snapshot
+
+CSRF_PLACEHOLDER = '__PAGE_CACHE_CSRF_TOKEN__'
+
+
+class _PageEntry:
+    __slots__ = ('body', 'compressed', 'etag', 'has_csrf', 'mimetype', 'version', 'created_at', 'size')
+
+    def __init__(self, body, compressed, etag, has_csrf, mimetype, version):
+        self.body = body
+        self.compressed = compressed
+        self.etag = etag
+        self.has_csrf = has_csrf
+        self.mimetype = mimetype
+        self.version = version
+        self.created_at = time.time()
+        self.size = len(body) + len(compressed or b'')
+
+
+class PageCache:
+    """ذاكرة LRU محدودة الحجم لناتج عرض الصفحات العامة"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=120, compress_level=6):
+        self.enabled = True
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compress_level = compress_level
+        self._entries = OrderedDict()  # (path, lang) -> _PageEntry
+        self._size = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'not_modified': 0,
+            'bypasses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+    def init_app(self, app):
+        """قراءة الإعدادات"""
+        self.enabled = app.config['PAGE_CACHE_ENABLED']
+        self.max_bytes = app.config['PAGE_CACHE_MAX_BYTES']
+        self.ttl = app.config['PAGE_CACHE_TTL']
+
+    def _increment(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _cacheable_request(self):
+        if not self.enabled or request.method != 'GET':
+            return False
+        if current_user.is_authenticated:
+            return False
+        # رسائل flash تعرض مرة واحدة في الصفحة التالية
+        if session.get('_flashes'):
+            return False
+        return True
+
+    def cached(self, view):
+        """مزخرف لمسار عام: يعيد الصفحة المحفوظة للزوار غير المسجلين أو يعرضها ويحفظها"""
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self._cacheable_request():
+                self._increment('bypasses')
+                return view(*args, **kwargs)
+
+            key = (request.full_path, getattr(g, 'lang', 'ar'))
+            version = content_snapshot.version_token()
+            entry = self._get(key, version)
+            if entry is not None:
+                self._increment('hits')
+                return self._respond(entry, 'HIT')
+
+            self._increment('misses')
+            response = view(*args, **kwargs)
+            if not isinstance(response, Response):
+                response = Response(response)
+            if response.status_code != 200 or response.mimetype != 'text/html' or response.direct_passthrough:
+                return response
+
+            entry = self._build_entry(response, version)
+            self._store(key, entry)
+            return self._respond(entry, 'MISS', response)
+
+        return wrapper
+
+    def _build_entry(self, response, version):
+        body = response.get_data()
+        token = g.get('csrf_token')
+        has_csrf = bool(token) and token.encode() in body
+        if has_csrf:
+            # رمز هذه الجلسة لا يصلح لغيرها: يحفظ مكانه ويستبدل عند كل طلب
+            return _PageEntry(body.replace(token.encode(), CSRF_PLACEHOLDER.encode()), None, None, True,
+                              response.mimetype, version)
+        compressed = gzip.compress(body, compresslevel=self.compress_level)
+        etag = hashlib.sha1(body).hexdigest()
+        return _PageEntry(body, compressed, etag, False, response.mimetype, version)
+
+    def _get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.version != version or time.time() - entry.created_at >= self.ttl:
+                self._remove(key)
+                self.counters['expirations'] += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._size += entry.size
+            self.counters['stores'] += 1
+            while self._size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _respond(self, entry, status, response=None):
+        """بناء الرد من الصفحة المحفوظة (مع الرؤوس المضافة من المسار إن وجدت)"""
+        accepts_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+        if entry.has_csrf:
+            body = entry.body.replace(CSRF_PLACEHOLDER.encode(), generate_csrf().encode())
+            compressed = gzip.compress(body, compresslevel=self.compress_level) if accepts_gzip else None
+        else:
+            if request.if_none_match.contains(entry.etag):
+                self._increment('not_modified')
+                not_modified = Response(status=304)
+                not_modified.set_etag(entry.etag)
+                not_modified.headers['X-Page-Cache'] = status
+                return not_modified
+            body = entry.body
+            compressed = entry.compressed if accepts_gzip else None
+
+        cached_response = response if response is not None else Response(mimetype=entry.mimetype)
+        if compressed is not None:
+            cached_response.set_data(compressed)
+            cached_response.headers['Content-Encoding'] = 'gzip'
+        else:
+            cached_response.set_data(body)
+        cached_response.vary.add('Accept-Encoding')
+        cached_response.vary.add('Cookie')
+        if entry.etag:
+            cached_response.set_etag(entry.etag)
+            cached_response.headers['Cache-Control'] = 'no-cache'
+        else:
+            cached_response.headers['Cache-Control'] = 'private, no-store'
+        cached_response.headers['X-Page-Cache'] = status
+        return cached_response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self):
+        """حالة الذاكرة المؤقتة للمراقبة"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        stats['enabled'] = self.enabled
+        stats['max_bytes'] = self.max_bytes
+        stats['ttl'] = self.ttl
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+page_cache = PageCache()
+
+
+def init_page_cache(app):
+    """
+    تهيئة الذاكرة المؤقتة للصفحات العامة
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('PAGE_CACHE_ENABLED', os.environ.get('PAGE_CACHE_ENABLED', '1') != '0')
+    app.config.setdefault('PAGE_CACHE_MAX_BYTES', int(os.environ.get('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024)))
+    app.config.setdefault('PAGE_CACHE_TTL', int(os.environ.get('PAGE_CACHE_TTL', 120)))
+
+    page_cache.init_app(app)
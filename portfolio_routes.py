@@ -5,6 +5,16 @@
 from flask import Blueprint, jsonify, request, render_template, session, abort, current_app as app
 from flask_login import current_user, login_required
 from models import db, PortfolioItem, PortfolioComment, PortfolioLike, CommentLike, User, PortfolioView, Visitor
+from visitor_cache import find_visitor_by_session, find_visitor_by_ip, remember_visitor
+from ua_classifier import classify_user_agent
+from page_cache import page_cache
+from keyset_pagination import keyset_page, encode_cursor, total_counts, InvalidCursor
+from portfolio_tags import category_cache, filter_by_tag, ALL_CATEGORIES
+from portfolio_search import search_portfolio_items
+from view_dedup import view_dedup, claim_view_locks
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from telegram_digest import telegram_digest, EVENT_VIEW, EVENT_LIKE
 from datetime import datetime, timedelta
 import json
 import uuid
@@ -17,25 +27,16 @@ portfolio_bp = Blueprint('portfolio', __name__)
 def get_portfolio_categories():
     """واجهة برمجية للحصول على قائمة الفئات المتاحة في معرض الأعمال"""
     try:
-        # استعلام للحصول على جميع الفئات الفريدة
-        distinct_categories = db.session.query(PortfolioItem.category)\
-            .filter(PortfolioItem.category.isnot(None))\
-            .filter(PortfolioItem.category != '')\
-            .distinct()\
-            .all()
-        
-        # تحويل النتائج إلى قائمة
-        categories = [cat[0] for cat in distinct_categories if cat[0]]
-        
-        # فرز الفئات أبجديًا
-        categories.sort()
+        # الوسوم المستخدمة مرتبة أبجديًا من الذاكرة (بدون استعلام ما لم تتغير المشاريع)
+        tags = category_cache.get()
         
         # إضافة فئة "الكل" في البداية
-        categories.insert(0, "الكل")
+        categories = [ALL_CATEGORIES] + [tag.name for tag in tags]
         
         return jsonify({
             'success': True,
-            'categories': categories
+            'categories': categories,
+            'counts': {tag.name: tag.items_count for tag in tags}
         })
     except Exception as e:
         app.logger.error(f"خطأ في الحصول على فئات المعرض: {str(e)}")
@@ -49,25 +50,19 @@ def filter_portfolio_by_category(category):
     """واجهة برمجية للحصول على مشاريع معرض الأعمال مفلترة حسب الفئة"""
     try:
         # التحقق مما إذا كانت الفئة هي "الكل"
-        if category == "الكل":
+        if category == ALL_CATEGORIES:
             # إرجاع جميع المشاريع بدون فلترة
             portfolio_items = PortfolioItem.query.order_by(PortfolioItem.created_at.desc()).all()
         else:
-            # فلترة المشاريع حسب الفئة
-            portfolio_items = PortfolioItem.query\
-                .filter(PortfolioItem.category == category)\
+            # فلترة المشاريع حسب الوسم عبر جدول الربط المفهرس
+            tag = category_cache.find(category)
+            portfolio_items = filter_by_tag(PortfolioItem.query, tag.id)\
                 .order_by(PortfolioItem.created_at.desc())\
-                .all()
+                .all() if tag else []
         
         # تحويل المشاريع إلى قائمة قواميس
         items_data = []
         for item in portfolio_items:
-            # حساب عدد التعليقات
-            comments_count = PortfolioComment.query.filter_by(
-                portfolio_id=item.id, 
-                approved=True
-            ).count()
-            
             # إضافة بيانات المشروع
             items_data.append({
                 'id': item.id,
@@ -79,7 +74,7 @@ def filter_portfolio_by_category(category):
                 'created_at': item.created_at.isoformat() if item.created_at else None,
                 'likes_count': item.likes_count_value or 0,
                 'views_count': item.views_count or 0,
-                'comments_count': comments_count
+                'comments_count': item.approved_comments_count
             })
         
         return jsonify({
@@ -95,7 +90,45 @@ def filter_portfolio_by_category(category):
             'message': str(e)
         }), 500
 
+@portfolio_bp.route('/api/portfolio/search')
+def search_portfolio():
+    """واجهة برمجية للبحث في معرض الأعمال (?q=) بنتائج مرتبة حسب الصلة"""
+    try:
+        query = request.args.get('q', '').strip()
+        limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+        
+        portfolio_items = search_portfolio_items(query, limit) if query else []
+        
+        items_data = []
+        for item in portfolio_items:
+            items_data.append({
+                'id': item.id,
+                'title': item.title,
+                'description': item.description,
+                'image_url': item.image_url,
+                'category': item.category,
+                'link': item.link,
+                'created_at': item.created_at.isoformat() if item.created_at else None,
+                'likes_count': item.likes_count_value or 0,
+                'views_count': item.views_count or 0,
+                'comments_count': item.approved_comments_count
+            })
+        
+        return jsonify({
+            'success': True,
+            'items': items_data,
+            'count': len(items_data),
+            'query': query
+        })
+    except Exception as e:
+        app.logger.error(f"خطأ في البحث في معرض الأعمال: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
 @portfolio_bp.route('/portfolio')
+@page_cache.cached
 def portfolio():
     """عرض صفحة معرض الأعمال الافتراضية"""
     # الحصول على إجمالي عدد الإعجابات لجميع المشاريع
@@ -104,49 +137,49 @@ def portfolio():
     # الحصول على إجمالي عدد المشاهدات لجميع المشاريع
     total_views = db.session.query(db.func.sum(PortfolioItem.views_count)).scalar() or 0
     
-    # الحصول على قائمة المشاريع مع إحصائياتها
-    portfolio_items = PortfolioItem.query.order_by(PortfolioItem.created_at.desc()).all()
-    
-    # حساب عدد التعليقات لكل مشروع
-    for item in portfolio_items:
-        item.comments_count = PortfolioComment.query.filter_by(
-            portfolio_id=item.id, 
-            approved=True
-        ).count()
-    
-    # التحقق مما إذا كان هناك المزيد من المشاريع للتحميل (للتمرير اللانهائي)
-    has_more = len(portfolio_items) > 12
+    # أول 12 مشروع فقط، والباقي بالتمرير اللانهائي عبر مؤشر الصفحة التالية
+    portfolio_items, has_more, next_cursor = keyset_page(PortfolioItem.query, 12)
     
     return render_template(
         'portfolio.html',
-        portfolio_items=portfolio_items[:12],  # إعرض فقط أول 12 مشروع في البداية
+        portfolio_items=portfolio_items,
         total_likes=total_likes,
         total_views=total_views,
-        has_more=has_more
+        has_more=has_more,
+        next_cursor=next_cursor
     )
 
+@portfolio_bp.route('/api/portfolio/page')
 @portfolio_bp.route('/api/portfolio/page/<int:page>')
-def get_portfolio_page(page):
-    """واجهة برمجية للحصول على قائمة المشاريع بالصفحات للتحميل التدريجي"""
+def get_portfolio_page(page=None):
+    """
+    واجهة برمجية للحصول على قائمة المشاريع بالصفحات للتحميل التدريجي
+    الصفحة التالية تطلب بـ ?cursor=<next_cursor>؛ رقم الصفحة مدعوم للعملاء القدامى (OFFSET)
+    والعدد الكلي يرجع فقط مع ?include_total=1
+    """
     try:
         # حجم الصفحة - عدد المشاريع في كل طلب
         page_size = 12
+        cursor = request.args.get('cursor')
         
-        # حساب الـ offset للصفحة
-        offset = (page - 1) * page_size
-        
-        # الحصول على المشاريع للصفحة المطلوبة
-        portfolio_items = PortfolioItem.query.order_by(PortfolioItem.created_at.desc()).offset(offset).limit(page_size).all()
+        if cursor or not page or page == 1:
+            try:
+                portfolio_items, has_more, next_cursor = keyset_page(PortfolioItem.query, page_size, cursor)
+            except InvalidCursor:
+                return jsonify({'success': False, 'message': 'مؤشر الصفحة غير صالح'}), 400
+        else:
+            # رقم صفحة قديم: OFFSET مع عنصر إضافي لمعرفة وجود صفحة تالية بدون COUNT
+            offset = (page - 1) * page_size
+            portfolio_items = PortfolioItem.query.order_by(
+                PortfolioItem.created_at.desc(), PortfolioItem.id.desc()
+            ).offset(offset).limit(page_size + 1).all()
+            has_more = len(portfolio_items) > page_size
+            portfolio_items = portfolio_items[:page_size]
+            next_cursor = encode_cursor(portfolio_items[-1]) if has_more else None
         
         # تحويل إلى قائمة من القواميس
         items_data = []
         for item in portfolio_items:
-            # حساب عدد التعليقات
-            comments_count = PortfolioComment.query.filter_by(
-                portfolio_id=item.id, 
-                approved=True
-            ).count()
-            
             # إضافة بيانات المشروع
             items_data.append({
                 'id': item.id,
@@ -158,21 +191,21 @@ def get_portfolio_page(page):
                 'created_at': item.created_at.isoformat() if item.created_at else None,
                 'likes_count': item.likes_count_value,
                 'views_count': item.views_count,
-                'comments_count': comments_count
+                'comments_count': item.approved_comments_count
             })
         
-        # التحقق من وجود المزيد من المشاريع للتحميل
-        total_count = PortfolioItem.query.count()
-        has_more = total_count > (offset + page_size)
-        
-        return jsonify({
+        result = {
             'success': True,
             'items': items_data,
             'has_more': has_more,
-            'total_count': total_count,
+            'next_cursor': next_cursor,
             'page': page,
             'page_size': page_size
-        })
+        }
+        if request.args.get('include_total') == '1':
+            result['total_count'] = total_counts.get('all', PortfolioItem.query)
+        
+        return jsonify(result)
     except Exception as e:
         app.logger.error(f"خطأ في الحصول على المشاريع بالصفحات: {str(e)}")
         return jsonify({
@@ -269,10 +302,10 @@ def update_visitor():
         
         # البحث بناءً على معرف الجلسة أو عنوان IP
         if session_id:
-            visitor = Visitor.query.filter(Visitor.session_id == session_id).first()
+            visitor = find_visitor_by_session(session_id)
             
         if not visitor and ip_address:
-            visitor = Visitor.query.filter(Visitor.ip_address == ip_address).first()
+            visitor = find_visitor_by_ip(ip_address)
         
         if visitor:
             # تحديث السجل الموجود
@@ -293,6 +326,8 @@ def update_visitor():
                 last_visit=datetime.now()
             )
             db.session.add(new_visitor)
+            db.session.flush()
+            remember_visitor(new_visitor, session_id=session_id, ip_address=ip_address)
         
         db.session.commit()
         return jsonify({'success': True})
@@ -343,7 +378,7 @@ def view_portfolio_item(portfolio_id):
             user_info = f"زائر من {ip_address}"
             
             # البحث عن سجل الزائر أو إنشاء سجل جديد
-            visitor = Visitor.query.filter_by(ip_address=ip_address).first()
+            visitor = find_visitor_by_ip(ip_address)
             if visitor:
                 # تحديث معلومات الزائر الموجود
                 visitor_id = visitor.id
@@ -365,62 +400,46 @@ def view_portfolio_item(portfolio_id):
                 db.session.add(new_visitor)
                 db.session.flush()  # لإنشاء معرف للزائر الجديد
                 visitor_id = new_visitor.id
-        
-        # التحقق من وجود سجل مشاهدة سابق بأي طريقة من طرق التعرف
+                remember_visitor(new_visitor, ip_address=ip_address)
+        
+        # وسائل التعرف على المشاهد (نفس الوسائل التي يبحث بها في portfolio_view)
+        identities = [
+            (kind, value) for kind, value in (
+                ('user', user_id),
+                ('session', session_id),
+                ('fingerprint', fingerprint),
+                ('visitor', visitor_id),
+                ('ip', ip_address)
+            ) if value
+        ]
+        
+        # التحقق من وجود سجل مشاهدة سابق: الذاكرة أولاً، وقاعدة البيانات فقط عند تطابق محتمل
         existing_view = None
-        
-        # قائمة من الفلاتر البديلة للبحث عن مشاهدة سابقة
-        all_filters = []
-        
-        # إنشاء مجموعة من الفلاتر المختلفة للبحث بطرق متعددة
-        if user_id:
-            all_filters.append(db.and_(
-                PortfolioView.portfolio_id == portfolio_id,
-                PortfolioView.user_id == user_id
-            ))
-        
-        if session_id:
-            all_filters.append(db.and_(
-                PortfolioView.portfolio_id == portfolio_id,
-                PortfolioView.session_id == session_id
-            ))
-            
-        if fingerprint:
-            all_filters.append(db.and_(
-                PortfolioView.portfolio_id == portfolio_id,
-                PortfolioView.fingerprint == fingerprint
-            ))
-            
-        if visitor_id:
-            all_filters.append(db.and_(
-                PortfolioView.portfolio_id == portfolio_id,
-                PortfolioView.visitor_id == visitor_id
-            ))
+        if identities and view_dedup.probably_seen(portfolio_id, identities):
+            identity_columns = {
+                'user': PortfolioView.user_id,
+                'session': PortfolioView.session_id,
+                'fingerprint': PortfolioView.fingerprint,
+                'visitor': PortfolioView.visitor_id,
+                'ip': PortfolioView.ip_address
+            }
+            all_filters = [
+                db.and_(PortfolioView.portfolio_id == portfolio_id, identity_columns[kind] == value)
+                for kind, value in identities
+            ]
             
-        if ip_address:
-            all_filters.append(db.and_(
-                PortfolioView.portfolio_id == portfolio_id,
-                PortfolioView.ip_address == ip_address
-            ))
-        
-        # القفل الزمني: البحث عن مشاهدة في آخر 24 ساعة للحد من المشاهدات المتكررة
-        time_lock = datetime.now() - timedelta(hours=24)
-        time_filter = PortfolioView.created_at >= time_lock
-
-        # البحث باستخدام أي من الفلاتر المعرّفة مع شرط الوقت
-        if all_filters:
+            # القفل الزمني: البحث عن مشاهدة في آخر 24 ساعة للحد من المشاهدات المتكررة
+            time_lock = datetime.now() - timedelta(seconds=view_dedup.window)
             existing_view = PortfolioView.query.filter(
-                db.or_(*all_filters), 
-                time_filter
+                db.or_(*all_filters),
+                PortfolioView.created_at >= time_lock
             ).first()
         
         is_new_view = False
+        views_count = portfolio_item.views_count or 0
         
         # مشاهدة جديدة (لم يسبق للمستخدم مشاهدة هذا المشروع)
         if not existing_view:
-            is_new_view = True
-            app.logger.info(f"إنشاء مشاهدة جديدة للعنصر {portfolio_id}")
-            
             # إنشاء سجل مشاهدة جديد
             new_view = PortfolioView(
                 portfolio_id=portfolio_id,
@@ -429,26 +448,47 @@ def view_portfolio_item(portfolio_id):
                 session_id=session_id,
                 fingerprint=fingerprint,
                 ip_address=ip_address,
+                user_agent=user_agent,
+                device_type=classify_user_agent(user_agent).device,
                 created_at=datetime.now()
             )
-            db.session.add(new_view)
-            db.session.flush()
             
-            # تحديث عداد المشاهدات في جدول المشروع
-            if portfolio_item.views_count is None:
-                portfolio_item.views_count = 1
-            else:
-                portfolio_item.views_count += 1
+            # قاعدة البيانات تحسم التكرار عند الإدراج إذا سجل المشاهدة عامل آخر أو كانت قبل بداية ذاكرة
+            # هذه العملية: أقفال الجلسة و IP، ثم القيود الفريدة (المستخدم، الزائر، البصمة)
+            try:
+                with db.session.begin_nested() as savepoint:
+                    if claim_view_locks(db.session, portfolio_id, identities, view_dedup.window):
+                        db.session.add(new_view)
+                        is_new_view = True
+                    else:
+                        savepoint.rollback()
+                        app.logger.info(f"مشاهدة مسجلة مسبقًا للعنصر {portfolio_id} (قفل الجلسة أو IP)")
+            except IntegrityError:
+                is_new_view = False
+                app.logger.info(f"مشاهدة مسجلة مسبقًا للعنصر {portfolio_id} (قيد فريد)")
+        
+        if is_new_view:
+            app.logger.info(f"إنشاء مشاهدة جديدة للعنصر {portfolio_id}")
             
-            # إرسال إشعار تيليجرام عند مشاهدة مشروع جديد
+            # زيادة ذرية لعداد المشاهدات بدلاً من قراءة القيمة وكتابتها أو إعادة العد
+            db.session.execute(
+                update(PortfolioItem)
+                .where(PortfolioItem.id == portfolio_id)
+                .values(views_count=db.func.coalesce(PortfolioItem.views_count, 0) + 1)
+                .execution_options(synchronize_session=False)
+            )
+            views_count += 1
+            
+            # إرسال إشعار تيليجرام عند مشاهدة مشروع جديد (أو إضافتها إلى الملخص الدوري)
             try:
-                telegram_message = format_visit_notification(
-                    user_info=user_info,
-                    project_title=portfolio_item.title,
-                    ip_address=ip_address,
-                    user_agent=user_agent
-                )
-                send_telegram_message(telegram_message)
+                if not telegram_digest.record(EVENT_VIEW, project=portfolio_item.title, referrer=request.referrer):
+                    telegram_message = format_visit_notification(
+                        user_info=user_info,
+                        project_title=portfolio_item.title,
+                        ip_address=ip_address,
+                        user_agent=user_agent
+                    )
+                    send_telegram_message(telegram_message)
             except Exception as telegram_error:
                 app.logger.error(f"خطأ في إرسال إشعار تيليجرام: {str(telegram_error)}")
         else:
@@ -456,23 +496,15 @@ def view_portfolio_item(portfolio_id):
             app.logger.info(f"مشاهدة متكررة للعنصر {portfolio_id} من نفس المستخدم - لم تحتسب")
         
         db.session.commit()
-        
-        # تحديث عدد المشاهدات الكلي من قاعدة البيانات
-        try:
-            portfolio_item.update_views_count()
-            db.session.commit()
-        except Exception as update_error:
-            app.logger.error(f"خطأ في تحديث العدد الكلي للمشاهدات: {str(update_error)}")
+        view_dedup.remember(portfolio_id, identities)
         
         # سجل حالة المشاهدة
         if is_new_view:
-            app.logger.info(f"مشاهدة فريدة جديدة للعنصر {portfolio_id}، الإجمالي: {portfolio_item.views_count}")
-        else:
-            app.logger.info(f"مشاهدة متكررة للعنصر {portfolio_id} من نفس المستخدم - لم تحتسب")
+            app.logger.info(f"مشاهدة فريدة جديدة للعنصر {portfolio_id}، الإجمالي: {views_count}")
         
         return jsonify({
             'success': True,
-            'views_count': portfolio_item.views_count,
+            'views_count': views_count,
             'is_new_view': is_new_view
         })
     except Exception as e:
@@ -617,14 +649,15 @@ def like_portfolio_item(portfolio_id):
             liked = True
             app.logger.info(f"تمت إضافة إعجاب جديد للعنصر {portfolio_id}")
             
-            # إرسال إشعار تيليجرام للإعجاب الجديد
+            # إرسال إشعار تيليجرام للإعجاب الجديد (أو إضافته إلى الملخص الدوري)
             try:
-                telegram_message = format_like_notification(
-                    user_info=user_info,
-                    content_type="مشروع",
-                    content_title=portfolio_item.title
-                )
-                send_telegram_message(telegram_message)
+                if not telegram_digest.record(EVENT_LIKE, project=portfolio_item.title):
+                    telegram_message = format_like_notification(
+                        user_info=user_info,
+                        content_type="مشروع",
+                        content_title=portfolio_item.title
+                    )
+                    send_telegram_message(telegram_message)
             except Exception as telegram_error:
                 app.logger.error(f"خطأ في إرسال إشعار تيليجرام: {str(telegram_error)}")
         
@@ -850,7 +883,7 @@ def like_comment(comment_id):
             try:
                 # الحصول على معلومات المشروع من خلال التعليق للإشعار
                 portfolio_item = PortfolioItem.query.get(comment.portfolio_id)
-                if portfolio_item:
+                if portfolio_item and not telegram_digest.record(EVENT_LIKE, project=portfolio_item.title):
                     telegram_message = format_like_notification(
                         user_info=user_info,
                         content_type="تعليق على مشروع",
@@ -0,0 +1,330 @@
+"""
+فهرس البحث النصي في معرض الأعمال
+البحث في صفحة إدارة المعرض كان ilike('%term%') على العنوان والوصف والفئة، أي مسحًا كاملاً للجدول
+مع كل بحث، ولا يجد "مكتبة" إذا كتبت "مكتبه" أو "إنشاء" إذا كتبت "انشاء". هنا فهرس نصي حقيقي:
+
+- SQLite: جدول FTS5 (portfolio_search) مع ترتيب النتائج بـ bm25
+- PostgreSQL: جدول portfolio_search_doc بعمود tsvector وفهرس GIN مع ترتيب النتائج بـ ts_rank
+- النص يوحد قبل الفهرسة وقبل البحث بنفس الدالة (normalize_arabic): إزالة التشكيل والتطويل وتوحيد
+  الألف والياء والتاء المربوطة، فلا يعتمد على إعدادات لغة قاعدة البيانات
+- العنوان (title و title_en) بوزن أعلى من الوصف (description و description_en) ثم الفئة
+- الفهرس يحدث في نفس معاملة إضافة المشروع أو تعديله أو حذفه (مستمع after_flush)
+- قواعد البيانات الأخرى أو SQLite بدون FTS5: بحث ilike كما كان
+
+إعادة بناء الفهرس بالكامل أو تجربة البحث:
+
+    python portfolio_search.py rebuild
+    python portfolio_search.py search "هوية بصرية"
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from database import db
+from models import PortfolioItem
+
+BACKEND_FTS5 = 'fts5'
+BACKEND_TSVECTOR = 'tsvector'
+BACKEND_LIKE = 'like'
+
+# الحقول التي يتغير الفهرس بتغيرها
+INDEXED_FIELDS = ('title', 'title_en', 'description', 'description_en', 'category')
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+_TATWEEL = '\u0640'
+_LETTER_FOLDING = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+})
+_TOKEN = re.compile(r'\w+')
+
+
+def normalize_arabic(value):
+    """
+    توحيد النص للبحث: إزالة التشكيل والتطويل وتوحيد أشكال الألف والياء والتاء المربوطة
+
+    Args:
+        value (str): النص
+
+    Returns:
+        str: النص الموحد بأحرف صغيرة
+    """
+    if not value:
+        return ''
+    value = _DIACRITICS.sub('', value).replace(_TATWEEL, '')
+    return value.translate(_LETTER_FOLDING).casefold()
+
+
+def search_terms(query):
+    """كلمات البحث بعد التوحيد (كل كلمة تطابق بادئة الكلمات المفهرسة)"""
+    return _TOKEN.findall(normalize_arabic(query))
+
+
+def _document(item):
+    """نصوص المشروع الموحدة: (العنوان، الوصف، الفئة)"""
+    return (
+        normalize_arabic(' '.join(filter(None, (item.title, item.title_en)))),
+        normalize_arabic(' '.join(filter(None, (item.description, item.description_en)))),
+        normalize_arabic(item.category)
+    )
+
+
+class SearchIndex:
+    """فهرس البحث حسب قاعدة البيانات المستخدمة"""
+
+    def __init__(self):
+        self.enabled = True
+        self.backend = None
+        self._listening = False
+        self._lock = threading.Lock()
+        self.counters = {
+            'searches': 0,
+            'indexed': 0,
+            'removed': 0,
+            'errors': 0
+        }
+
+    def init_app(self, app):
+        """قراءة الإعدادات وتسجيل مستمع التحديث (مرة واحدة لكل عملية)"""
+        self.enabled = app.config['PORTFOLIO_SEARCH_ENABLED']
+        if not self._listening:
+            event.listen(Session, 'after_flush', self._after_flush)
+            self._listening = True
+
+    def _increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def ensure_index(self):
+        """
+        إنشاء هيكل الفهرس إذا لم يكن موجودًا، وبناؤه من المشاريع الحالية عند إنشائه لأول مرة
+
+        Returns:
+            str: الواجهة المستخدمة (fts5 أو tsvector أو like)
+        """
+        if not self.enabled:
+            self.backend = BACKEND_LIKE
+            return self.backend
+
+        dialect = db.engine.dialect.name
+        table = 'portfolio_search' if dialect == 'sqlite' else 'portfolio_search_doc'
+        existed = inspect(db.engine).has_table(table)
+        try:
+            if dialect == 'sqlite':
+                db.session.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS portfolio_search "
+                    "USING fts5(title, description, category, tokenize='unicode61')"
+                ))
+                self.backend = BACKEND_FTS5
+            elif dialect == 'postgresql':
+                db.session.execute(text(
+                    'CREATE TABLE IF NOT EXISTS portfolio_search_doc ('
+                    'portfolio_id INTEGER PRIMARY KEY REFERENCES portfolio_item(id) ON DELETE CASCADE, '
+                    'document tsvector NOT NULL)'
+                ))
+                db.session.execute(text(
+                    'CREATE INDEX IF NOT EXISTS ix_portfolio_search_doc_document '
+                    'ON portfolio_search_doc USING GIN (document)'
+                ))
+                self.backend = BACKEND_TSVECTOR
+            else:
+                self.backend = BACKEND_LIKE
+                return self.backend
+            db.session.commit()
+        except Exception as e:
+            # مثلاً SQLite مبني بدون FTS5
+            db.session.rollback()
+            logging.error(f"Full-text search unavailable, falling back to LIKE: {str(e)}")
+            self.backend = BACKEND_LIKE
+            return self.backend
+
+        if not existed:
+            count = self.rebuild()
+            logging.info(f"Portfolio search index built ({self.backend}, {count} items)")
+        return self.backend
+
+    def _write(self, connection, item_id, document):
+        title, description, category = document
+        if self.backend == BACKEND_FTS5:
+            connection.execute(text('DELETE FROM portfolio_search WHERE rowid = :id'), {'id': item_id})
+            connection.execute(text(
+                'INSERT INTO portfolio_search (rowid, title, description, category) '
+                'VALUES (:id, :title, :description, :category)'
+            ), {'id': item_id, 'title': title, 'description': description, 'category': category})
+        elif self.backend == BACKEND_TSVECTOR:
+            connection.execute(text(
+                "INSERT INTO portfolio_search_doc (portfolio_id, document) VALUES (:id, "
+                "setweight(to_tsvector('simple', :title), 'A') || "
+                "setweight(to_tsvector('simple', :description), 'B') || "
+                "setweight(to_tsvector('simple', :category), 'C')) "
+                "ON CONFLICT (portfolio_id) DO UPDATE SET document = EXCLUDED.document"
+            ), {'id': item_id, 'title': title, 'description': description, 'category': category})
+
+    def _remove(self, connection, item_id):
+        if self.backend == BACKEND_FTS5:
+            connection.execute(text('DELETE FROM portfolio_search WHERE rowid = :id'), {'id': item_id})
+        elif self.backend == BACKEND_TSVECTOR:
+            connection.execute(text('DELETE FROM portfolio_search_doc WHERE portfolio_id = :id'), {'id': item_id})
+
+    def _after_flush(self, session, flush_context):
+        if self.backend not in (BACKEND_FTS5, BACKEND_TSVECTOR):
+            return
+
+        changed = [obj for obj in session.new if isinstance(obj, PortfolioItem)]
+        for obj in session.dirty:
+            if isinstance(obj, PortfolioItem):
+                state = inspect(obj)
+                if any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+                    changed.append(obj)
+        deleted = [obj.id for obj in session.deleted if isinstance(obj, PortfolioItem)]
+        if not changed and not deleted:
+            return
+
+        connection = session.connection()
+        for obj in changed:
+            self._write(connection, obj.id, _document(obj))
+        for item_id in deleted:
+            self._remove(connection, item_id)
+        self._increment('indexed', len(changed))
+        self._increment('removed', len(deleted))
+
+    def rebuild(self):
+        """
+        إعادة بناء الفهرس من كل المشاريع
+
+        Returns:
+            int: عدد المشاريع المفهرسة
+        """
+        if self.backend not in (BACKEND_FTS5, BACKEND_TSVECTOR):
+            return 0
+
+        connection = db.session.connection()
+        if self.backend == BACKEND_FTS5:
+            connection.execute(text('DELETE FROM portfolio_search'))
+        else:
+            connection.execute(text('DELETE FROM portfolio_search_doc'))
+        items = PortfolioItem.query.all()
+        for item in items:
+            self._write(connection, item.id, _document(item))
+        db.session.commit()
+        self._increment('indexed', len(items))
+        return len(items)
+
+    def search(self, query, limit=50):
+        """
+        البحث في المشاريع
+
+        Args:
+            query (str): نص البحث
+            limit (int): أقصى عدد للنتائج
+
+        Returns:
+            list: معرفات المشاريع مرتبة حسب الصلة (الأقرب أولاً)
+        """
+        terms = search_terms(query)
+        if not terms:
+            return []
+        self._increment('searches')
+
+        try:
+            if self.backend == BACKEND_FTS5:
+                # كل كلمة بادئة بين علامتي تنصيص حتى لا تفسر كعوامل FTS5
+                match = ' '.join(f'"{term}"*' for term in terms)
+                rows = db.session.execute(text(
+                    'SELECT rowid FROM portfolio_search WHERE portfolio_search MATCH :match '
+                    'ORDER BY bm25(portfolio_search, 10.0, 3.0, 1.0) LIMIT :limit'
+                ), {'match': match, 'limit': limit})
+                return [row[0] for row in rows]
+
+            if self.backend == BACKEND_TSVECTOR:
+                tsquery = ' & '.join(f'{term}:*' for term in terms)
+                rows = db.session.execute(text(
+                    "SELECT portfolio_id FROM portfolio_search_doc, to_tsquery('simple', :tsquery) query "
+                    "WHERE document @@ query ORDER BY ts_rank(document, query) DESC, portfolio_id DESC LIMIT :limit"
+                ), {'tsquery': tsquery, 'limit': limit})
+                return [row[0] for row in rows]
+        except Exception as e:
+            db.session.rollback()
+            self._increment('errors')
+            logging.error(f"Portfolio search error, falling back to LIKE: {str(e)}")
+
+        return self._search_like(query, limit)
+
+    def _search_like(self, query, limit):
+        """البحث القديم بـ ilike (بدون توحيد النص وبدون ترتيب حسب الصلة)"""
+        search_term = f"%{query.strip()}%"
+        rows = db.session.query(PortfolioItem.id).filter(db.or_(
+            PortfolioItem.title.ilike(search_term),
+            PortfolioItem.title_en.ilike(search_term),
+            PortfolioItem.description.ilike(search_term),
+            PortfolioItem.description_en.ilike(search_term),
+            PortfolioItem.category.ilike(search_term)
+        )).order_by(PortfolioItem.created_at.desc()).limit(limit)
+        return [row[0] for row in rows]
+
+    def get_stats(self):
+        """حالة الفهرس للمراقبة"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['enabled'] = self.enabled
+        stats['backend'] = self.backend
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+search_index = SearchIndex()
+
+
+def search_portfolio_items(query, limit=50):
+    """
+    المشاريع المطابقة للبحث مرتبة حسب الصلة
+
+    Returns:
+        list: كائنات PortfolioItem
+    """
+    ids = search_index.search(query, limit)
+    if not ids:
+        return []
+    items = {item.id: item for item in PortfolioItem.query.filter(PortfolioItem.id.in_(ids))}
+    return [items[item_id] for item_id in ids if item_id in items]
+
+
+def init_portfolio_search(app):
+    """
+    تهيئة فهرس البحث في معرض الأعمال
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('PORTFOLIO_SEARCH_ENABLED', os.environ.get('PORTFOLIO_SEARCH_ENABLED', '1') != '0')
+
+    search_index.init_app(app)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Portfolio full-text search index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild', help='Rebuild the search index from all portfolio items')
+    search_parser = subparsers.add_parser('search', help='Run a search against the index')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'rebuild':
+            print(json.dumps({'backend': search_index.backend, 'indexed': search_index.rebuild()}))
+        elif args.command == 'search':
+            results = [{'id': item.id, 'title': item.title}
+                       for item in search_portfolio_items(args.query, args.limit)]
+            print(json.dumps(results, indent=2, ensure_ascii=False))
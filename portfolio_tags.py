@@ -0,0 +1,256 @@
+"""
+وسوم معرض الأعمال
+حقل PortfolioItem.category نص حر مفصول بفواصل ("هوية بصرية, تصميم شعار")، فكانت قائمة الفئات تمسح
+كل القيم المختلفة وتقسمها في بايثون، والفلترة بمطابقة النص. هنا تحفظ الفئات في جدول وسوم مفهرس:
+
+- portfolio_tag: وسم لكل اسم موحد مع عدد مشاريعه المحسوب مسبقًا (items_count)
+- portfolio_item_tag: ربط المشاريع بالوسوم، والفلترة تبدأ من فهرس (tag_id, portfolio_item_id)
+- حقل category يبقى كما هو في نماذج الإدارة؛ أي إضافة أو تعديل أو حذف لمشروع يحدث وسومه
+  وعدادات الوسوم المتأثرة في نفس المعاملة
+- قائمة الفئات محفوظة في الذاكرة حتى يتغير إصدار لقطة المحتوى (أي تعديل على المشاريع)
+
+نقل الفئات الموجودة (مرة واحدة، وتطبق تلقائيًا عند بدء التشغيل):
+
+    python portfolio_tags.py backfill
+"""
+
+import argparse
+import json
+import logging
+import re
+import threading
+from collections import namedtuple
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from content_snapshot import content_snapshot
+from database import db
+from models import PortfolioItem, PortfolioTag, SchemaMigration, portfolio_item_tag
+
+BACKFILL_VERSION = 'data_0001_portfolio_tags'
+
+# الفئة الافتراضية التي تعني كل المشاريع في واجهة المعرض
+ALL_CATEGORIES = 'الكل'
+
+TagView = namedtuple('TagView', ['id', 'name', 'items_count'])
+
+_listening = False
+
+
+def tag_key(name):
+    """الاسم الموحد للوسم: بدون مسافات زائدة وبدون فرق بين الأحرف الكبيرة والصغيرة"""
+    return re.sub(r'\s+', ' ', name or '').strip().casefold()
+
+
+def split_categories(category):
+    """
+    تقسيم نص الفئات إلى أسماء الوسوم (بدون تكرار، بنفس الترتيب)
+
+    Args:
+        category (str): نص مفصول بفواصل (عربية أو إنجليزية)
+
+    Returns:
+        list: أسماء الوسوم
+    """
+    names = []
+    seen = set()
+    for part in re.split(r'[,،]', category or ''):
+        name = re.sub(r'\s+', ' ', part).strip()
+        key = tag_key(name)
+        if key and key not in seen:
+            seen.add(key)
+            names.append(name)
+    return names
+
+
+def _tags_for(session, names, created):
+    """وسوم الأسماء، مع إنشاء غير الموجود منها (created: وسوم أنشئت في نفس الـ flush)"""
+    keys = [tag_key(name) for name in names]
+    with session.no_autoflush:
+        existing = {tag.key: tag for tag in session.query(PortfolioTag).filter(PortfolioTag.key.in_(keys))}
+    tags = []
+    for name, key in zip(names, keys):
+        tag = existing.get(key) or created.get(key)
+        if tag is None:
+            tag = PortfolioTag(name=name, key=key, items_count=0)
+            session.add(tag)
+            created[key] = tag
+        tags.append(tag)
+    return tags
+
+
+def _before_flush(session, flush_context, instances):
+    affected = session.info.setdefault('portfolio_tags_affected', set())
+    created = {}
+
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, PortfolioItem):
+            continue
+        if obj not in session.new and not inspect(obj).attrs.category.history.has_changes():
+            continue
+        old_tags = [] if obj in session.new else list(obj.tags)
+        new_tags = _tags_for(session, split_categories(obj.category), created)
+        if [tag.key for tag in old_tags] != [tag.key for tag in new_tags]:
+            obj.tags = new_tags
+        affected.update(old_tags)
+        affected.update(new_tags)
+
+    for obj in session.deleted:
+        if isinstance(obj, PortfolioItem):
+            affected.update(obj.tags)
+
+
+def _after_flush(session, flush_context):
+    affected = session.info.pop('portfolio_tags_affected', None)
+    if not affected:
+        return
+    tag_ids = {tag.id for tag in affected if tag.id is not None}
+    if tag_ids:
+        refresh_tag_counts(session.connection(), tag_ids)
+
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop('portfolio_tags_affected', None)
+
+
+def refresh_tag_counts(connection, tag_ids=None):
+    """
+    إعادة حساب عدد مشاريع الوسوم من جدول الربط
+
+    Args:
+        connection: اتصال قاعدة البيانات (داخل المعاملة الحالية)
+        tag_ids: الوسوم المطلوبة (None لكل الوسوم)
+    """
+    table = PortfolioTag.__table__
+    item_count = select(func.count()).where(portfolio_item_tag.c.tag_id == table.c.id).scalar_subquery()
+    statement = update(table).values(items_count=item_count)
+    if tag_ids is not None:
+        statement = statement.where(table.c.id.in_(tag_ids))
+    connection.execute(statement)
+
+
+def backfill_portfolio_tags():
+    """
+    إنشاء الوسوم من حقل category لكل المشاريع الموجودة وإعادة حساب العدادات
+
+    Returns:
+        dict: عدد المشاريع والوسوم
+    """
+    items = PortfolioItem.query.all()
+    created = {}
+    for item in items:
+        item.tags = _tags_for(db.session, split_categories(item.category), created)
+    db.session.flush()
+    refresh_tag_counts(db.session.connection())
+    db.session.commit()
+    # الوسوم ليست من نماذج اللقطة، فتبلغ العمليات الأخرى صراحة حتى تعيد بناء قائمة الفئات
+    content_snapshot.invalidate()
+    return {'items': len(items), 'tags': PortfolioTag.query.count()}
+
+
+def ensure_tags_backfilled():
+    """نقل الفئات الموجودة إلى جدول الوسوم مرة واحدة (يسجل في schema_migration)"""
+    if db.session.get(SchemaMigration, BACKFILL_VERSION) is not None:
+        return None
+    try:
+        result = backfill_portfolio_tags()
+        db.session.add(SchemaMigration(version=BACKFILL_VERSION))
+        db.session.commit()
+        logging.info(f"Portfolio tags backfilled: {result}")
+        return result
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error backfilling portfolio tags: {str(e)}")
+        return None
+
+
+class CategoryCache:
+    """قائمة الوسوم المستخدمة مع أعدادها، صالحة حتى يتغير إصدار لقطة المحتوى"""
+
+    def __init__(self):
+        self._entry = None  # (version, tags)
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'builds': 0
+        }
+
+    def get(self):
+        """
+        الوسوم التي لها مشاريع، مرتبة أبجديًا
+
+        Returns:
+            tuple: TagView لكل وسم
+        """
+        version = content_snapshot.version_token()
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry[0] == version:
+                self.counters['hits'] += 1
+                return entry[1]
+
+        tags = tuple(
+            TagView(tag.id, tag.name, tag.items_count)
+            for tag in PortfolioTag.query.filter(PortfolioTag.items_count > 0).order_by(PortfolioTag.name)
+        )
+        with self._lock:
+            self._entry = (version, tags)
+            self.counters['builds'] += 1
+        return tags
+
+    def names(self):
+        """أسماء الوسوم فقط (لقوائم الاختيار في صفحات الإدارة)"""
+        return [tag.name for tag in self.get()]
+
+    def find(self, name):
+        """الوسم المطابق للاسم من القائمة المحفوظة (None إذا لم يوجد)"""
+        key = tag_key(name)
+        for tag in self.get():
+            if tag_key(tag.name) == key:
+                return tag
+        return None
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['tags'] = len(self._entry[1]) if self._entry else 0
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+category_cache = CategoryCache()
+
+
+def filter_by_tag(query, tag_id):
+    """فلترة استعلام المشاريع بوسم عبر جدول الربط"""
+    return query.join(portfolio_item_tag, portfolio_item_tag.c.portfolio_item_id == PortfolioItem.id)\
+        .filter(portfolio_item_tag.c.tag_id == tag_id)
+
+
+def init_portfolio_tags(app):
+    """
+    تسجيل مستمعي مزامنة الوسوم (مرة واحدة لكل عملية)
+
+    Args:
+        app: تطبيق Flask
+    """
+    global _listening
+    if not _listening:
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'after_soft_rollback', _after_rollback)
+        _listening = True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Normalized portfolio category tags')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('backfill', help='Split existing category strings into tags and recount')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'backfill':
+            print(json.dumps(backfill_portfolio_tags(), indent=2, ensure_ascii=False))
@@ -0,0 +1,301 @@
+"""
+تدقيق خطط تنفيذ الاستعلامات
+- record: يزور صفحات وواجهات الموقع بعميل الاختبار (كمدير)، ويسجل كل استعلام SELECT لكل endpoint،
+  ثم يشغل EXPLAIN عليه (SQLite أو PostgreSQL حسب قاعدة البيانات المهيأة) ويعرض الجداول
+  التي تقرأ بمسح كامل مع اقتراح فهرس من أعمدة شروط WHERE بصيغة جاهزة لـ INDEX_MIGRATIONS
+- check: يشغل الاستعلامات الساخنة المعروفة (_hot_queries) ويفشل (رمز خروج 1) إذا قرئ جدولها
+  بمسح كامل أو إذا نقص فهرس من db_migrations.REQUIRED_INDEXES
+
+في PostgreSQL يعطل enable_seqscan أثناء EXPLAIN حتى لا يختار المخطط المسح الكامل لمجرد أن
+جداول الاختبار صغيرة؛ فيظهر Seq Scan فقط عندما لا يوجد فهرس صالح.
+
+الاستخدام:
+    python query_audit.py record [--json]
+    python query_audit.py check
+    python db_migrations.py   # تطبيق ترحيلات الفهارس
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import has_request_context, request
+from sqlalchemy import event, func, inspect
+
+from database import db
+from models import (PageVisit, PortfolioView, UserActivity, PortfolioComment, PortfolioLike, CommentLike,
+                    ContactMessage, ServiceRequest, Visitor, PortfolioItem, portfolio_item_tag)
+
+# الصفحات والواجهات التي يزورها أمر record
+AUDIT_ENDPOINTS = [
+    '/',
+    '/portfolio',
+    '/analytics/dashboard',
+    '/analytics/data?days=30',
+    '/analytics/portfolio?days=30',
+    '/analytics/activity?days=30',
+    '/analytics/visitors/data?days=30',
+    '/analytics/data/hourly',
+    '/admin/analytics/views?days=30',
+    '/admin/dashboard',
+    '/admin/messages',
+    '/admin/comments',
+]
+
+_WHERE_COLUMN = re.compile(r'(\w+)\.(\w+)\s*(?:=|<|>|<=|>=|IN|IS|LIKE)\s', re.IGNORECASE)
+
+
+class QueryRecorder:
+    """تسجيل استعلامات SELECT المنفذة مع الـ endpoint الذي نفذها"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.queries = defaultdict(list)  # endpoint -> [(statement, parameters)]
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if executemany or not statement.lstrip().upper().startswith('SELECT'):
+            return
+        endpoint = request.endpoint if has_request_context() else 'script'
+        self.queries[endpoint or 'unknown'].append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+
+def explain(connection, statement, parameters):
+    """
+    خطة تنفيذ استعلام
+
+    Returns:
+        list: (الجدول، هل هو مسح كامل، وصف الخطوة)
+    """
+    dialect = connection.dialect.name
+    steps = []
+
+    if dialect == 'sqlite':
+        for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters):
+            detail = row[-1]
+            match = re.match(r'(SCAN|SEARCH) (\w+)', detail)
+            if match and match.group(2) not in ('CONSTANT', 'SUBQUERY'):
+                # SCAN بدون فهرس = قراءة الجدول كاملاً؛ SCAN ... USING INDEX = قراءة الفهرس كاملاً
+                steps.append((match.group(2), match.group(1) == 'SCAN', detail))
+        return steps
+
+    if dialect == 'postgresql':
+        transaction = connection.begin_nested() if connection.in_transaction() else connection.begin()
+        try:
+            connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+            plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters).scalar()
+        finally:
+            transaction.rollback()
+
+        def walk(node):
+            relation = node.get('Relation Name')
+            if relation:
+                steps.append((relation, node['Node Type'] == 'Seq Scan', node['Node Type']))
+            for child in node.get('Plans', []):
+                walk(child)
+
+        walk(plan[0]['Plan'])
+        return steps
+
+    raise ValueError(f"EXPLAIN is not supported for the {dialect} dialect")
+
+
+def suggest_index(statement, table):
+    """اقتراح فهرس من أعمدة الجدول المستخدمة في شروط WHERE (تقريبي، للمراجعة قبل إضافته)"""
+    where = statement.upper().split(' WHERE ', 1)
+    if len(where) < 2:
+        return None
+    clause = statement[len(where[0]) + len(' WHERE '):]
+    columns = []
+    for table_name, column in _WHERE_COLUMN.findall(clause):
+        if table_name.strip('"') == table and column not in columns:
+            columns.append(column)
+    if not columns:
+        return None
+    return (table, f"ix_{table}_{'_'.join(columns)}", tuple(columns))
+
+
+def audit_queries(queries):
+    """
+    تشغيل EXPLAIN على الاستعلامات المسجلة (مرة واحدة لكل استعلام مميز)
+
+    Returns:
+        dict: endpoint -> {'queries', 'distinct', 'full_scans': [...]}
+    """
+    report = {}
+    connection = db.session.connection()
+    for endpoint, statements in sorted(queries.items()):
+        seen = set()
+        full_scans = []
+        for statement, parameters in statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            try:
+                steps = explain(connection, statement, parameters)
+            except Exception as e:
+                full_scans.append({'statement': statement, 'error': str(e)})
+                continue
+            for table, full_scan, detail in steps:
+                if full_scan:
+                    full_scans.append({
+                        'table': table,
+                        'plan': detail,
+                        'statement': ' '.join(statement.split())[:300],
+                        'suggested_index': suggest_index(statement, table)
+                    })
+        report[endpoint] = {'queries': len(statements), 'distinct': len(seen), 'full_scans': full_scans}
+    return report
+
+
+def record_endpoints(app, endpoints=None):
+    """زيارة الصفحات بعميل الاختبار كمدير وتسجيل استعلاماتها"""
+    from models import User
+
+    client = app.test_client()
+    client.environ_base['wsgi.url_scheme'] = 'https'
+    admin = User.query.filter_by(role='admin').first()
+    if admin is not None:
+        with client.session_transaction() as client_session:
+            client_session['_user_id'] = str(admin.id)
+            client_session['_fresh'] = True
+            client_session['last_active'] = time.time()
+
+    with QueryRecorder(db.engine) as recorder:
+        for path in endpoints or AUDIT_ENDPOINTS:
+            client.get(path)
+
+    # الاستعلامات المنفذة في خيوط خلفية لا تنتمي لطلب
+    recorder.queries.pop('script', None)
+    return recorder.queries
+
+
+def _hot_queries():
+    """الاستعلامات الساخنة المعروفة: (الاسم، الجدول، دالة تنفذ الاستعلام)"""
+    since = datetime.now() - timedelta(days=30)
+    return [
+        ('page_visit current exit page', 'page_visit',
+         lambda: PageVisit.query.filter(PageVisit.visitor_id == 1, PageVisit.exit_page == True).first()),
+        ('page_visit period count', 'page_visit',
+         lambda: db.session.query(func.count(PageVisit.id)).filter(PageVisit.visited_at >= since).scalar()),
+        ('portfolio_view project period', 'portfolio_view',
+         lambda: db.session.query(func.count(PortfolioView.id)).filter(
+             PortfolioView.portfolio_id == 1, PortfolioView.created_at >= since).scalar()),
+        ('portfolio_view existing viewer', 'portfolio_view',
+         lambda: PortfolioView.query.filter(db.or_(
+             db.and_(PortfolioView.portfolio_id == 1, PortfolioView.user_id == 1),
+             db.and_(PortfolioView.portfolio_id == 1, PortfolioView.visitor_id == 1),
+             db.and_(PortfolioView.portfolio_id == 1, PortfolioView.session_id == 'session'),
+             db.and_(PortfolioView.portfolio_id == 1, PortfolioView.ip_address == '127.0.0.1')
+         )).first()),
+        ('user_activity type period', 'user_activity',
+         lambda: db.session.query(func.count(UserActivity.id)).filter(
+             UserActivity.activity_type == 'login', UserActivity.created_at >= since).scalar()),
+        ('portfolio_comment approved list', 'portfolio_comment',
+         lambda: PortfolioComment.query.filter_by(portfolio_id=1, approved=True).order_by(
+             PortfolioComment.created_at.desc()).all()),
+        ('portfolio_comment pending count', 'portfolio_comment',
+         lambda: PortfolioComment.query.filter_by(approved=False, status='pending').count()),
+        ('portfolio_like existing like', 'portfolio_like',
+         lambda: PortfolioLike.query.filter(db.or_(
+             db.and_(PortfolioLike.portfolio_id == 1, PortfolioLike.user_id == 1),
+             db.and_(PortfolioLike.portfolio_id == 1, PortfolioLike.session_id == 'session'),
+             db.and_(PortfolioLike.portfolio_id == 1, PortfolioLike.fingerprint == 'fingerprint'),
+             db.and_(PortfolioLike.portfolio_id == 1, PortfolioLike.ip_address == '127.0.0.1')
+         )).first()),
+        ('comment_like existing like', 'comment_like',
+         lambda: CommentLike.query.filter(db.or_(
+             db.and_(CommentLike.comment_id == 1, CommentLike.user_id == 1),
+             db.and_(CommentLike.comment_id == 1, CommentLike.session_id == 'session'),
+             db.and_(CommentLike.comment_id == 1, CommentLike.ip_address == '127.0.0.1')
+         )).first()),
+        ('contact_message unread count', 'contact_message',
+         lambda: ContactMessage.query.filter_by(read=False).count()),
+        ('service_request status count', 'service_request',
+         lambda: ServiceRequest.query.filter_by(status='new').count()),
+        ('portfolio_item keyset page', 'portfolio_item',
+         lambda: PortfolioItem.query.filter(
+             PortfolioItem.created_at <= since,
+             db.or_(PortfolioItem.created_at < since, PortfolioItem.id < 1)
+         ).order_by(PortfolioItem.created_at.desc(), PortfolioItem.id.desc()).limit(13).all()),
+        ('portfolio_item_tag tag items', 'portfolio_item_tag',
+         lambda: db.session.query(portfolio_item_tag.c.portfolio_item_id).filter(
+             portfolio_item_tag.c.tag_id == 1).all()),
+        ('visitor inactive', 'visitor',
+         lambda: Visitor.query.filter(Visitor.last_visit < since).first()),
+    ]
+
+
+def check_hot_queries():
+    """
+    التحقق من أن الاستعلامات الساخنة تستخدم فهارس
+
+    Returns:
+        list: المشاكل (فارغة إذا نجح التحقق)
+    """
+    from db_migrations import REQUIRED_INDEXES
+
+    problems = []
+    inspector = inspect(db.engine)
+    for table, index_name, _ in REQUIRED_INDEXES:
+        if inspector.has_table(table) and index_name not in {index['name'] for index in inspector.get_indexes(table)}:
+            problems.append(f"missing index {index_name} on {table} (run python db_migrations.py)")
+
+    connection = db.session.connection()
+    for name, table, run_query in _hot_queries():
+        recorder = QueryRecorder(db.engine)
+        with recorder:
+            run_query()
+        for statement, parameters in recorder.queries['script']:
+            for step_table, full_scan, detail in explain(connection, statement, parameters):
+                if step_table == table and full_scan:
+                    problems.append(f"{name}: full scan of {table} ({detail})")
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query plan audit for hot access paths')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record_parser = subparsers.add_parser('record', help='Record the queries of each endpoint and EXPLAIN them')
+    record_parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+    record_parser.add_argument('--endpoint', action='append', help='Path to visit (repeatable, default: built-in list)')
+    subparsers.add_parser('check', help='Fail when a known hot query falls back to a full table scan')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'record':
+            report = audit_queries(record_endpoints(app, args.endpoint))
+            if args.json:
+                print(json.dumps(report, indent=2, ensure_ascii=False))
+            else:
+                suggestions = set()
+                for endpoint, result in report.items():
+                    print(f"{endpoint}: {result['queries']} queries ({result['distinct']} distinct), "
+                          f"{len(result['full_scans'])} full scans")
+                    for scan in result['full_scans']:
+                        print(f"    {scan.get('table', '?')}: {scan.get('plan') or scan.get('error')}")
+                        if scan.get('suggested_index'):
+                            suggestions.add(scan['suggested_index'])
+                if suggestions:
+                    print("\nSuggested INDEX_MIGRATIONS entries (review before adding a new version):")
+                    for suggestion in sorted(suggestions):
+                        print(f"    {suggestion!r},")
+        elif args.command == 'check':
+            problems = check_hot_queries()
+            for problem in problems:
+                print(f"FAIL {problem}")
+            if problems:
+                sys.exit(1)
+            print("All hot queries use an index")
@@ -0,0 +1,476 @@
+"""
+الاحتفاظ بالبيانات وضغط جداول التتبع
+جداول page_visit و portfolio_view و visitor تنمو مع كل زيارة ولا يحذف منها شيء، فتكبر الفهارس
+والنسخ الاحتياطية بسجلات لا يستعلم عنها أحد. هذه المهمة تعالج السجلات الأقدم من مدة الاحتفاظ:
+
+1. تجميعها في جداول ملخصة (DailyPageStat و DailyViewStat و DailyVisitorStat)، مع بقاء
+   DailyStat و UniqueSketch كما هي
+2. تصديرها إلى ملفات أرشيف مضغوطة مقسمة حسب التاريخ:
+   <RETENTION_ARCHIVE_DIR>/<الجدول>/<السنة>/<الشهر>/<الجدول>-<اليوم>.jsonl.gz
+3. حذفها على دفعات صغيرة (RETENTION_BATCH_SIZE) في معاملات قصيرة حتى لا تقفل الجداول طويلاً
+
+ومع كل تشغيل تحذف أقفال المشاهدة المنتهية من portfolio_view_lock.
+
+التجميع والحذف لكل دفعة في نفس المعاملة، والأرشيف يكتب قبل تأكيدها: إذا فشلت المعاملة بعد
+الكتابة قد يتكرر سطر في الأرشيف عند التشغيل التالي، لكن لا يضيع سجل.
+
+تعمل تلقائيًا مرة كل RETENTION_INTERVAL_HOURS ساعة (عملية واحدة فقط بين عمال gunicorn)، أو يدويًا:
+    python retention.py run [--dry-run] [--batch-size N] [--no-archive]
+    python retention.py status
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+
+from analytics_rollup import upsert_counters
+from database import db
+from models import (PageVisit, PortfolioView, PortfolioViewLock, Visitor, DailyVisitor, DailyPageStat,
+                    DailyViewStat, DailyVisitorStat, RetentionState)
+
+try:
+    import fcntl
+except ImportError:  # Windows: قفل داخل العملية فقط
+    fcntl = None
+
+UNKNOWN = 'unknown'
+
+
+def _day(moment):
+    return (moment or datetime.now()).date()
+
+
+def _label(value, length):
+    return (value or UNKNOWN)[:length]
+
+
+def _summarize_page_visit(row):
+    keys = {'day': _day(row['visited_at']), 'page_url': row['page_url'][:255]}
+    return DailyPageStat, keys, {
+        'visits': 1,
+        'exits': 1 if row['exit_page'] else 0,
+        'time_spent': row['time_spent'] or 0
+    }
+
+
+def _summarize_portfolio_view(row):
+    keys = {'day': _day(row['created_at']), 'portfolio_id': row['portfolio_id'],
+            'device_type': _label(row['device_type'], 50)}
+    view_count = row['view_count'] or 1
+    return DailyViewStat, keys, {
+        'viewers': 1,
+        'views': view_count,
+        'returning_viewers': 1 if view_count > 1 else 0,
+        'bounced': 1 if row['bounced'] else 0,
+        'duration': row['duration'] or 0
+    }
+
+
+def _summarize_visitor(row):
+    keys = {'day': _day(row['first_visit']), 'device': _label(row['device'], 20),
+            'browser': _label(row['browser'], 50), 'os': _label(row['os'], 50),
+            'country': _label(row['country'], 50)}
+    return DailyVisitorStat, keys, {
+        'visitors': 1,
+        'bots': 1 if row['is_bot'] else 0,
+        'visits': row['visit_count'] or 1
+    }
+
+
+class RetentionTable:
+    """وصف جدول خاضع للاحتفاظ: عمود الوقت المستخدم للحد، ويوم التقسيم، ودالة التلخيص"""
+
+    def __init__(self, name, model, time_column, day_column, setting, summarize, extra_filters=()):
+        self.name = name
+        self.model = model
+        self.table = model.__table__
+        self.time_column = self.table.c[time_column]
+        self.day_column = day_column
+        self.setting = setting
+        self.summarize = summarize
+        self.extra_filters = extra_filters
+
+    def filters(self, cutoff):
+        return [self.time_column < cutoff, *self.extra_filters]
+
+
+# ترتيب المعالجة مهم: الزائر يحذف فقط بعد حذف زياراته ومشاهداته
+RETENTION_TABLES = (
+    RetentionTable('page_visit', PageVisit, 'visited_at', 'visited_at', 'RETENTION_PAGE_VISIT_DAYS',
+                   _summarize_page_visit),
+    # المشاهدة المتكررة تحدث نفس السجل، فالحد على آخر مشاهدة وليس الأولى
+    RetentionTable('portfolio_view', PortfolioView, 'last_viewed_at', 'created_at', 'RETENTION_PORTFOLIO_VIEW_DAYS',
+                   _summarize_portfolio_view),
+    RetentionTable('visitor', Visitor, 'last_visit', 'first_visit', 'RETENTION_VISITOR_DAYS',
+                   _summarize_visitor,
+                   extra_filters=(
+                       ~select(PageVisit.id).where(PageVisit.visitor_id == Visitor.id).exists(),
+                       ~select(PortfolioView.id).where(PortfolioView.visitor_id == Visitor.id).exists(),
+                   )),
+)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def compacted_before(*table_names):
+    """
+    أحدث حد ضغط للجداول المحددة (السجلات الأقدم منه لم تعد في الجداول الأصلية)
+
+    Returns:
+        datetime: الحد، أو None إذا لم يضغط أي منها
+    """
+    result = db.session.query(db.func.max(RetentionState.compacted_before)).filter(
+        RetentionState.table_name.in_(table_names)
+    ).scalar()
+    return result
+
+
+def rebuild_start(start, *table_names):
+    """
+    بداية آمنة لإعادة بناء التجميعات من السجلات الأصلية: لا تعاد الأيام التي ضغطت سجلاتها
+    حتى لا تستبدل تجميعاتها بأعداد ناقصة
+
+    Args:
+        start (datetime, optional): البداية المطلوبة (None لكل البيانات)
+
+    Returns:
+        datetime: البداية بعد تطبيق حد الضغط
+    """
+    horizon = compacted_before(*table_names)
+    if horizon is None:
+        return start
+    safe_start = datetime.combine(horizon.date() + timedelta(days=1), datetime.min.time())
+    return safe_start if start is None or start < safe_start else start
+
+
+class RetentionJob:
+    """تشغيل الضغط يدويًا أو دوريًا في خيط خلفي"""
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.interval = 24 * 3600
+        self.batch_size = 1000
+        self.batch_pause = 0.1
+        self.archive_enabled = True
+        self.archive_dir = None
+        self.retention_days = {}
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self.counters = {
+            'runs': 0,
+            'rows_compacted': 0,
+            'errors': 0
+        }
+        self.last_run = None
+        self.last_result = None
+        self.last_error = None
+
+    def init_app(self, app):
+        """قراءة الإعدادات"""
+        self.app = app
+        self.enabled = app.config['RETENTION_SCHEDULE_ENABLED']
+        self.interval = app.config['RETENTION_INTERVAL_HOURS'] * 3600
+        self.batch_size = app.config['RETENTION_BATCH_SIZE']
+        self.batch_pause = app.config['RETENTION_BATCH_PAUSE']
+        self.archive_enabled = app.config['RETENTION_ARCHIVE_ENABLED']
+        self.archive_dir = app.config['RETENTION_ARCHIVE_DIR']
+        self.retention_days = {spec.name: app.config[spec.setting] for spec in RETENTION_TABLES}
+
+        # لا يحذف الزائر قبل زياراته ومشاهداته
+        minimum = max(self.retention_days['page_visit'], self.retention_days['portfolio_view'])
+        if self.retention_days['visitor'] < minimum:
+            logging.warning(f"RETENTION_VISITOR_DAYS raised to {minimum} to outlive page visits and views")
+            self.retention_days['visitor'] = minimum
+
+    def ensure_scheduled(self):
+        """تشغيل خيط الجدولة (مع إعادة تشغيله بعد fork في عمال gunicorn)"""
+        if not self.enabled:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop_event.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='retention')
+            self._thread.daemon = True  # جعل الخيط daemon حتى يتوقف عند إيقاف التطبيق
+            self._thread.start()
+            logging.info("Started retention scheduler thread")
+
+    def _run(self):
+        # التحقق كل ساعة؛ التشغيل الفعلي مرة كل فترة بين كل العمليات (ملف ختم في مجلد الأرشيف)
+        while not self._stop_event.wait(min(self.interval, 3600)):
+            try:
+                with self.app.app_context():
+                    self.run_if_due()
+            except Exception as e:
+                logging.error(f"Error running scheduled retention: {str(e)}")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _stamp_path(self):
+        return os.path.join(self.archive_dir, '.retention-last-run')
+
+    def run_if_due(self):
+        """تشغيل الضغط إذا مرت الفترة منذ آخر تشغيل ولم تكن عملية أخرى تشغله الآن"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with open(os.path.join(self.archive_dir, '.retention.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None  # عامل آخر يشغلها
+
+            stamp = self._stamp_path()
+            if os.path.exists(stamp) and time.time() - os.path.getmtime(stamp) < self.interval:
+                return None
+
+            result = self.run()
+            with open(stamp, 'w') as stamp_file:
+                stamp_file.write(datetime.now().isoformat())
+            return result
+
+    def cutoffs(self, now=None):
+        """حد الاحتفاظ لكل جدول"""
+        now = now or datetime.now()
+        return {name: now - timedelta(days=days) for name, days in self.retention_days.items()}
+
+    def run(self, dry_run=False, batch_size=None, archive=None, progress=None):
+        """
+        ضغط كل الجداول
+
+        Args:
+            dry_run (bool): عدّ السجلات المؤهلة فقط دون أي كتابة
+            batch_size (int, optional): عدد السجلات في كل دفعة
+            archive (bool, optional): كتابة الأرشيف (الافتراضي من الإعدادات)
+            progress (callable, optional): دالة تستقبل رسالة تقدم نصية
+
+        Returns:
+            dict: نتيجة كل جدول
+        """
+        report = progress or (lambda message: logging.info(message))
+        batch_size = batch_size or self.batch_size
+        archive = self.archive_enabled if archive is None else archive
+
+        with self._run_lock:
+            cutoffs = self.cutoffs()
+            result = {}
+            try:
+                for spec in RETENTION_TABLES:
+                    if dry_run:
+                        result[spec.name] = self._preview(spec, cutoffs[spec.name], report)
+                    else:
+                        result[spec.name] = self._compact(spec, cutoffs[spec.name], batch_size, archive, report)
+
+                # أيام الزوار المحتسبين لم تعد لازمة بعد ضغط زيارات ذلك اليوم (الأعداد في DailyStat)
+                result['daily_visitor'] = self._compact_daily_visitors(cutoffs['page_visit'], dry_run, report)
+                # أقفال المشاهدة المنتهية (القفل المنتهي يعاد استخدامه لنفس الهوية، فيبقى فقط ما لن يعود)
+                result['portfolio_view_lock'] = self._purge_view_locks(dry_run, report)
+            except Exception as e:
+                db.session.rollback()
+                with self._lock:
+                    self.counters['errors'] += 1
+                    self.last_error = str(e)
+                raise
+
+            if not dry_run:
+                with self._lock:
+                    self.counters['runs'] += 1
+                    self.counters['rows_compacted'] += sum(item['rows'] for item in result.values())
+                    self.last_run = datetime.now().isoformat()
+                    self.last_result = result
+            return result
+
+    def _preview(self, spec, cutoff, report):
+        rows, oldest = db.session.execute(
+            select(db.func.count(), db.func.min(spec.time_column)).select_from(spec.table).where(*spec.filters(cutoff))
+        ).one()
+        report(f"{spec.name}: {rows} rows older than {cutoff:%Y-%m-%d %H:%M} (oldest {oldest or '-'})")
+        return {'cutoff': cutoff.isoformat(), 'rows': rows, 'oldest': oldest.isoformat() if oldest else None,
+                'dry_run': True}
+
+    def _mark_compacted(self, table_name, cutoff, rows=0):
+        state = db.session.get(RetentionState, table_name)
+        if state is None:
+            state = RetentionState(table_name=table_name, compacted_before=cutoff, rows_compacted=0)
+            db.session.add(state)
+        state.compacted_before = max(state.compacted_before, cutoff)
+        state.rows_compacted = (state.rows_compacted or 0) + rows
+
+    def _compact(self, spec, cutoff, batch_size, archive, report):
+        """تجميع وأرشفة وحذف سجلات جدول على دفعات"""
+        # تسجيل الحد قبل الحذف حتى لا تعيد أدوات إعادة البناء حساب أيام ناقصة أثناء التشغيل
+        self._mark_compacted(spec.name, cutoff)
+        db.session.commit()
+
+        primary_key = spec.table.c.id
+        total = 0
+        batches = 0
+        while not self._stop_event.is_set():
+            rows = db.session.execute(
+                select(spec.table).where(*spec.filters(cutoff)).order_by(primary_key).limit(batch_size)
+            ).mappings().all()
+            if not rows:
+                break
+
+            if archive:
+                self._archive(spec, rows)
+
+            summary = defaultdict(Counter)
+            for row in rows:
+                model, keys, increments = spec.summarize(row)
+                summary[(model, tuple(sorted(keys.items())))].update(increments)
+
+            connection = db.session.connection()
+            for (model, keys), increments in summary.items():
+                upsert_counters(connection, model, dict(keys), dict(increments))
+            connection.execute(spec.table.delete().where(primary_key.in_([row['id'] for row in rows])))
+            self._mark_compacted(spec.name, cutoff, len(rows))
+            db.session.commit()
+
+            total += len(rows)
+            batches += 1
+            report(f"{spec.name}: compacted {total} rows")
+
+            if len(rows) < batch_size:
+                break
+            # مهلة قصيرة بين الدفعات حتى تمر كتابات الزيارات الجديدة
+            if self.batch_pause:
+                time.sleep(self.batch_pause)
+
+        return {'cutoff': cutoff.isoformat(), 'rows': total, 'batches': batches, 'archived': total if archive else 0}
+
+    def _compact_daily_visitors(self, cutoff, dry_run, report):
+        cutoff_day = cutoff.date()
+        days = [day for (day,) in db.session.query(DailyVisitor.day).filter(
+            DailyVisitor.day < cutoff_day).distinct().order_by(DailyVisitor.day)]
+        if dry_run:
+            rows = DailyVisitor.query.filter(DailyVisitor.day < cutoff_day).count()
+            report(f"daily_visitor: {rows} rows in {len(days)} days before {cutoff_day}")
+            return {'cutoff': cutoff_day.isoformat(), 'rows': rows, 'dry_run': True}
+
+        total = 0
+        for day in days:
+            total += DailyVisitor.query.filter(DailyVisitor.day == day).delete(synchronize_session=False)
+            db.session.commit()
+        if days:
+            report(f"daily_visitor: removed {total} rows in {len(days)} days")
+        return {'cutoff': cutoff_day.isoformat(), 'rows': total, 'batches': len(days)}
+
+    def _purge_view_locks(self, dry_run, report):
+        expired = PortfolioViewLock.query.filter(PortfolioViewLock.expires_at <= datetime.now())
+        if dry_run:
+            rows = expired.count()
+            report(f"portfolio_view_lock: {rows} expired locks")
+            return {'rows': rows, 'dry_run': True}
+
+        rows = expired.delete(synchronize_session=False)
+        db.session.commit()
+        if rows:
+            report(f"portfolio_view_lock: removed {rows} expired locks")
+        return {'rows': rows}
+
+    def _archive(self, spec, rows):
+        """إلحاق السجلات بملف أرشيف اليوم (gzip يقبل الإلحاق كأجزاء متتالية)"""
+        by_day = defaultdict(list)
+        for row in rows:
+            by_day[_day(row[spec.day_column])].append(row)
+
+        for day, day_rows in by_day.items():
+            directory = os.path.join(self.archive_dir, spec.name, f"{day:%Y}", f"{day:%m}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{spec.name}-{day:%Y-%m-%d}.jsonl.gz")
+            with gzip.open(path, 'at', encoding='utf-8') as archive_file:
+                for row in day_rows:
+                    archive_file.write(json.dumps(dict(row), default=_json_default, ensure_ascii=False) + '\n')
+
+    def status(self):
+        """حدود الضغط المسجلة لكل جدول"""
+        return {
+            state.table_name: {
+                'compacted_before': state.compacted_before.isoformat(),
+                'rows_compacted': state.rows_compacted,
+                'updated_at': state.updated_at.isoformat() if state.updated_at else None
+            }
+            for state in RetentionState.query.all()
+        }
+
+    def get_stats(self):
+        """حالة المهمة للمراقبة"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['last_run'] = self.last_run
+            stats['last_result'] = self.last_result
+            stats['last_error'] = self.last_error
+        stats['enabled'] = self.enabled
+        stats['interval_hours'] = self.interval / 3600
+        stats['retention_days'] = dict(self.retention_days)
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+retention_job = RetentionJob()
+
+
+def init_retention(app):
+    """
+    تهيئة مهمة الاحتفاظ بالبيانات
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('RETENTION_PAGE_VISIT_DAYS', int(os.environ.get('RETENTION_PAGE_VISIT_DAYS', 90)))
+    app.config.setdefault('RETENTION_PORTFOLIO_VIEW_DAYS', int(os.environ.get('RETENTION_PORTFOLIO_VIEW_DAYS', 180)))
+    app.config.setdefault('RETENTION_VISITOR_DAYS', int(os.environ.get('RETENTION_VISITOR_DAYS', 180)))
+    app.config.setdefault('RETENTION_BATCH_SIZE', int(os.environ.get('RETENTION_BATCH_SIZE', 1000)))
+    app.config.setdefault('RETENTION_BATCH_PAUSE', float(os.environ.get('RETENTION_BATCH_PAUSE', 0.1)))
+    app.config.setdefault('RETENTION_ARCHIVE_ENABLED', os.environ.get('RETENTION_ARCHIVE_ENABLED', '1') != '0')
+    app.config.setdefault('RETENTION_ARCHIVE_DIR', os.environ.get(
+        'RETENTION_ARCHIVE_DIR', os.path.join(app.root_path, 'archives')))
+    app.config.setdefault('RETENTION_SCHEDULE_ENABLED', os.environ.get('RETENTION_SCHEDULE_ENABLED', '1') != '0')
+    app.config.setdefault('RETENTION_INTERVAL_HOURS', float(os.environ.get('RETENTION_INTERVAL_HOURS', 24)))
+
+    retention_job.init_app(app)
+
+    # يبدأ خيط الجدولة مع أول طلب في كل عامل (بعد fork)
+    app.before_request(retention_job.ensure_scheduled)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Retention and compaction of tracking tables')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='Roll up, archive and delete rows older than the retention window')
+    run_parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be compacted')
+    run_parser.add_argument('--batch-size', type=int, default=None)
+    run_parser.add_argument('--no-archive', action='store_true', help='Delete without writing archive files')
+    subparsers.add_parser('status', help='Show the compaction horizon of each table')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'run':
+            result = retention_job.run(dry_run=args.dry_run, batch_size=args.batch_size,
+                                       archive=False if args.no_archive else None, progress=print)
+            print(json.dumps(result, indent=2, ensure_ascii=False))
+        elif args.command == 'status':
+            print(json.dumps(retention_job.status(), indent=2, ensure_ascii=False))
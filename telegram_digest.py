@@ -0,0 +1,173 @@
+"""
+وضع الملخص الدوري لإشعارات التيليجرام
+بدلاً من رسالة لكل زائر جديد أو مشاهدة أو إعجاب أو زائر نشط، تُجمع هذه الأحداث داخل نافذة زمنية
+وترسل في نهايتها رسالة واحدة بالأعداد وأكثر المشاريع تفاعلاً وأهم مصادر الزيارات.
+رسائل التواصل وطلبات الخدمات ورموز المصادقة الثنائية لا تمر من هنا وترسل فورًا
+"""
+
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlparse
+
+# أنواع الأحداث التي يمكن تجميعها
+EVENT_VISITOR = 'visitor'
+EVENT_VIEW = 'view'
+EVENT_LIKE = 'like'
+EVENT_LIVE_VISITOR = 'live_visitor'
+DIGEST_EVENTS = (EVENT_VISITOR, EVENT_VIEW, EVENT_LIKE, EVENT_LIVE_VISITOR)
+
+
+def _referrer_host(referrer):
+    """اسم النطاق من رابط الإحالة (بدون www)"""
+    if not referrer:
+        return None
+    host = urlparse(referrer).netloc.lower() or referrer[:50]
+    return host[4:] if host.startswith('www.') else host
+
+
+class TelegramDigest:
+    """تجميع أحداث الإشعارات المتكررة وإرسالها كملخص واحد لكل نافذة زمنية"""
+
+    def __init__(self, interval=600, top_count=5):
+        self.enabled = False
+        self.interval = interval
+        self.top_count = top_count
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self._reset()
+        self.digests_sent = 0
+        self.events_coalesced = 0
+
+    def init_app(self, app):
+        """قراءة الإعدادات من تطبيق Flask"""
+        self.enabled = app.config['TELEGRAM_DIGEST_ENABLED']
+        self.interval = app.config['TELEGRAM_DIGEST_INTERVAL']
+        self.top_count = app.config['TELEGRAM_DIGEST_TOP_COUNT']
+
+    def _reset(self):
+        self.window_started_at = datetime.now()
+        self.counts = Counter()
+        self.projects = Counter()
+        self.referrers = Counter()
+
+    def record(self, event_type, project=None, referrer=None):
+        """
+        إضافة حدث إلى الملخص الحالي
+
+        Args:
+            event_type (str): نوع الحدث (أحد DIGEST_EVENTS)
+            project (str, optional): عنوان المشروع المرتبط بالحدث
+            referrer (str, optional): رابط الإحالة
+
+        Returns:
+            bool: True إذا تم تجميع الحدث، False إذا كان وضع الملخص معطلاً ويجب إرسال الإشعار الفردي
+        """
+        if not self.enabled:
+            return False
+
+        self._ensure_worker()
+        host = _referrer_host(referrer)
+        with self._lock:
+            self.counts[event_type] += 1
+            if project:
+                self.projects[project] += 1
+            if host:
+                self.referrers[host] += 1
+            self.events_coalesced += 1
+        return True
+
+    def _ensure_worker(self):
+        """تشغيل خيط الإرسال الدوري (مع إعادة تشغيله بعد fork في عمال gunicorn)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop_event.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='telegram-digest')
+            self._thread.daemon = True  # جعل الخيط daemon حتى يتوقف عند إيقاف التطبيق
+            self._thread.start()
+            logging.info("Started Telegram digest thread")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error sending Telegram digest: {str(e)}")
+
+    def flush(self):
+        """
+        إرسال ملخص النافذة الحالية وبدء نافذة جديدة
+
+        Returns:
+            bool: True إذا تم إرسال ملخص، False إذا لم تكن هناك أحداث
+        """
+        from telegram_service import send_telegram_message, format_digest_notification
+
+        with self._lock:
+            if not self.counts:
+                self.window_started_at = datetime.now()
+                return False
+            counts = dict(self.counts)
+            top_projects = self.projects.most_common(self.top_count)
+            top_referrers = self.referrers.most_common(self.top_count)
+            started_at = self.window_started_at
+            self._reset()
+
+        message = format_digest_notification(counts, top_projects, top_referrers, started_at, datetime.now())
+        send_telegram_message(message)
+        with self._lock:
+            self.digests_sent += 1
+        logging.info(f"Sent Telegram digest with {sum(counts.values())} events")
+        return True
+
+    def stop(self, flush=True):
+        """إيقاف خيط الملخص مع إرسال ما تم تجميعه"""
+        self._stop_event.set()
+        if flush:
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error sending Telegram digest on shutdown: {str(e)}")
+
+    def get_stats(self):
+        """حالة الملخص الحالي للمراقبة"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'interval': self.interval,
+                'pending': dict(self.counts),
+                'window_started_at': self.window_started_at.strftime('%Y-%m-%d %H:%M:%S'),
+                'digests_sent': self.digests_sent,
+                'events_coalesced': self.events_coalesced
+            }
+
+
+# نسخة مشتركة على مستوى العملية
+telegram_digest = TelegramDigest()
+
+
+def init_telegram_digest(app):
+    """
+    تهيئة وضع الملخص الدوري
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('TELEGRAM_DIGEST_ENABLED', os.environ.get('TELEGRAM_DIGEST_ENABLED', '1') != '0')
+    app.config.setdefault('TELEGRAM_DIGEST_INTERVAL', int(os.environ.get('TELEGRAM_DIGEST_INTERVAL', 600)))
+    app.config.setdefault('TELEGRAM_DIGEST_TOP_COUNT', int(os.environ.get('TELEGRAM_DIGEST_TOP_COUNT', 5)))
+
+    telegram_digest.init_app(app)
+
+    # إرسال الملخص الأخير عند إيقاف العملية
+    atexit.register(telegram_digest.stop)
@@ -0,0 +1,398 @@
+"""
+مرسل إشعارات التيليجرام في الخلفية
+معالجات الطلبات تضع الرسالة في طابور محدود الحجم وتعود فورًا، بينما يرسلها خيط خلفي
+عبر جلسة HTTP دائمة (keep-alive) مع تحديد معدل الإرسال لكل محادثة (token bucket)
+وإعادة المحاولة مع تأخير متزايد. الرسائل العاجلة (رمز المصادقة الثنائية) ترسل بشكل متزامن
+بمحاولة واحدة مهلتها TELEGRAM_SYNC_TIMEOUT، دون انتظار حدود المعدل أو إعادة المحاولة داخل الطلب
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# حدود تيليجرام: رسالة واحدة في الثانية تقريبًا لكل محادثة و 30 رسالة في الثانية للبوت
+DEFAULT_CHAT_RATE = 1.0
+DEFAULT_CHAT_BURST = 3
+DEFAULT_GLOBAL_RATE = 30.0
+
+
+class TokenBucket:
+    """دلو رموز لتحديد المعدل: يعيد مدة الانتظار اللازمة قبل الإرسال التالي"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """حجز رمز واحد وإرجاع عدد الثواني الواجب انتظارها قبل استخدامه"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def pause(self, seconds):
+        """إيقاف الدلو مؤقتًا (عند استلام retry_after من تيليجرام)"""
+        with self._lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class TelegramMessage:
+    """رسالة في طابور الإرسال مع حالة تسليمها"""
+
+    __slots__ = ('bot_token', 'chat_id', 'text', 'attempts', 'result')
+
+    def __init__(self, bot_token, chat_id, text):
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.text = text
+        self.attempts = 0
+        self.result = None
+
+
+class TelegramDispatcher:
+    """طابور رسائل التيليجرام مع خيط إرسال خلفي"""
+
+    def __init__(self, max_queue_size=1000, max_retries=3, retry_backoff=1.0, request_timeout=10,
+                 sync_timeout=5, chat_rate=DEFAULT_CHAT_RATE, chat_burst=DEFAULT_CHAT_BURST, global_rate=DEFAULT_GLOBAL_RATE,
+                 api_url='https://api.telegram.org'):
+        self.enabled = True
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.request_timeout = request_timeout
+        self.sync_timeout = sync_timeout
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.api_url = api_url.rstrip('/')
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self._start_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self.counters = {
+            'enqueued': 0,  # الرسائل المقبولة في الطابور
+            'dropped': 0,  # الرسائل المتجاهلة بسبب امتلاء الطابور
+            'sent': 0,  # الرسائل المرسلة بنجاح
+            'sent_sync': 0,  # الرسائل المرسلة بشكل متزامن (المصادقة الثنائية)
+            'failed': 0,  # الرسائل التي فشل إرسالها نهائيًا
+            'retries': 0,  # محاولات الإعادة
+            'rate_limited': 0,  # ردود 429 من تيليجرام
+            'throttled': 0,  # مرات الانتظار بسبب تحديد المعدل المحلي
+            'max_queue_depth': 0  # أقصى عمق وصل إليه الطابور
+        }
+        self.last_sent_at = None
+        self.last_error = None
+
+    def init_app(self, app):
+        """قراءة الإعدادات من تطبيق Flask"""
+        self.enabled = app.config['TELEGRAM_ASYNC']
+        self.max_retries = app.config['TELEGRAM_MAX_RETRIES']
+        self.retry_backoff = app.config['TELEGRAM_RETRY_BACKOFF']
+        self.request_timeout = app.config['TELEGRAM_REQUEST_TIMEOUT']
+        self.sync_timeout = app.config['TELEGRAM_SYNC_TIMEOUT']
+        self.chat_rate = app.config['TELEGRAM_CHAT_RATE']
+        self.chat_burst = app.config['TELEGRAM_CHAT_BURST']
+        self.api_url = app.config['TELEGRAM_API_URL'].rstrip('/')
+        self._global_bucket = TokenBucket(app.config['TELEGRAM_GLOBAL_RATE'], app.config['TELEGRAM_GLOBAL_RATE'])
+        with self._buckets_lock:
+            self._chat_buckets.clear()
+
+        max_queue_size = app.config['TELEGRAM_QUEUE_SIZE']
+        if max_queue_size != self.max_queue_size:
+            self.max_queue_size = max_queue_size
+            self._queue = queue.Queue(maxsize=max_queue_size)
+
+    def _increment(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def send(self, bot_token, chat_id, text, wait=False):
+        """
+        إرسال رسالة: وضعها في الطابور، أو إرسالها فورًا إذا طُلب الانتظار أو كان الإرسال غير المتزامن معطلاً
+
+        Args:
+            bot_token (str): توكن البوت
+            chat_id (str): معرف المحادثة
+            text (str): نص الرسالة بصيغة HTML
+            wait (bool): إرسال متزامن وإرجاع نتيجة التسليم الفعلية
+
+        Returns:
+            bool: نتيجة التسليم عند الإرسال المتزامن، أو قبول الرسالة في الطابور
+        """
+        message = TelegramMessage(bot_token, chat_id, text)
+
+        if wait or not self.enabled:
+            result = self._deliver_now(message)
+            if result:
+                self._increment('sent_sync')
+            return result
+
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._increment('dropped')
+            logging.warning("Telegram queue is full, dropping message")
+            return False
+
+        depth = self._queue.qsize()
+        with self._counters_lock:
+            self.counters['enqueued'] += 1
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], depth)
+        return True
+
+    def _ensure_worker(self):
+        """تشغيل خيط الإرسال عند الحاجة (مع إعادة تشغيله بعد fork في عمال gunicorn)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop_event.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='telegram-dispatcher')
+            self._thread.daemon = True  # جعل الخيط daemon حتى يتوقف عند إيقاف التطبيق
+            self._thread.start()
+            logging.info("Started Telegram dispatcher thread")
+
+    def _run(self):
+        """حلقة خيط الإرسال"""
+        while not self._stop_event.is_set():
+            try:
+                message = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            try:
+                self._deliver(message)
+            except Exception as e:
+                logging.error(f"Error in Telegram dispatcher thread: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _get_session(self):
+        """جلسة HTTP دائمة لإعادة استخدام اتصال TLS مع api.telegram.org (واحدة لكل عملية)"""
+        if self._session is not None and self._session_pid == os.getpid():
+            return self._session
+
+        with self._session_lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+                session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+                self._session = session
+                self._session_pid = os.getpid()
+            return self._session
+
+    def _get_chat_bucket(self, chat_id):
+        with self._buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self._chat_buckets[chat_id] = bucket
+            return bucket
+
+    def _wait_for_rate_limit(self, chat_bucket):
+        delay = max(self._global_bucket.reserve(), chat_bucket.reserve())
+        if delay > 0:
+            self._increment('throttled')
+            time.sleep(delay)
+
+    def _request(self, message):
+        """رابط وجسم طلب sendMessage"""
+        url = f"{self.api_url}/bot{message.bot_token}/sendMessage"
+        payload = {
+            'chat_id': message.chat_id,
+            'text': message.text,
+            'parse_mode': 'HTML'
+        }
+        return url, payload
+
+    def _deliver_now(self, message):
+        """
+        إرسال متزامن داخل الطلب: محاولة واحدة بمهلة sync_timeout بدون أي انتظار
+
+        الرمز يحجز من دلو المحادثة حتى يتباطأ الإرسال الخلفي بعده، لكن الطلب لا ينتظر الدلو
+        ولا retry_after؛ عند الفشل يعرف المستخدم فورًا ويمكنه طلب رمز جديد
+        """
+        chat_bucket = self._get_chat_bucket(message.chat_id)
+        self._global_bucket.reserve()
+        chat_bucket.reserve()
+        url, payload = self._request(message)
+        message.attempts += 1
+
+        try:
+            response = self._get_session().post(url, json=payload, timeout=self.sync_timeout)
+            logging.info(f"Telegram API response status: {response.status_code}")
+
+            if response.status_code == 200 and response.json().get('ok'):
+                message.result = True
+                self._increment('sent')
+                self.last_sent_at = datetime.now()
+                logging.info("Telegram message sent successfully")
+                return True
+
+            if response.status_code == 429:
+                self._increment('rate_limited')
+                chat_bucket.pause(response.json().get('parameters', {}).get('retry_after', 1))
+            self.last_error = f"{response.status_code}: {response.text[:200]}"
+            logging.error(f"Failed to send Telegram message. Status code: {response.status_code}, Response: {response.text}")
+        except Exception as e:
+            self.last_error = str(e)
+            logging.error(f"Error sending Telegram message: {str(e)}")
+
+        message.result = False
+        self._increment('failed')
+        return False
+
+    def _deliver(self, message):
+        """إرسال رسالة مع احترام حدود المعدل وإعادة المحاولة عند الأخطاء المؤقتة"""
+        chat_bucket = self._get_chat_bucket(message.chat_id)
+        url, payload = self._request(message)
+
+        try:
+            while True:
+                self._wait_for_rate_limit(chat_bucket)
+                message.attempts += 1
+                retry_after = None
+
+                try:
+                    response = self._get_session().post(url, json=payload, timeout=self.request_timeout)
+                    logging.info(f"Telegram API response status: {response.status_code}")
+
+                    if response.status_code == 200 and response.json().get('ok'):
+                        message.result = True
+                        self._increment('sent')
+                        self.last_sent_at = datetime.now()
+                        logging.info("Telegram message sent successfully")
+                        return True
+
+                    if response.status_code == 429:
+                        self._increment('rate_limited')
+                        retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+                        chat_bucket.pause(retry_after)
+                    elif response.status_code < 500:
+                        # أخطاء الطلب (توكن أو محادثة غير صحيحة، HTML غير صالح) لا تفيد معها الإعادة
+                        self.last_error = f"{response.status_code}: {response.text[:200]}"
+                        logging.error(f"Failed to send Telegram message. Status code: {response.status_code}, Response: {response.text}")
+                        break
+                    else:
+                        self.last_error = f"{response.status_code}: {response.text[:200]}"
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self.last_error = str(e)
+                    logging.warning(f"Telegram request error: {str(e)}")
+
+                if message.attempts > self.max_retries:
+                    logging.error(f"Giving up on Telegram message after {message.attempts} attempts")
+                    break
+
+                self._increment('retries')
+                if retry_after is None:
+                    time.sleep(self.retry_backoff * (2 ** (message.attempts - 1)))
+        except Exception as e:
+            self.last_error = str(e)
+            logging.error(f"Error sending Telegram message: {str(e)}")
+
+        message.result = False
+        self._increment('failed')
+        return False
+
+    def flush(self, timeout=None):
+        """
+        انتظار إرسال كل الرسائل الموجودة حاليًا في الطابور
+
+        Returns:
+            bool: True إذا فرغ الطابور قبل انتهاء المهلة
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                # لا يوجد خيط إرسال في هذه العملية: الإرسال من الخيط الحالي
+                try:
+                    message = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._deliver(message)
+                finally:
+                    self._queue.task_done()
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stop(self, flush=True, timeout=10):
+        """إيقاف خيط الإرسال مع محاولة إرسال ما تبقى في الطابور"""
+        if flush:
+            try:
+                self.flush(timeout=timeout)
+            except Exception as e:
+                logging.error(f"Error flushing Telegram queue on shutdown: {str(e)}")
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=2)
+
+    def get_stats(self):
+        """إحصائيات الطابور للمراقبة"""
+        with self._counters_lock:
+            stats = dict(self.counters)
+        stats.update({
+            'enabled': self.enabled,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue_size,
+            'worker_alive': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+            'last_sent_at': self.last_sent_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_sent_at else None,
+            'last_error': self.last_error
+        })
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+telegram_dispatcher = TelegramDispatcher(api_url=os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org'))
+
+# إرسال الرسائل المتبقية عند إيقاف العملية
+atexit.register(telegram_dispatcher.stop)
+
+
+def init_telegram_dispatcher(app):
+    """
+    تهيئة مرسل إشعارات التيليجرام
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('TELEGRAM_ASYNC', os.environ.get('TELEGRAM_ASYNC', '1') != '0')
+    app.config.setdefault('TELEGRAM_QUEUE_SIZE', int(os.environ.get('TELEGRAM_QUEUE_SIZE', 1000)))
+    app.config.setdefault('TELEGRAM_MAX_RETRIES', int(os.environ.get('TELEGRAM_MAX_RETRIES', 3)))
+    app.config.setdefault('TELEGRAM_RETRY_BACKOFF', float(os.environ.get('TELEGRAM_RETRY_BACKOFF', 1.0)))
+    app.config.setdefault('TELEGRAM_REQUEST_TIMEOUT', float(os.environ.get('TELEGRAM_REQUEST_TIMEOUT', 10)))
+    app.config.setdefault('TELEGRAM_SYNC_TIMEOUT', float(os.environ.get('TELEGRAM_SYNC_TIMEOUT', 5)))
+    app.config.setdefault('TELEGRAM_CHAT_RATE', float(os.environ.get('TELEGRAM_CHAT_RATE', DEFAULT_CHAT_RATE)))
+    app.config.setdefault('TELEGRAM_CHAT_BURST', int(os.environ.get('TELEGRAM_CHAT_BURST', DEFAULT_CHAT_BURST)))
+    app.config.setdefault('TELEGRAM_GLOBAL_RATE', float(os.environ.get('TELEGRAM_GLOBAL_RATE', DEFAULT_GLOBAL_RATE)))
+    app.config.setdefault('TELEGRAM_API_URL', os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org'))
+
+    telegram_dispatcher.init_app(app)
@@ -4,6 +4,7 @@
 """
 
 import os
+import html
 import json
 import logging
 import requests
@@ -12,15 +13,21 @@ import time
 from datetime import datetime, timedelta
 from flask import flash
 
-def send_telegram_message(message):
+from telegram_dispatcher import telegram_dispatcher
+from ua_classifier import classify_user_agent, describe_browser, describe_device
+
+def send_telegram_message(message, wait=False):
     """
     إرسال رسالة إلى بوت التيليجرام
     
+    تضع الرسالة في طابور مرسل الخلفية وتعود فورًا حتى لا ينتظر الطلب استجابة تيليجرام
+    
     Args:
         message (str): نص الرسالة المراد إرسالها
+        wait (bool): انتظار التسليم الفعلي (لرموز المصادقة الثنائية واختبار الإعدادات)
         
     Returns:
-        bool: True إذا تم الإرسال بنجاح، False إذا فشل الإرسال
+        bool: True إذا تم الإرسال (أو قبول الرسالة في الطابور) بنجاح، False إذا فشل الإرسال
     """
     logging.info(f"Going to send Telegram message: {message[:50]}...")
     
@@ -28,52 +35,17 @@ def send_telegram_message(message):
     try:
         bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
         chat_id = os.environ.get('TELEGRAM_CHAT_ID')
-        
-        # طباعة المتغيرات البيئية المتاحة للتصحيح
-        all_env_vars = {key: '***' if key in ['TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHAT_ID'] else value[:10] + '...' if isinstance(value, str) and len(value) > 10 else value 
-                       for key, value in os.environ.items()}
-        logging.info(f"Available env vars: {all_env_vars}")
     except Exception as e:
         logging.error(f"Error accessing environment variables: {str(e)}")
         bot_token = None
         chat_id = None
     
-    logging.info(f"Bot token exists: {bool(bot_token)}, Chat ID exists: {bool(chat_id)}")
-    
     if not bot_token or not chat_id:
         logging.warning("Telegram configuration missing: TELEGRAM_BOT_TOKEN or TELEGRAM_CHAT_ID not found in environment variables.")
         return False
     
     try:
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        payload = {
-            'chat_id': chat_id,
-            'text': message,
-            'parse_mode': 'HTML'
-        }
-        
-        # طباعة قيم المتغيرات للتصحيح (مع تعتيم التوكن)
-        if bot_token:
-            masked_token = bot_token[:5] + "..." + bot_token[-5:]
-            logging.info(f"Using bot token: {masked_token}")
-        logging.info(f"Using chat ID: {chat_id}")
-        
-        logging.info("Sending Telegram message...")
-        response = requests.post(url, json=payload, timeout=10)
-        logging.info(f"Telegram API response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('ok'):
-                logging.info("Telegram message sent successfully")
-                return True
-            else:
-                logging.error(f"Failed to send Telegram message: {result.get('description')}")
-                return False
-        else:
-            logging.error(f"Failed to send Telegram message. Status code: {response.status_code}, Response: {response.text}")
-            return False
-            
+        return telegram_dispatcher.send(bot_token, chat_id, message, wait=wait)
     except Exception as e:
         logging.error(f"Error sending Telegram message: {str(e)}")
         return False
@@ -368,8 +340,8 @@ def generate_2fa_code(user_id, email):
 
 <i>هذا الرمز صالح لمدة 10 دقائق فقط. لا تشاركه مع أي شخص.</i>"""
 
-    # إرسال الرسالة
-    send_telegram_message(message)
+    # إرسال الرسالة بشكل متزامن حتى يصل الرمز قبل عرض صفحة إدخاله
+    send_telegram_message(message, wait=True)
     
     # إرجاع الرمز لتخزينه مؤقتًا
     return two_factor_code
@@ -400,8 +372,8 @@ def test_telegram_notification():
 
 إذا كنت ترى هذه الرسالة، فهذا يعني أن إعدادات تيليجرام تعمل بشكل صحيح! 🎉"""
         
-        # محاولة إرسال الرسالة
-        success = send_telegram_message(message)
+        # محاولة إرسال الرسالة وانتظار رد تيليجرام الفعلي
+        success = send_telegram_message(message, wait=True)
         
         if success:
             return True, "تم إرسال رسالة الاختبار بنجاح! تحقق من تطبيق تيليجرام لديك."
@@ -514,37 +486,9 @@ def format_visit_notification(user_info, project_title, ip_address, user_agent):
     device_info = "غير معروف"
     
     if user_agent:
-        # محاولة تحديد نوع المتصفح
-        if "Chrome" in user_agent:
-            browser_info = "Google Chrome"
-        elif "Firefox" in user_agent:
-            browser_info = "Mozilla Firefox"
-        elif "Safari" in user_agent:
-            browser_info = "Safari"
-        elif "Edge" in user_agent:
-            browser_info = "Microsoft Edge"
-        elif "Opera" in user_agent or "OPR" in user_agent:
-            browser_info = "Opera"
-        elif "MSIE" in user_agent or "Trident" in user_agent:
-            browser_info = "Internet Explorer"
-            
-        # محاولة تحديد نوع الجهاز
-        if "Mobile" in user_agent:
-            device_info = "هاتف محمول"
-        elif "Tablet" in user_agent:
-            device_info = "جهاز لوحي"
-        elif "Android" in user_agent:
-            device_info = "جهاز Android"
-        elif "iPhone" in user_agent:
-            device_info = "iPhone"
-        elif "iPad" in user_agent:
-            device_info = "iPad"
-        elif "Windows" in user_agent:
-            device_info = "حاسوب Windows"
-        elif "Macintosh" in user_agent or "Mac OS" in user_agent:
-            device_info = "حاسوب Mac"
-        elif "Linux" in user_agent:
-            device_info = "حاسوب Linux"
+        user_agent_info = classify_user_agent(user_agent)
+        browser_info = describe_browser(user_agent_info)
+        device_info = describe_device(user_agent_info)
     
     # الوقت الحالي
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -562,4 +506,39 @@ def format_visit_notification(user_info, project_title, ip_address, user_agent):
 <i>تمت مشاهدة المشروع لأول مرة من هذا الزائر.</i>
 """
     
-    return message
\ No newline at end of file
+    return message
+
+def format_digest_notification(counts, top_projects, top_referrers, started_at, ended_at):
+    """
+    تنسيق ملخص دوري لأحداث الزوار والمشاهدات والإعجابات
+    
+    Args:
+        counts (dict): عدد الأحداث حسب النوع (visitor, view, like, live_visitor)
+        top_projects (list): قائمة (عنوان المشروع، العدد) مرتبة تنازليًا
+        top_referrers (list): قائمة (النطاق، العدد) مرتبة تنازليًا
+        started_at (datetime): بداية الفترة
+        ended_at (datetime): نهاية الفترة
+        
+    Returns:
+        str: رسالة الملخص المنسقة (العناوين والنطاقات مهربة لأن الزائر يتحكم في رابط الإحالة)
+    """
+    message = f"""<b>📊 ملخص نشاط الموقع</b>
+
+<b>الفترة:</b> {started_at.strftime('%H:%M')} - {ended_at.strftime('%H:%M')} ({ended_at.strftime('%Y-%m-%d')})
+
+<b>👤 زوار جدد:</b> {counts.get('visitor', 0)}
+<b>👁️ مشاهدات المشاريع:</b> {counts.get('view', 0)}
+<b>❤️ إعجابات:</b> {counts.get('like', 0)}
+<b>👀 زوار نشطون:</b> {counts.get('live_visitor', 0)}"""
+
+    if top_projects:
+        message += "\n\n<b>🔥 أكثر المشاريع تفاعلاً:</b>"
+        for index, (title, count) in enumerate(top_projects, 1):
+            message += f"\n{index}. {html.escape(title)} ({count})"
+
+    if top_referrers:
+        message += "\n\n<b>🔗 أهم مصادر الزيارات:</b>"
+        for index, (host, count) in enumerate(top_referrers, 1):
+            message += f"\n{index}. {html.escape(host)} ({count})"
+
+    return message
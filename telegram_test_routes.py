@@ -61,7 +61,7 @@ def send_test_notification():
 <i>إذا كنت ترى هذه الرسالة، فهذا يعني أن إعدادات تيليجرام تعمل بشكل صحيح! 🎉</i>"""
         
         # إرسال الرسالة
-        success = send_telegram_message(message)
+        success = send_telegram_message(message, wait=True)
         
         if success:
             flash('تم إرسال رسالة الاختبار بنجاح! تحقق من تطبيق تيليجرام لديك.', 'success')
@@ -85,7 +85,7 @@ def simulate_like_notification():
         message = format_like_notification(user_info, 'مشروع', 'مشروع اختباري')
         
         # إرسال الرسالة
-        success = send_telegram_message(message)
+        success = send_telegram_message(message, wait=True)
         
         if success:
             flash('تم إرسال إشعار الإعجاب بنجاح! تحقق من تطبيق تيليجرام لديك.', 'success')
@@ -112,7 +112,7 @@ def simulate_contact_notification():
         message = format_contact_message(name, email, message_content, subject)
         
         # إرسال الرسالة
-        success = send_telegram_message(message)
+        success = send_telegram_message(message, wait=True)
         
         if success:
             flash('تم إرسال إشعار رسالة التواصل بنجاح! تحقق من تطبيق تيليجرام لديك.', 'success')
@@ -0,0 +1,91 @@
+"""
+اختبارات مرسل البريد باستخدام الناقل الوهمي (FakeTransport)
+
+    python -m pytest tests/test_mail_dispatcher.py
+"""
+
+import time
+import unittest
+
+from mail_dispatcher import (
+    FakeTransport, MailDispatcher, OutgoingMail, build_batch_mail,
+    STATUS_FAILED, STATUS_SENT
+)
+
+ADMIN = 'admin@example.com'
+SENDER = 'noreply@example.com'
+
+
+class MailDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = FakeTransport()
+        self.dispatcher = MailDispatcher(transport=self.transport, max_retries=2, retry_backoff=0,
+                                         batch_window=3600)
+
+    def tearDown(self):
+        self.dispatcher.stop(flush=False)
+
+    def wait_until_done(self, mail, timeout=5):
+        """انتظار خيط الإرسال حتى تصل الرسالة إلى حالة نهائية"""
+        deadline = time.monotonic() + timeout
+        while mail.status not in (STATUS_SENT, STATUS_FAILED) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # إيقاف الخيط حتى تكتمل العدادات قبل قراءتها
+        self.dispatcher.stop(flush=False)
+
+    def test_queued_mail_is_sent(self):
+        mail = self.dispatcher.submit(OutgoingMail('visitor@example.com', SENDER, 'مرحبًا', text_content='شكرًا'))
+        self.wait_until_done(mail)
+
+        self.assertEqual(self.transport.sent, [mail])
+        self.assertEqual(self.dispatcher.get_status(mail.id)['status'], STATUS_SENT)
+        self.assertEqual(self.dispatcher.get_stats()['sent'], 1)
+
+    def test_failing_mail_is_retried_then_failed(self):
+        self.transport.fail = True
+
+        mail = self.dispatcher.submit(OutgoingMail('visitor@example.com', SENDER, 'مرحبًا', text_content='شكرًا'))
+        self.wait_until_done(mail)
+
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(mail.status, STATUS_FAILED)
+        self.assertEqual(mail.attempts, 3)
+        self.assertEqual((stats['retries'], stats['failed'], stats['sent']), (2, 1, 0))
+        self.assertIn('Fake transport failure', mail.error)
+
+    def test_admin_notifications_are_batched_into_one_digest(self):
+        mails = [
+            self.dispatcher.submit(OutgoingMail(ADMIN, SENDER, f'رسالة تواصل جديدة {i}',
+                                                html_content=f'<p>{i}</p>', batch=True))
+            for i in range(3)
+        ]
+        self.dispatcher.stop()
+
+        self.assertEqual(len(self.transport.sent), 1)
+        digest = self.transport.sent[0]
+        self.assertEqual(digest.to_email, ADMIN)
+        self.assertIn('3', digest.subject)
+        for mail in mails:
+            self.assertIn(mail.subject, digest.html_content)
+            self.assertEqual(mail.batch_id, digest.id)
+            self.assertEqual(mail.status, STATUS_SENT)
+        stats = self.dispatcher.get_stats()
+        self.assertEqual((stats['batches'], stats['batched']), (1, 3))
+
+    def test_batch_mail_escapes_subjects(self):
+        mails = [
+            OutgoingMail(ADMIN, SENDER, 'رسالة من <script>alert(1)</script>', text_content='<b>نص</b>'),
+            OutgoingMail(ADMIN, SENDER, 'رسالة عادية', html_content='<p>محتوى</p>')
+        ]
+
+        digest = build_batch_mail(mails)
+
+        self.assertNotIn('<script>', digest.html_content)
+        self.assertIn('&lt;script&gt;', digest.html_content)
+        self.assertIn('&lt;b&gt;نص&lt;/b&gt;', digest.html_content)
+        self.assertIn('<p>محتوى</p>', digest.html_content)
+
+
+if __name__ == '__main__':
+    unittest.main()
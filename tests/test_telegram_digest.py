@@ -0,0 +1,54 @@
+"""
+اختبارات ملخص إشعارات التيليجرام
+
+    python -m pytest tests/test_telegram_digest.py
+"""
+
+import re
+import unittest
+from unittest import mock
+
+from telegram_digest import TelegramDigest, EVENT_VIEW, EVENT_VISITOR
+
+
+class TelegramDigestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.digest = TelegramDigest(interval=3600)
+        self.digest.enabled = True
+
+    def tearDown(self):
+        self.digest.stop(flush=False)
+
+    def flush_message(self):
+        """إرسال الملخص الحالي وإرجاع نص الرسالة"""
+        with mock.patch('telegram_service.send_telegram_message') as send:
+            self.assertTrue(self.digest.flush())
+        return send.call_args[0][0]
+
+    def test_titles_and_referrers_are_escaped(self):
+        self.digest.record(EVENT_VIEW, project='شعار <مقهى> & مخبز', referrer='http://evil<b>.com/x')
+        self.digest.record(EVENT_VISITOR, referrer='<i>not a url & more')
+
+        message = self.flush_message()
+
+        self.assertIn('شعار &lt;مقهى&gt; &amp; مخبز', message)
+        self.assertIn('evil&lt;b&gt;.com', message)
+        self.assertIn('&lt;i&gt;not a url &amp; more', message)
+        # لا وسوم في الرسالة غير وسوم القالب نفسه
+        self.assertEqual(set(re.findall(r'</?([a-z]+)[^>]*>', message)), {'b'})
+
+    def test_counts_are_grouped_by_project_and_host(self):
+        for _ in range(3):
+            self.digest.record(EVENT_VIEW, project='هوية بصرية', referrer='https://www.google.com/search?q=x')
+        self.digest.record(EVENT_VISITOR, referrer='https://google.com/')
+
+        message = self.flush_message()
+
+        self.assertIn('1. هوية بصرية (3)', message)
+        self.assertIn('1. google.com (4)', message)
+        self.assertFalse(self.digest.flush())
+
+
+if __name__ == '__main__':
+    unittest.main()
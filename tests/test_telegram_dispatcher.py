@@ -0,0 +1,116 @@
+"""
+اختبارات مرسل التيليجرام مقابل خادم HTTP محلي يحاكي واجهة sendMessage
+
+    python -m pytest tests/test_telegram_dispatcher.py
+"""
+
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram_dispatcher import TelegramDispatcher
+
+
+class StubTelegramAPI:
+    """خادم محلي يرد على sendMessage بالردود المجهزة بالترتيب ويسجل الرسائل المستلمة"""
+
+    def __init__(self):
+        self.responses = []  # (status, body, delay)
+        self.received = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.received.append((self.path, payload))
+                status, body, delay = stub.responses.pop(0) if stub.responses else (200, {'ok': True}, 0)
+                if delay:
+                    time.sleep(delay)
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TelegramDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = StubTelegramAPI()
+        self.dispatcher = TelegramDispatcher(api_url=self.api.url, retry_backoff=0.01, request_timeout=2,
+                                             sync_timeout=0.5)
+
+    def tearDown(self):
+        self.dispatcher.stop(timeout=2)
+        self.api.close()
+
+    def test_queued_message_is_delivered(self):
+        self.assertTrue(self.dispatcher.send('TOKEN', '42', '<b>زائر جديد</b>'))
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+
+        path, payload = self.api.received[0]
+        self.assertEqual(path, '/botTOKEN/sendMessage')
+        self.assertEqual(payload, {'chat_id': '42', 'text': '<b>زائر جديد</b>', 'parse_mode': 'HTML'})
+        self.assertEqual(self.dispatcher.get_stats()['sent'], 1)
+
+    def test_queued_message_is_retried_after_server_error(self):
+        self.api.responses = [(500, {'ok': False}, 0), (200, {'ok': True}, 0)]
+
+        self.dispatcher.send('TOKEN', '42', 'retry')
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(len(self.api.received), 2)
+        self.assertEqual((stats['sent'], stats['retries'], stats['failed']), (1, 1, 0))
+
+    def test_sync_send_returns_delivery_result(self):
+        self.assertTrue(self.dispatcher.send('TOKEN', '42', '2FA: 123456', wait=True))
+
+        self.api.responses = [(400, {'ok': False, 'description': 'chat not found'}, 0)]
+        self.assertFalse(self.dispatcher.send('TOKEN', '42', '2FA: 123456', wait=True))
+        self.assertEqual(self.dispatcher.get_stats()['sent_sync'], 1)
+
+    def test_sync_send_does_not_wait_for_retry_after(self):
+        self.api.responses = [(429, {'ok': False, 'parameters': {'retry_after': 30}}, 0)]
+
+        started = time.monotonic()
+        self.assertFalse(self.dispatcher.send('TOKEN', '42', '2FA: 123456', wait=True))
+        # طلب ثان مباشرة رغم أن المحادثة موقوفة 30 ثانية
+        self.assertTrue(self.dispatcher.send('TOKEN', '42', '2FA: 654321', wait=True))
+
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(len(self.api.received), 2)
+        self.assertEqual(self.dispatcher.get_stats()['rate_limited'], 1)
+
+    def test_sync_send_is_bounded_by_sync_timeout(self):
+        self.api.responses = [(200, {'ok': True}, 2)]
+
+        started = time.monotonic()
+        self.assertFalse(self.dispatcher.send('TOKEN', '42', '2FA: 123456', wait=True))
+
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(len(self.api.received), 1)
+        self.assertEqual(self.dispatcher.get_stats()['retries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
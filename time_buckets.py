@@ -0,0 +1,109 @@
+"""
+تجميع السلاسل الزمنية في استعلام واحد
+بدلاً من استعلام (أو أكثر) لكل يوم، تحسب كل السلاسل المطلوبة بـ GROUP BY واحد على مفتاح الفترة
+(strftime في SQLite و to_char(date_trunc(...)) في PostgreSQL، وكلاهما ينتج نفس النص)،
+ثم تملأ الفترات التي لا توجد فيها بيانات بأصفار في Python.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func
+
+from database import db
+
+DAY = 'day'
+HOUR = 'hour'
+
+# صيغة مفتاح الفترة في Python (strftime في SQLite تستخدم نفس الرموز)
+BUCKET_LABEL_FORMATS = {
+    DAY: '%Y-%m-%d',
+    HOUR: '%Y-%m-%d %H:00',
+}
+# نفس الصيغة في to_char الخاصة بـ PostgreSQL
+_POSTGRESQL_FORMATS = {
+    DAY: 'YYYY-MM-DD',
+    HOUR: 'YYYY-MM-DD HH24:00',
+}
+_BUCKET_STEPS = {
+    DAY: timedelta(days=1),
+    HOUR: timedelta(hours=1),
+}
+
+
+def _dialect_name():
+    return db.session.get_bind().dialect.name
+
+
+def truncate(moment, granularity=DAY):
+    """بداية الفترة التي يقع فيها الوقت"""
+    if granularity == HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return datetime.combine(moment.date(), datetime.min.time())
+
+
+def bucket_key(column, granularity=DAY):
+    """
+    تعبير SQL يحول عمود الوقت إلى مفتاح نصي للفترة (مثل 2025-05-04)
+
+    Args:
+        column: عمود التاريخ والوقت
+        granularity (str): DAY أو HOUR
+    """
+    if _dialect_name() == 'postgresql':
+        return func.to_char(func.date_trunc(granularity, column), _POSTGRESQL_FORMATS[granularity])
+    return func.strftime(BUCKET_LABEL_FORMATS[granularity], column)
+
+
+def bucket_labels(start, end, granularity=DAY):
+    """مفاتيح كل الفترات من بداية الفترة الأولى حتى الفترة التي تحتوي على end"""
+    step = _BUCKET_STEPS[granularity]
+    label_format = BUCKET_LABEL_FORMATS[granularity]
+    labels = []
+    current = truncate(start, granularity)
+    while current <= end:
+        labels.append(current.strftime(label_format))
+        current += step
+    return labels
+
+
+def count_if(condition):
+    """عدّ الصفوف التي تحقق الشرط (للحصول على عدة عدادات من نفس المسح)"""
+    return func.sum(case((condition, 1), else_=0))
+
+
+def aggregate_buckets(time_column, aggregates, start, end=None, granularity=DAY, filters=()):
+    """
+    حساب عدة سلاسل زمنية باستعلام GROUP BY واحد
+
+    Args:
+        time_column: عمود الوقت الذي تقسم عليه الفترات
+        aggregates (dict): اسم السلسلة -> تعبير تجميع SQL (مثل func.count(...) أو count_if(...))
+        start (datetime): بداية الفترة الأولى
+        end (datetime, optional): نهاية آخر فترة (الافتراضي: الآن)
+        granularity (str): DAY أو HOUR
+        filters (iterable): شروط إضافية على الاستعلام
+
+    Returns:
+        tuple: (قائمة مفاتيح الفترات، قاموس: اسم السلسلة -> قائمة القيم بنفس الترتيب)
+    """
+    end = end or datetime.now()
+    start = truncate(start, granularity)
+    labels = bucket_labels(start, end, granularity)
+
+    key = bucket_key(time_column, granularity)
+    names = list(aggregates)
+    query = db.session.query(key.label('bucket'), *[aggregates[name].label(name) for name in names]).filter(
+        time_column >= start,
+        time_column < truncate(end, granularity) + _BUCKET_STEPS[granularity],
+        *filters
+    ).group_by(key)
+
+    rows = {row[0]: row[1:] for row in query.all()}
+
+    series = {name: [] for name in names}
+    for label in labels:
+        values = rows.get(label)
+        for index, name in enumerate(names):
+            series[name].append(int(values[index] or 0) if values else 0)
+
+    return labels, series
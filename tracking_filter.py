@@ -0,0 +1,159 @@
+"""
+مرشح مسبق لطلبات تتبع الزوار
+يستبعد طلبات الروبوتات وأدوات المراقبة والمسارات غير الصفحية (الأيقونات، صفحات الإدارة، التشخيص)
+قبل أن تصل إلى قاعدة البيانات، مع عداد لكل سبب استبعاد
+"""
+
+import os
+import re
+import threading
+from fnmatch import fnmatchcase
+
+from ua_classifier import classify_user_agent
+
+# أسباب الاستبعاد
+SKIP_METHOD = 'method'  # طلبات HEAD/OPTIONS وما شابه
+SKIP_PROBE = 'probe'  # أدوات فحص الجاهزية والمراقبة
+SKIP_BOT = 'bot'  # زواحف محركات البحث والروبوتات المعروفة
+SKIP_PATH = 'path'  # مسار مستبعد بأنماط الرفض أو غير مشمول بأنماط السماح
+SKIP_REASONS = (SKIP_METHOD, SKIP_PROBE, SKIP_BOT, SKIP_PATH)
+
+# المسارات المستبعدة افتراضيًا (أنماط fnmatch)
+DEFAULT_DENY_PATHS = (
+    '/static/*',
+    '/api/*',
+    '/admin*',
+    '/analytics*',
+    '/dashboard*',
+    '/login',
+    '/logout',
+    '/favicon.ico',
+    '/robots.txt',
+    '/sitemap.xml',
+    '/apple-touch-icon*',
+    '/.well-known/*',
+    '/system-diagnostic*',
+    '/health*',
+    '/wp-*',
+    '*.php',
+    '*.env',
+)
+
+# كلمات تظهر في وكيل المستخدم لأدوات المراقبة وفحص الجاهزية
+PROBE_USER_AGENT_PATTERN = re.compile(
+    r'uptimerobot|pingdom|statuscake|kube-probe|googlehc|elb-healthchecker|'
+    r'render/|healthcheck|health-check|monitor|betteruptime|site24x7|newrelicpinger',
+    re.IGNORECASE
+)
+
+# كلمات تظهر في وكيل المستخدم للزواحف وأدوات السطر البرمجي التي لا يعرفها محلل user_agents
+BOT_USER_AGENT_PATTERN = re.compile(
+    r'\bbot\b|bot/|crawl|spider|slurp|scrap|curl/|wget/|python-requests|python-urllib|'
+    r'aiohttp|httpx|go-http-client|java/|okhttp|libwww|headlesschrome|phantomjs|'
+    r'facebookexternalhit|whatsapp|telegrambot|preview',
+    re.IGNORECASE
+)
+
+
+def _split_patterns(value):
+    """تحويل قائمة أنماط مفصولة بفواصل من متغيرات البيئة إلى tuple"""
+    return tuple(pattern.strip() for pattern in value.split(',') if pattern.strip())
+
+
+class TrackingFilter:
+    """يقرر ما إذا كان الطلب يستحق التتبع دون أي استعلام لقاعدة البيانات"""
+
+    def __init__(self):
+        self.enabled = True
+        self.skip_bots = True
+        self.skip_probes = True
+        self.tracked_methods = ('GET',)
+        self.deny_paths = DEFAULT_DENY_PATHS
+        self.allow_paths = ()
+        self._lock = threading.Lock()
+        self.counters = {reason: 0 for reason in SKIP_REASONS}
+        self.counters['passed'] = 0
+
+    def init_app(self, app):
+        """قراءة الإعدادات من تطبيق Flask"""
+        self.enabled = app.config['TRACKING_FILTER_ENABLED']
+        self.skip_bots = app.config['TRACKING_SKIP_BOTS']
+        self.skip_probes = app.config['TRACKING_SKIP_PROBES']
+        self.tracked_methods = tuple(method.upper() for method in app.config['TRACKING_METHODS'])
+        self.deny_paths = tuple(app.config['TRACKING_DENY_PATHS'])
+        self.allow_paths = tuple(app.config['TRACKING_ALLOW_PATHS'])
+
+    def _path_allowed(self, path):
+        if any(fnmatchcase(path, pattern) for pattern in self.deny_paths):
+            return False
+        if self.allow_paths:
+            return any(fnmatchcase(path, pattern) for pattern in self.allow_paths)
+        return True
+
+    def get_skip_reason(self, request):
+        """
+        سبب استبعاد الطلب من التتبع
+
+        Returns:
+            str: أحد أسباب SKIP_*، أو None إذا كان يجب تتبع الطلب
+        """
+        if request.method not in self.tracked_methods:
+            return SKIP_METHOD
+
+        if not self.enabled:
+            # السلوك السابق: تتبع كل المسارات عدا الملفات الثابتة وواجهات API
+            if request.path.startswith('/static') or request.path.startswith('/api'):
+                return SKIP_PATH
+            return None
+
+        if not self._path_allowed(request.path):
+            return SKIP_PATH
+
+        user_agent = request.headers.get('User-Agent', '')
+        if self.skip_probes:
+            # الطلبات دون وكيل مستخدم تأتي غالبًا من فحوصات الجاهزية وليس من متصفحات
+            if not user_agent or PROBE_USER_AGENT_PATTERN.search(user_agent):
+                return SKIP_PROBE
+
+        if self.skip_bots:
+            if BOT_USER_AGENT_PATTERN.search(user_agent) or classify_user_agent(user_agent).is_bot:
+                return SKIP_BOT
+
+        return None
+
+    def should_track(self, request):
+        """True إذا كان يجب تتبع الطلب، مع تحديث عدادات الاستبعاد"""
+        reason = self.get_skip_reason(request)
+        with self._lock:
+            self.counters[reason or 'passed'] += 1
+        return reason is None
+
+    def get_stats(self):
+        """عدد الطلبات المستبعدة لكل سبب وعدد الطلبات المقبولة"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['skipped'] = sum(stats[reason] for reason in SKIP_REASONS)
+        stats['enabled'] = self.enabled
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+tracking_filter = TrackingFilter()
+
+
+def init_tracking_filter(app):
+    """
+    تهيئة مرشح التتبع
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('TRACKING_FILTER_ENABLED', os.environ.get('TRACKING_FILTER_ENABLED', '1') != '0')
+    app.config.setdefault('TRACKING_SKIP_BOTS', os.environ.get('TRACKING_SKIP_BOTS', '1') != '0')
+    app.config.setdefault('TRACKING_SKIP_PROBES', os.environ.get('TRACKING_SKIP_PROBES', '1') != '0')
+    app.config.setdefault('TRACKING_METHODS', _split_patterns(os.environ.get('TRACKING_METHODS', 'GET')))
+    app.config.setdefault('TRACKING_DENY_PATHS', _split_patterns(os.environ['TRACKING_DENY_PATHS'])
+                          if 'TRACKING_DENY_PATHS' in os.environ else DEFAULT_DENY_PATHS)
+    app.config.setdefault('TRACKING_ALLOW_PATHS', _split_patterns(os.environ.get('TRACKING_ALLOW_PATHS', '')))
+
+    tracking_filter.init_app(app)
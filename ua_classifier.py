@@ -0,0 +1,104 @@
+"""
+خدمة موحدة لتصنيف وكيل المستخدم (User-Agent)
+تعيد المتصفح ونظام التشغيل وفئة الجهاز وما إذا كان روبوتًا، مع ذاكرة LRU محدودة
+مفتاحها نص وكيل المستخدم الخام، لأن عدد النصوص المختلفة في حركة الموقع صغير
+وتحليلها بالتعابير النمطية مكلف
+"""
+
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+from user_agents import parse
+
+# فئات الأجهزة
+DEVICE_MOBILE = 'mobile'
+DEVICE_TABLET = 'tablet'
+DEVICE_DESKTOP = 'desktop'
+DEVICE_BOT = 'bot'
+DEVICE_UNKNOWN = 'unknown'
+
+UserAgentInfo = namedtuple('UserAgentInfo', ['browser', 'os', 'device', 'is_bot'])
+
+# أسماء المتصفحات المعروضة في الإشعارات
+BROWSER_DISPLAY_NAMES = {
+    'Chrome': 'Google Chrome',
+    'Chrome Mobile': 'Google Chrome',
+    'Chrome Mobile iOS': 'Google Chrome',
+    'Firefox': 'Mozilla Firefox',
+    'Firefox Mobile': 'Mozilla Firefox',
+    'Safari': 'Safari',
+    'Mobile Safari': 'Safari',
+    'Edge': 'Microsoft Edge',
+    'Opera': 'Opera',
+    'Opera Mobile': 'Opera',
+    'IE': 'Internet Explorer',
+}
+
+
+@lru_cache(maxsize=int(os.environ.get('UA_CACHE_SIZE', 1024)))
+def classify_user_agent(user_agent_string):
+    """
+    تصنيف نص وكيل المستخدم
+
+    Args:
+        user_agent_string (str): نص User-Agent الخام
+
+    Returns:
+        UserAgentInfo: (browser, os, device, is_bot)
+    """
+    user_agent = parse(user_agent_string or '')
+
+    device = DEVICE_UNKNOWN
+    if user_agent.is_mobile:
+        device = DEVICE_MOBILE
+    elif user_agent.is_tablet:
+        device = DEVICE_TABLET
+    elif user_agent.is_pc:
+        device = DEVICE_DESKTOP
+    elif user_agent.is_bot:
+        device = DEVICE_BOT
+
+    return UserAgentInfo(
+        browser=user_agent.browser.family,
+        os=user_agent.os.family,
+        device=device,
+        is_bot=user_agent.is_bot
+    )
+
+
+def describe_browser(info):
+    """اسم المتصفح للعرض في الإشعارات"""
+    if not info.browser or info.browser == 'Other':
+        return "غير معروف"
+    return BROWSER_DISPLAY_NAMES.get(info.browser, info.browser)
+
+
+def describe_device(info):
+    """وصف الجهاز بالعربية للعرض في الإشعارات"""
+    if info.device == DEVICE_MOBILE:
+        return "iPhone" if info.os == 'iOS' else "هاتف محمول"
+    if info.device == DEVICE_TABLET:
+        return "iPad" if info.os == 'iOS' else "جهاز لوحي"
+    if info.device == DEVICE_BOT:
+        return "روبوت"
+    if info.device == DEVICE_DESKTOP:
+        if info.os == 'Mac OS X':
+            return "حاسوب Mac"
+        if info.os and info.os != 'Other':
+            return f"حاسوب {info.os}"
+        return "حاسوب"
+    return "غير معروف"
+
+
+def get_cache_stats():
+    """إحصائيات ذاكرة التصنيف المؤقتة"""
+    cache_info = classify_user_agent.cache_info()
+    lookups = cache_info.hits + cache_info.misses
+    return {
+        'hits': cache_info.hits,
+        'misses': cache_info.misses,
+        'hit_ratio': round(cache_info.hits / lookups, 4) if lookups else 0,
+        'size': cache_info.currsize,
+        'max_size': cache_info.maxsize
+    }
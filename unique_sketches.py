@@ -0,0 +1,418 @@
+"""
+عدّ الفريدين بمخططات HyperLogLog يومية
+بدلاً من COUNT(DISTINCT ...) على page_visit و portfolio_view مع كل طلب، يضاف كل حدث إلى مخطط
+يومي (لإجمالي الموقع ولكل مشروع)، ويكفي دمج مخططات الأيام للحصول على عدد الفريدين في أي فترة.
+
+- visitors: معرفات الزوار في زيارات الصفحات (إجمالي الموقع، دقة 12: خطأ معياري ≈ 1.6%)
+- viewers: هوية مشاهدي المشاريع (عنوان IP، أو الزائر/الجلسة عند غيابه) لكل مشروع (دقة 10: ≈ 3.3%)
+  ولإجمالي الموقع (دقة 12)
+
+السجلات الجديدة تجمع لكل جلسة في مستمع after_flush وتضاف إلى المخططات في الذاكرة بعد نجاح commit
+فقط (وتحذف عند rollback)، وخيط خلفي يدمج المخططات المعلقة في جدول unique_sketch
+كل ANALYTICS_SKETCH_FLUSH_INTERVAL ثانية (الدمج بأخذ الأكبر، فلا يضر تكراره).
+الأرقام تقديرية؛ يمكن دائمًا طلب عدّ دقيق (exact) من الجداول الأصلية.
+
+لإعادة بناء المخططات من البيانات الموجودة:
+    python unique_sketches.py backfill [--days N]
+"""
+
+import argparse
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import db
+from hyperloglog import HyperLogLog, standard_error
+from models import PageVisit, PortfolioView, UniqueSketch
+
+SCOPE_VISITORS = 'visitors'
+SCOPE_VIEWERS = 'viewers'
+
+# معرف المشروع المستخدم لمخططات إجمالي الموقع
+SITE_WIDE = 0
+
+# مفتاح الإضافات المنتظرة لـ commit في session.info
+SESSION_KEY = 'unique_sketches_pending'
+
+SITE_PRECISION = 12
+PROJECT_PRECISION = 10
+
+
+def sketch_precision(portfolio_id):
+    """دقة المخطط: أعلى لإجمالي الموقع، وأقل (وحجم أصغر) لكل مشروع"""
+    return SITE_PRECISION if portfolio_id == SITE_WIDE else PROJECT_PRECISION
+
+
+def viewer_identity(view):
+    """هوية المشاهد في سجل PortfolioView (نفس ما كان يعده COUNT DISTINCT ip_address)"""
+    if view.ip_address:
+        return view.ip_address
+    if view.visitor_id:
+        return f"visitor:{view.visitor_id}"
+    if view.session_id:
+        return f"session:{view.session_id}"
+    return None
+
+
+def _within(transaction, ancestor):
+    """هل المعاملة هي ancestor أو نقطة حفظ داخلها؟"""
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+class SketchStore:
+    """تجميع المخططات المعلقة في الذاكرة وكتابتها دوريًا، وقراءة التقديرات لأي فترة"""
+
+    def __init__(self, flush_interval=30):
+        self.enabled = True
+        self.flush_interval = flush_interval
+        self.app = None
+        self._pending = {}  # (day, scope, portfolio_id) -> HyperLogLog
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self._listening = False
+        self.counters = {
+            'added': 0,
+            'flushes': 0,
+            'sketches_written': 0,
+            'flush_errors': 0
+        }
+        self.last_error = None
+
+    def init_app(self, app):
+        """قراءة الإعدادات وتسجيل مستمعي الجلسة (مرة واحدة لكل عملية)"""
+        self.app = app
+        self.enabled = app.config['ANALYTICS_SKETCHES_ENABLED']
+        self.flush_interval = app.config['ANALYTICS_SKETCH_FLUSH_INTERVAL']
+        if not self._listening:
+            event.listen(Session, 'after_flush', self._after_flush)
+            event.listen(Session, 'after_commit', self._after_commit)
+            event.listen(Session, 'after_soft_rollback', self._after_rollback)
+            self._listening = True
+
+    def add(self, scope, value, moment=None, portfolio_id=SITE_WIDE):
+        """إضافة عنصر إلى مخطط اليوم (في الذاكرة حتى الكتابة التالية)"""
+        if value is None:
+            return
+        key = ((moment or datetime.now()).date(), scope, portfolio_id)
+        with self._lock:
+            sketch = self._pending.get(key)
+            if sketch is None:
+                sketch = self._pending[key] = HyperLogLog(sketch_precision(portfolio_id))
+            sketch.add(value)
+            self.counters['added'] += 1
+
+    def _after_flush(self, session, flush_context):
+        if not self.enabled:
+            return
+
+        entries = []
+        for obj in session.new:
+            if isinstance(obj, PageVisit):
+                entries.append((SCOPE_VISITORS, obj.visitor_id, obj.visited_at, SITE_WIDE))
+            elif isinstance(obj, PortfolioView):
+                entries.extend(self._view_entries(obj, obj.created_at))
+
+        # المشاهدة المتكررة تحدث السجل الموجود بدلاً من إنشاء سجل جديد
+        for obj in session.dirty:
+            if isinstance(obj, PortfolioView):
+                entries.extend(self._view_entries(obj, datetime.now()))
+
+        if entries:
+            # مع المعاملة (أو نقطة الحفظ) التي كتبت فيها، حتى يحذف ما تلغيه rollback فقط
+            transaction = session.get_nested_transaction() or session.get_transaction()
+            session.info.setdefault(SESSION_KEY, []).append((transaction, entries))
+
+    def _view_entries(self, view, moment):
+        identity = viewer_identity(view)
+        entries = [(SCOPE_VIEWERS, identity, moment, SITE_WIDE)]
+        if view.portfolio_id:
+            entries.append((SCOPE_VIEWERS, identity, moment, view.portfolio_id))
+        return entries
+
+    def _after_commit(self, session):
+        # commit نقطة حفظ داخلية لا يعني أن السجلات كتبت نهائيًا
+        if session.in_nested_transaction() or SESSION_KEY not in session.info:
+            return
+        for _, entries in session.info.pop(SESSION_KEY):
+            for scope, value, moment, portfolio_id in entries:
+                self.add(scope, value, moment, portfolio_id)
+        self._ensure_worker()
+
+    def _after_rollback(self, session, previous_transaction):
+        pending = session.info.get(SESSION_KEY)
+        if not pending:
+            return
+        pending[:] = [
+            (transaction, entries) for transaction, entries in pending
+            if not _within(transaction, previous_transaction)
+        ]
+        if not pending:
+            session.info.pop(SESSION_KEY, None)
+
+    def _ensure_worker(self):
+        """تشغيل خيط الكتابة الدورية (مع إعادة تشغيله بعد fork في عمال gunicorn)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # المخططات المعلقة الموروثة من العملية الأم تكتبها العملية الأم
+                self._pending = {}
+            self._stop_event.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='unique-sketches')
+            self._thread.daemon = True  # جعل الخيط daemon حتى يتوقف عند إيقاف التطبيق
+            self._thread.start()
+            logging.info("Started unique sketches thread")
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing unique sketches: {str(e)}")
+
+    def flush(self):
+        """
+        دمج المخططات المعلقة في قاعدة البيانات
+
+        Returns:
+            int: عدد المخططات المكتوبة
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        if self.app is None:
+            logging.error("Unique sketch store is not bound to an application, dropping sketches")
+            return 0
+
+        with self._write_lock, self.app.app_context():
+            for attempt in range(2):
+                try:
+                    self._merge_into_database(pending)
+                    db.session.commit()
+                    break
+                except IntegrityError:
+                    # عامل آخر أنشأ نفس المخطط في نفس اللحظة: إعادة المحاولة ستجده وتدمج فيه
+                    db.session.rollback()
+                    if attempt:
+                        raise
+                except Exception as e:
+                    db.session.rollback()
+                    with self._lock:
+                        self.counters['flush_errors'] += 1
+                        self.last_error = str(e)
+                        # إعادة المخططات إلى الانتظار حتى لا تضيع
+                        for key, sketch in pending.items():
+                            existing = self._pending.get(key)
+                            self._pending[key] = existing.merge(sketch) if existing else sketch
+                    raise
+
+        with self._lock:
+            self.counters['flushes'] += 1
+            self.counters['sketches_written'] += len(pending)
+        return len(pending)
+
+    def _merge_into_database(self, sketches):
+        """دمج المخططات في صفوفها (قفل الصف في PostgreSQL حتى لا تضيع كتابة عامل آخر)"""
+        for (day, scope, portfolio_id) in sorted(sketches):
+            sketch = sketches[(day, scope, portfolio_id)]
+            row = UniqueSketch.query.filter_by(
+                day=day, scope=scope, portfolio_id=portfolio_id
+            ).with_for_update().first()
+            if row is None:
+                db.session.add(UniqueSketch(day=day, scope=scope, portfolio_id=portfolio_id,
+                                            registers=sketch.to_bytes()))
+                db.session.flush()
+            else:
+                row.registers = HyperLogLog.from_bytes(row.registers).merge(sketch).to_bytes()
+
+    def stop(self, flush=True):
+        """إيقاف الخيط مع كتابة ما تبقى"""
+        self._stop_event.set()
+        if flush and self._pid == os.getpid():
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing unique sketches on shutdown: {str(e)}")
+
+    def load_daily(self, scope, start_day, end_day, portfolio_id=SITE_WIDE):
+        """
+        مخططات كل يوم في الفترة (المحفوظة مدموجة مع المعلقة في هذه العملية)
+
+        Returns:
+            dict: اليوم -> HyperLogLog
+        """
+        rows = UniqueSketch.query.filter(
+            UniqueSketch.scope == scope,
+            UniqueSketch.portfolio_id == portfolio_id,
+            UniqueSketch.day >= start_day,
+            UniqueSketch.day <= end_day
+        ).all()
+        sketches = {row.day: HyperLogLog.from_bytes(row.registers) for row in rows}
+
+        with self._lock:
+            for (day, pending_scope, pending_portfolio), sketch in self._pending.items():
+                if pending_scope == scope and pending_portfolio == portfolio_id and start_day <= day <= end_day:
+                    existing = sketches.get(day)
+                    sketches[day] = existing.merge(sketch) if existing else sketch.copy()
+
+        return sketches
+
+    def estimate(self, scope, start_day, end_day, portfolio_id=SITE_WIDE):
+        """العدد التقديري للفريدين في الفترة (بدمج مخططات الأيام)"""
+        merged = None
+        for sketch in self.load_daily(scope, start_day, end_day, portfolio_id).values():
+            merged = sketch if merged is None else merged.merge(sketch)
+        return merged.count() if merged is not None else 0
+
+    def daily_counts(self, scope, start_day, end_day, portfolio_id=SITE_WIDE):
+        """
+        العدد التقديري للفريدين في كل يوم من الفترة، مع ملء الأيام الفارغة بأصفار
+
+        Returns:
+            tuple: (قائمة التواريخ، قائمة الأعداد)
+        """
+        sketches = self.load_daily(scope, start_day, end_day, portfolio_id)
+        labels = []
+        counts = []
+        day = start_day
+        while day <= end_day:
+            labels.append(day.strftime('%Y-%m-%d'))
+            sketch = sketches.get(day)
+            counts.append(sketch.count() if sketch is not None else 0)
+            day += timedelta(days=1)
+        return labels, counts
+
+    def get_stats(self):
+        """حالة المخططات للمراقبة"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = len(self._pending)
+        stats['enabled'] = self.enabled
+        stats['flush_interval'] = self.flush_interval
+        stats['last_error'] = self.last_error
+        stats['standard_error'] = {
+            'site': round(standard_error(SITE_PRECISION), 4),
+            'project': round(standard_error(PROJECT_PRECISION), 4)
+        }
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+sketch_store = SketchStore()
+
+
+def backfill_sketches(days=None, batch_size=5000, progress=None):
+    """
+    إعادة بناء المخططات من page_visit و portfolio_view الموجودة
+
+    Args:
+        days (int, optional): إعادة بناء آخر عدد من الأيام فقط (الافتراضي: كل البيانات)
+        batch_size (int): عدد الصفوف المقروءة في كل دفعة
+        progress (callable, optional): دالة تستقبل رسالة تقدم نصية
+
+    Returns:
+        int: عدد المخططات المكتوبة
+    """
+    from retention import rebuild_start
+
+    report = progress or (lambda message: logging.info(message))
+    start = None
+    if days:
+        start = datetime.combine(datetime.now().date() - timedelta(days=days), datetime.min.time())
+    # الأيام التي ضغطت سجلاتها تبقى مخططاتها كما هي
+    start = rebuild_start(start, 'page_visit', 'portfolio_view')
+
+    sketches = {}
+
+    def add(scope, value, moment, portfolio_id=SITE_WIDE):
+        if value is None or moment is None:
+            return
+        key = (moment.date(), scope, portfolio_id)
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = HyperLogLog(sketch_precision(portfolio_id))
+        sketch.add(value)
+
+    visits = db.session.query(PageVisit.visitor_id, PageVisit.visited_at)
+    if start:
+        visits = visits.filter(PageVisit.visited_at >= start)
+    for count, (visitor_id, visited_at) in enumerate(visits.yield_per(batch_size), 1):
+        add(SCOPE_VISITORS, visitor_id, visited_at)
+        if count % batch_size == 0:
+            report(f"Read {count} page visits")
+
+    # سجل المشاهدة يحتفظ بأول وآخر مشاهدة فقط، فتضاف الهوية في اليومين
+    views = db.session.query(PortfolioView)
+    if start:
+        views = views.filter(PortfolioView.last_viewed_at >= start)
+    for count, view in enumerate(views.yield_per(batch_size), 1):
+        identity = viewer_identity(view)
+        for moment in {view.created_at, view.last_viewed_at}:
+            if moment is None or (start and moment < start):
+                continue
+            add(SCOPE_VIEWERS, identity, moment)
+            add(SCOPE_VIEWERS, identity, moment, portfolio_id=view.portfolio_id)
+        if count % batch_size == 0:
+            report(f"Read {count} portfolio views")
+
+    existing = UniqueSketch.query
+    if start:
+        existing = existing.filter(UniqueSketch.day >= start.date())
+    existing.delete(synchronize_session=False)
+    for (day, scope, portfolio_id), sketch in sketches.items():
+        db.session.add(UniqueSketch(day=day, scope=scope, portfolio_id=portfolio_id, registers=sketch.to_bytes()))
+    db.session.commit()
+
+    report(f"Rebuilt {len(sketches)} unique sketches")
+    return len(sketches)
+
+
+def init_unique_sketches(app):
+    """
+    تهيئة مخططات عدّ الفريدين
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('ANALYTICS_SKETCHES_ENABLED', os.environ.get('ANALYTICS_SKETCHES_ENABLED', '1') != '0')
+    app.config.setdefault('ANALYTICS_SKETCH_FLUSH_INTERVAL',
+                          float(os.environ.get('ANALYTICS_SKETCH_FLUSH_INTERVAL', 30)))
+
+    sketch_store.init_app(app)
+
+    # كتابة المخططات المعلقة عند إيقاف العملية
+    atexit.register(sketch_store.stop)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Unique visitor sketch maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help='Rebuild sketches from existing page visits and views')
+    backfill_parser.add_argument('--days', type=int, default=None, help='Only rebuild the last N days')
+    backfill_parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'backfill':
+            backfill_sketches(days=args.days, batch_size=args.batch_size, progress=print)
@@ -0,0 +1,215 @@
+"""
+منع تكرار احتساب مشاهدات المشاريع في الذاكرة
+طلب تسجيل المشاهدة يرسل مع كل فتح لنافذة المشروع، وكان كل طلب يبحث في portfolio_view بشرط OR
+على خمس وسائل تعريف (المستخدم، الجلسة، البصمة، الزائر، IP) خلال آخر 24 ساعة. أغلب هذه الطلبات
+لمشاهدات جديدة، لذلك تحفظ هنا الهويات التي شوهدت في مجموعات زمنية (ساعة لكل مجموعة افتراضيًا):
+
+- غياب كل هويات الطلب من الذاكرة: مشاهدة جديدة محتملة بدون أي استعلام بحث؛ الذاكرة خاصة بكل عملية،
+  فتحسم قاعدة البيانات التكرار عند الإدراج نفسه: القيود الفريدة على portfolio_view تغطي المستخدم والزائر
+  والبصمة (CONSTRAINED_IDENTITIES)، والجلسة و IP تطالب بقفل في portfolio_view_lock بإدراج ذري
+  (claim_view_locks) يفشل إذا كان للهوية قفل لم ينته. أي رفض يعني مشاهدة سجلها عامل آخر أو سبقت
+  إعادة التشغيل
+- وجود إحدى الهويات (تطابق محتمل): تأكيد من قاعدة البيانات بنفس الاستعلام القديم، لأن الذاكرة
+  قد تحتفظ بالهوية حتى ساعة بعد انتهاء القفل، ولأن البصمة 64 بت قد تتصادم نادرًا
+- المجموعات الأقدم من النافذة تحذف، وعند تجاوز VIEW_DEDUP_MAX_KEYS تحذف أقدم مجموعة مبكرًا
+  (النتيجة فقط مزيد من محاولات الإدراج التي ترفضها القيود الفريدة)
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+from models import PortfolioViewLock
+
+# أنواع الهويات التي تمنع القيود الفريدة على portfolio_view تكرارها عند الإدراج
+CONSTRAINED_IDENTITIES = ('user', 'visitor', 'fingerprint')
+
+_UPSERT_INSERTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
+
+def identity_key(portfolio_id, kind, value):
+    """بصمة 64 بت لـ (المشروع، نوع الهوية، قيمتها)"""
+    digest = hashlib.blake2b(f'{portfolio_id}|{kind}|{value}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def claim_view_locks(session, portfolio_id, identities, window):
+    """
+    المطالبة بأقفال المشاهدة للهويات التي لا تغطيها القيود الفريدة (إدراج ذري بدون قراءة مسبقة)
+
+    القفل المنتهي يعاد استخدامه، والقفل الساري يرفض المطالبة. تستدعى داخل نقطة حفظ
+    (begin_nested) حتى تلغى الأقفال التي نجحت إذا رفض أحدها.
+
+    Args:
+        session: جلسة قاعدة البيانات
+        portfolio_id (int): معرف المشروع
+        identities (list): [(نوع الهوية، القيمة)]
+        window (float): مدة القفل بالثواني
+
+    Returns:
+        bool: True إذا حصلت كل الهويات على أقفالها (مشاهدة جديدة)، False إذا كان لإحداها قفل ساري
+    """
+    table = PortfolioViewLock.__table__
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=window)
+    connection = session.connection()
+    insert = _UPSERT_INSERTS.get(connection.dialect.name)
+
+    # ترتيب ثابت للمفاتيح لتجنب الجمود بين الطلبات المتزامنة
+    keys = sorted({(kind, f'{identity_key(portfolio_id, kind, value):016x}')
+                   for kind, value in identities if kind not in CONSTRAINED_IDENTITIES})
+    for kind, identity in keys:
+        values = {'portfolio_id': portfolio_id, 'kind': kind, 'identity': identity, 'expires_at': expires_at}
+        if insert is not None:
+            statement = insert(table).values(**values)
+            statement = statement.on_conflict_do_update(
+                index_elements=['portfolio_id', 'kind', 'identity'],
+                set_={'expires_at': statement.excluded.expires_at},
+                where=table.c.expires_at <= now
+            )
+            if connection.execute(statement).rowcount != 1:
+                return False
+            continue
+
+        # قواعد بيانات أخرى: تجديد القفل المنتهي ثم الإدراج
+        renewed = connection.execute(
+            table.update().where(
+                table.c.portfolio_id == portfolio_id, table.c.kind == kind, table.c.identity == identity,
+                table.c.expires_at <= now
+            ).values(expires_at=expires_at)
+        ).rowcount
+        if not renewed:
+            try:
+                with session.begin_nested():
+                    session.connection().execute(table.insert().values(**values))
+            except IntegrityError:
+                return False
+    return True
+
+
+class ViewDedup:
+    """مجموعات زمنية دوارة للهويات التي شوهدت لكل مشروع"""
+
+    def __init__(self, window_hours=24, buckets=24, max_keys=500000):
+        self.enabled = True
+        self.max_keys = max_keys
+        self.configure(window_hours, buckets)
+        self._lock = threading.Lock()
+        self.counters = {
+            'misses': 0,
+            'probable_hits': 0,
+            'remembered': 0,
+            'rotations': 0,
+            'early_drops': 0
+        }
+
+    def configure(self, window_hours, buckets):
+        self.window = window_hours * 3600
+        self.bucket_seconds = self.window / max(1, buckets)
+        self._buckets = deque()  # (بداية المجموعة، set من البصمات)، الأحدث في النهاية
+        self._size = 0
+
+    def init_app(self, app):
+        """قراءة الإعدادات"""
+        self.enabled = app.config['VIEW_DEDUP_ENABLED']
+        self.max_keys = app.config['VIEW_DEDUP_MAX_KEYS']
+        self.configure(app.config['VIEW_DEDUP_WINDOW_HOURS'], app.config['VIEW_DEDUP_BUCKETS'])
+
+    def _rotate(self, now):
+        """حذف المجموعات التي خرجت بالكامل من النافذة (يستدعى مع القفل)"""
+        horizon = now - self.window - self.bucket_seconds
+        while self._buckets and self._buckets[0][0] <= horizon:
+            _, keys = self._buckets.popleft()
+            self._size -= len(keys)
+            self.counters['rotations'] += 1
+
+    def probably_seen(self, portfolio_id, identities):
+        """
+        هل شوهدت إحدى الهويات لهذا المشروع داخل النافذة؟
+
+        Args:
+            portfolio_id (int): معرف المشروع
+            identities (list): [(نوع الهوية، القيمة)]
+
+        Returns:
+            bool: False مؤكدة داخل هذه العملية، True تحتاج تأكيدًا من قاعدة البيانات
+        """
+        if not self.enabled:
+            return True
+
+        keys = [identity_key(portfolio_id, kind, value) for kind, value in identities]
+        with self._lock:
+            self._rotate(time.time())
+            for _, bucket in reversed(self._buckets):
+                if any(key in bucket for key in keys):
+                    self.counters['probable_hits'] += 1
+                    return True
+            self.counters['misses'] += 1
+            return False
+
+    def remember(self, portfolio_id, identities):
+        """تسجيل أن هذه الهويات شاهدت المشروع الآن"""
+        if not self.enabled:
+            return
+
+        keys = [identity_key(portfolio_id, kind, value) for kind, value in identities]
+        now = time.time()
+        with self._lock:
+            self._rotate(now)
+            if not self._buckets or now - self._buckets[-1][0] >= self.bucket_seconds:
+                self._buckets.append((now, set()))
+            bucket = self._buckets[-1][1]
+            before = len(bucket)
+            bucket.update(keys)
+            self._size += len(bucket) - before
+            self.counters['remembered'] += 1
+
+            while self._size > self.max_keys and len(self._buckets) > 1:
+                _, keys = self._buckets.popleft()
+                self._size -= len(keys)
+                self.counters['early_drops'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._size = 0
+
+    def get_stats(self):
+        """حالة الذاكرة للمراقبة"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['buckets'] = len(self._buckets)
+            stats['keys'] = self._size
+        stats['enabled'] = self.enabled
+        stats['window_hours'] = self.window / 3600
+        stats['max_keys'] = self.max_keys
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+view_dedup = ViewDedup()
+
+
+def init_view_dedup(app):
+    """
+    تهيئة ذاكرة منع تكرار المشاهدات
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('VIEW_DEDUP_ENABLED', os.environ.get('VIEW_DEDUP_ENABLED', '1') != '0')
+    app.config.setdefault('VIEW_DEDUP_WINDOW_HOURS', float(os.environ.get('VIEW_DEDUP_WINDOW_HOURS', 24)))
+    app.config.setdefault('VIEW_DEDUP_BUCKETS', int(os.environ.get('VIEW_DEDUP_BUCKETS', 24)))
+    app.config.setdefault('VIEW_DEDUP_MAX_KEYS', int(os.environ.get('VIEW_DEDUP_MAX_KEYS', 500000)))
+
+    view_dedup.init_app(app)
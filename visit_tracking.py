@@ -0,0 +1,292 @@
+"""
+خط معالجة تتبع الزوار خارج دورة الطلب
+يضع حدث الزيارة في طابور محدود الحجم داخل العملية ويعود فورًا، بينما يقوم خيط خلفي
+بكتابة سجلات Visitor و PageVisit على دفعات داخل معاملة واحدة لكل دفعة؛ إذا فشلت الدفعة تعاد كتابة
+أحداثها حدثًا حدثًا فلا يضيع إلا الحدث المعطوب
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from database import db
+
+# سياسات التعامل مع امتلاء الطابور
+OVERFLOW_DROP_NEWEST = 'drop_newest'  # تجاهل الحدث الجديد
+OVERFLOW_DROP_OLDEST = 'drop_oldest'  # إزالة أقدم حدث في الطابور لإفساح المجال للجديد
+OVERFLOW_INLINE = 'inline'  # كتابة الحدث مباشرة داخل الطلب (السلوك القديم)
+OVERFLOW_POLICIES = (OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, OVERFLOW_INLINE)
+
+
+class VisitTracker:
+    """طابور أحداث الزيارة مع خيط كتابة خلفي يعمل على دفعات"""
+
+    def __init__(self, max_queue_size=5000, batch_size=200, flush_interval=2.0,
+                 overflow_policy=OVERFLOW_DROP_NEWEST):
+        self.app = None
+        self.enabled = True
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self.counters = {
+            'enqueued': 0,  # الأحداث المقبولة في الطابور
+            'dropped': 0,  # الأحداث المتجاهلة بسبب امتلاء الطابور
+            'inline_writes': 0,  # الأحداث المكتوبة مباشرة داخل الطلب
+            'written': 0,  # الأحداث المكتوبة بنجاح في قاعدة البيانات
+            'failed': 0,  # الأحداث التي فشلت كتابتها
+            'new_visitors': 0,  # الزوار الجدد المنشأون
+            'batches': 0,  # عدد الدفعات المحفوظة
+            'failed_batches': 0,  # عدد الدفعات التي فشل حفظها
+            'retried': 0,  # أحداث الدفعات الفاشلة التي كتبت عند إعادة المحاولة حدثًا حدثًا
+            'max_queue_depth': 0  # أقصى عمق وصل إليه الطابور
+        }
+        self.last_flush_at = None
+        self.last_error = None
+
+    def init_app(self, app):
+        """ربط المتتبع بتطبيق Flask وقراءة الإعدادات"""
+        self.app = app
+        self.enabled = app.config['VISIT_TRACKING_ASYNC']
+        self.batch_size = app.config['VISIT_TRACKING_BATCH_SIZE']
+        self.flush_interval = app.config['VISIT_TRACKING_FLUSH_INTERVAL']
+
+        overflow_policy = app.config['VISIT_TRACKING_OVERFLOW_POLICY']
+        if overflow_policy not in OVERFLOW_POLICIES:
+            logging.warning(f"Unknown visit tracking overflow policy '{overflow_policy}', using '{OVERFLOW_DROP_NEWEST}'")
+            overflow_policy = OVERFLOW_DROP_NEWEST
+        self.overflow_policy = overflow_policy
+
+        max_queue_size = app.config['VISIT_TRACKING_QUEUE_SIZE']
+        if max_queue_size != self.max_queue_size:
+            self.max_queue_size = max_queue_size
+            self._queue = queue.Queue(maxsize=max_queue_size)
+
+    def _increment(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def track(self, request):
+        """تسجيل زيارة الطلب الحالي: وضعها في الطابور أو كتابتها مباشرة إذا كان التتبع غير المتزامن معطلاً"""
+        from analytics import build_visit_event, track_visitor, track_page_visit
+
+        if not self.enabled:
+            visitor = track_visitor(request)
+            track_page_visit(visitor, request)
+            return True
+
+        return self.enqueue(build_visit_event(request))
+
+    def enqueue(self, event):
+        """
+        إضافة حدث زيارة إلى الطابور دون انتظار
+
+        Returns:
+            bool: True إذا تم قبول الحدث (في الطابور أو بالكتابة المباشرة)، False إذا تم تجاهله
+        """
+        self._ensure_worker()
+
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            if self.overflow_policy == OVERFLOW_INLINE:
+                self._increment('inline_writes')
+                self._write_batch([event])
+                return True
+
+            if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                try:
+                    self._queue.get_nowait()
+                    self._increment('dropped')
+                    self._queue.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    self._increment('dropped')
+                    return False
+            else:
+                self._increment('dropped')
+                return False
+
+        depth = self._queue.qsize()
+        with self._counters_lock:
+            self.counters['enqueued'] += 1
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], depth)
+        return True
+
+    def _ensure_worker(self):
+        """تشغيل خيط الكتابة عند الحاجة (مع إعادة تشغيله بعد fork في عمال gunicorn)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop_event.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='visit-tracking-writer')
+            self._thread.daemon = True  # جعل الخيط daemon حتى يتوقف عند إيقاف التطبيق
+            self._thread.start()
+            logging.info("Started visit tracking writer thread")
+
+    def _run(self):
+        """حلقة خيط الكتابة: تجميع الأحداث حتى حجم الدفعة أو انقضاء فترة التفريغ ثم حفظها"""
+        while not self._stop_event.is_set():
+            try:
+                batch = self._next_batch(timeout=self.flush_interval)
+                if batch:
+                    self._write_batch(batch)
+            except Exception as e:
+                logging.error(f"Error in visit tracking writer thread: {str(e)}")
+                time.sleep(1)
+
+    def _next_batch(self, timeout):
+        """انتظار أول حدث ثم سحب ما يتوفر من الطابور حتى حجم الدفعة"""
+        try:
+            first = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, events):
+        """كتابة دفعة من أحداث الزيارة في معاملة واحدة، وعند فشلها إعادة كتابة كل حدث في معاملة مستقلة"""
+        from analytics import notify_new_visitor
+
+        if self.app is None:
+            logging.error("Visit tracker is not bound to an application, dropping batch")
+            self._increment('failed', len(events))
+            return
+
+        with self._write_lock, self.app.app_context():
+            try:
+                new_visitors = self._commit_events(events)
+            except Exception as e:
+                db.session.rollback()
+                self._increment('failed_batches')
+                self.last_error = str(e)
+                if len(events) == 1:
+                    self._increment('failed')
+                    logging.error(f"Error writing visit tracking event: {str(e)}")
+                    return
+                logging.error(f"Error writing visit tracking batch of {len(events)} events, "
+                              f"retrying one event at a time: {str(e)}")
+                new_visitors = self._retry_events(events)
+            else:
+                self._increment('written', len(events))
+                self._increment('batches')
+
+            self._increment('new_visitors', len(new_visitors))
+            self.last_flush_at = datetime.now()
+
+            # إرسال الإشعارات بعد نجاح الحفظ فقط
+            for visitor, event in new_visitors:
+                notify_new_visitor(visitor, event)
+
+    def _commit_events(self, events):
+        """
+        كتابة الأحداث وحفظها في معاملة واحدة (يستدعى داخل سياق التطبيق)
+
+        Returns:
+            list: (الزائر، الحدث) لكل زائر جديد
+        """
+        from analytics import upsert_visitor, add_page_visit
+
+        new_visitors = []
+        for event in events:
+            visitor, is_new_visitor = upsert_visitor(event)
+            add_page_visit(visitor, event)
+            if is_new_visitor:
+                new_visitors.append((visitor, event))
+        db.session.commit()
+        return new_visitors
+
+    def _retry_events(self, events):
+        """كتابة كل حدث من دفعة فاشلة في معاملة مستقلة حتى لا يضيع إلا الحدث المعطوب"""
+        new_visitors = []
+        for event in events:
+            try:
+                new_visitors.extend(self._commit_events([event]))
+            except Exception as e:
+                db.session.rollback()
+                self._increment('failed')
+                self.last_error = str(e)
+                logging.error(f"Error writing visit tracking event for {event.get('page_url')}: {str(e)}")
+            else:
+                self._increment('written')
+                self._increment('retried')
+        return new_visitors
+
+    def flush(self):
+        """كتابة كل الأحداث الموجودة حاليًا في الطابور بشكل متزامن"""
+        while True:
+            batch = self._next_batch(timeout=0.01)
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def stop(self, flush=True):
+        """إيقاف خيط الكتابة مع تفريغ ما تبقى في الطابور"""
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval + 1)
+        if flush:
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing visit tracking queue on shutdown: {str(e)}")
+
+    def get_stats(self):
+        """إحصائيات الطابور للمراقبة"""
+        with self._counters_lock:
+            stats = dict(self.counters)
+        stats.update({
+            'enabled': self.enabled,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue_size,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'overflow_policy': self.overflow_policy,
+            'writer_alive': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+            'last_flush_at': self.last_flush_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_flush_at else None,
+            'last_error': self.last_error
+        })
+        return stats
+
+
+# نسخة مشتركة على مستوى العملية
+visit_tracker = VisitTracker()
+
+
+def init_visit_tracking(app):
+    """
+    تهيئة خط معالجة تتبع الزوار
+
+    Args:
+        app: تطبيق Flask
+    """
+    app.config.setdefault('VISIT_TRACKING_ASYNC', os.environ.get('VISIT_TRACKING_ASYNC', '1') != '0')
+    app.config.setdefault('VISIT_TRACKING_QUEUE_SIZE', int(os.environ.get('VISIT_TRACKING_QUEUE_SIZE', 5000)))
+    app.config.setdefault('VISIT_TRACKING_BATCH_SIZE', int(os.environ.get('VISIT_TRACKING_BATCH_SIZE', 200)))
+    app.config.setdefault('VISIT_TRACKING_FLUSH_INTERVAL', float(os.environ.get('VISIT_TRACKING_FLUSH_INTERVAL', 2.0)))
+    app.config.setdefault('VISIT_TRACKING_OVERFLOW_POLICY', os.environ.get('VISIT_TRACKING_OVERFLOW_POLICY', OVERFLOW_DROP_NEWEST))
+
+    visit_tracker.init_app(app)
+
+    # تفريغ الأحداث المتبقية عند إيقاف العملية
+    atexit.register(visit_tracker.stop)
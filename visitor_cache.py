@@ -0,0 +1,174 @@
+"""
+ذاكرة مؤقتة لهوية الزوار داخل العملية
+تربط معرف الجلسة وعنوان IP بمعرف الزائر مع مدة صلاحية (TTL) وحد أقصى للحجم (LRU)،
+حتى تتجاوز الزيارات المتكررة استعلامات البحث عن الزائر في جدول visitor
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import event, inspect
+
+from database import db
+from models import Visitor
+
+# أنواع مفاتيح البحث
+KEY_SESSION = 'session'
+KEY_IP = 'ip'
+
+
+class VisitorIdentityCache:
+    """ذاكرة LRU مع مدة صلاحية لربط (نوع المفتاح، القيمة) بمعرف الزائر"""
+
+    def __init__(self, max_size=10000, ttl=1800):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (kind, value) -> (visitor_id, expires_at)
+        self._keys_by_visitor = defaultdict(set)  # visitor_id -> {(kind, value)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, kind, value):
+        """الحصول على معرف الزائر المخزن أو None"""
+        key = (kind, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            visitor_id, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return visitor_id
+
+    def set(self, kind, value, visitor_id):
+        """تخزين معرف الزائر لمفتاح بحث"""
+        if not value or not visitor_id:
+            return
+
+        key = (kind, value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (visitor_id, time.monotonic() + self.ttl)
+            self._keys_by_visitor[visitor_id].add(key)
+
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate_visitor(self, visitor_id):
+        """إزالة كل المفاتيح المرتبطة بزائر (عند تغيير أو حذف سجله)"""
+        with self._lock:
+            keys = self._keys_by_visitor.pop(visitor_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            if keys:
+                self.invalidations += 1
+
+    def mark_stale(self, visitor_id):
+        """تسجيل إدخال لم يعد يطابق قاعدة البيانات وإزالته"""
+        with self._lock:
+            self.stale += 1
+        self.invalidate_visitor(visitor_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_visitor.clear()
+
+    def _remove(self, key):
+        visitor_id, _ = self._entries.pop(key)
+        keys = self._keys_by_visitor.get(visitor_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_visitor[visitor_id]
+
+    def get_stats(self):
+        """إحصائيات الإصابة والإخفاق لتحديد الحجم المناسب"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0,
+                'stale': self.stale,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+# نسخة مشتركة على مستوى العملية
+visitor_identity_cache = VisitorIdentityCache(
+    max_size=int(os.environ.get('VISITOR_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('VISITOR_CACHE_TTL', 1800))
+)
+
+
+def _find_visitor(kind, value, column):
+    if not value:
+        return None
+
+    visitor_id = visitor_identity_cache.get(kind, value)
+    if visitor_id is not None:
+        visitor = db.session.get(Visitor, visitor_id)
+        if visitor is not None and getattr(visitor, column.key) == value:
+            return visitor
+        # السجل حُذف أو تغير من عامل آخر
+        visitor_identity_cache.mark_stale(visitor_id)
+
+    visitor = Visitor.query.filter(column == value).first()
+    if visitor:
+        visitor_identity_cache.set(kind, value, visitor.id)
+    return visitor
+
+
+def find_visitor_by_session(session_id):
+    """البحث عن زائر بمعرف الجلسة مع استخدام الذاكرة المؤقتة"""
+    return _find_visitor(KEY_SESSION, session_id, Visitor.session_id)
+
+
+def find_visitor_by_ip(ip_address):
+    """البحث عن زائر بعنوان IP مع استخدام الذاكرة المؤقتة"""
+    return _find_visitor(KEY_IP, ip_address, Visitor.ip_address)
+
+
+def remember_visitor(visitor, session_id=None, ip_address=None):
+    """تخزين هوية زائر منشأ حديثًا حتى تصيب الزيارة التالية الذاكرة المؤقتة"""
+    if session_id:
+        visitor_identity_cache.set(KEY_SESSION, session_id, visitor.id)
+    if ip_address:
+        visitor_identity_cache.set(KEY_IP, ip_address, visitor.id)
+
+
+@event.listens_for(Visitor, 'after_update')
+def _invalidate_on_identity_change(mapper, connection, target):
+    """إبطال مفاتيح الزائر عند تغيير معرف الجلسة أو عنوان IP"""
+    state = inspect(target)
+    if state.attrs.session_id.history.has_changes() or state.attrs.ip_address.history.has_changes():
+        visitor_identity_cache.invalidate_visitor(target.id)
+
+
+@event.listens_for(Visitor, 'after_delete')
+def _invalidate_on_delete(mapper, connection, target):
+    visitor_identity_cache.invalidate_visitor(target.id)